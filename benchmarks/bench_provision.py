@@ -0,0 +1,279 @@
+"""Time the provisioning paths of both scripts against the in-process EC2 stand-in
+
+Runs, for each scenario, the same engine the script uses and reports the
+wall-clock time, the API calls made per action, and when each phase (the
+span from the first to the last call of its API action) started and ended::
+
+    python benchmarks/bench_provision.py
+    python benchmarks/bench_provision.py --scenario sql --throttle-rate 0.1 --json results.json
+
+Real-world timings (about 5 s to create a volume, 2 s to attach, 100 ms per
+API call and the scripts' 2 s poll interval) are multiplied by ``--scale``
+so a full run takes seconds. The ``*-legacy`` scenarios replay the original
+one-volume-at-a-time loops as a baseline. The ``rollback`` scenarios start
+from a batch of ``--volumes`` attached volumes and delete it.
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from ebs_core import waiter  # noqa: E402
+from ebs_core.api import ResilientClient  # noqa: E402
+from ebs_core.devices import DeviceAllocator, candidate_device_names  # noqa: E402
+from ebs_core.fake_ec2 import FakeEC2  # noqa: E402
+from ebs_core.pipeline import Pipeline  # noqa: E402
+from ebs_core.rollback import find_batch_volumes, rollback  # noqa: E402
+
+# Seconds, before scaling
+REAL_CREATE_DELAY = 5.0
+REAL_ATTACH_DELAY = 2.0
+REAL_LATENCY = 0.1
+REAL_POLL_INTERVAL = 2.0
+
+PHASES = (
+    ('discovery', 'describe_instances'),
+    ('create', 'create_volume'),
+    ('wait', 'describe_volumes'),
+    ('attach', 'attach_volume'),
+    ('detach', 'detach_volume'),
+    ('delete', 'delete_volume'),
+)
+
+
+def load_sql_script():
+    """Import create-sql-ebs.py, whose file name is not a valid module name"""
+    if 'create_sql_ebs' not in sys.modules:
+        spec = importlib.util.spec_from_file_location('create_sql_ebs', os.path.join(REPO_ROOT, 'create-sql-ebs.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules['create_sql_ebs'] = module
+    return sys.modules['create_sql_ebs']
+
+
+def sql_layout(module):
+    """Return the default SQL layout as the script's prompted volume configurations"""
+    return [
+        {
+            'name': name,
+            'disk_count': defaults['disks'],
+            'size_per_disk': defaults['size'],
+            'volume_type': defaults['type'],
+            'iops_per_disk': defaults['iops'],
+            'throughput_per_disk': None
+        }
+        for name, defaults in module.SQL_VOLUME_DEFAULTS.items()
+    ]
+
+
+def legacy_attach(ec2, instance_id, volume_id, poll_interval):
+    """The original per-volume wait, describe_instances and attach"""
+    while ec2.describe_volumes(VolumeIds=[volume_id])['Volumes'][0]['State'] != 'available':
+        time.sleep(poll_interval)
+    instance = ec2.describe_instances(InstanceIds=[instance_id])['Reservations'][0]['Instances'][0]
+    used = {instance['RootDeviceName']} | {m['DeviceName'] for m in instance['BlockDeviceMappings']}
+    # The original scanned /dev/xvdf-z and then fell back to /dev/sda-z, the order candidate_device_names yields
+    device = next((name for name in candidate_device_names() if name not in used), None)
+    if device is None:
+        raise Exception("No available device names")
+    ec2.attach_volume(InstanceId=instance_id, VolumeId=volume_id, Device=device)
+
+
+def legacy_create(ec2, az, name, size, volume_type, iops):
+    params = {'AvailabilityZone': az, 'Size': size, 'VolumeType': volume_type, 'Encrypted': True}
+    if iops:
+        params['Iops'] = iops
+    volume_id = ec2.create_volume(**params)['VolumeId']
+    ec2.create_tags(Resources=[volume_id], Tags=[{'Key': 'Name', 'Value': name}])
+    return volume_id
+
+
+def run_createebs_legacy(fake, instance_id, az, options):
+    for i in range(options.volumes):
+        volume_id = legacy_create(fake, az, f"Bench-{i+1}", 100, 'gp3', None)
+        legacy_attach(fake, instance_id, volume_id, options.poll_interval)
+
+
+def run_createebs(fake, instance_id, az, options):
+    ec2 = ResilientClient(fake)
+    specs = [{'name': f"Bench-{i+1}", 'size': 100, 'volume_type': 'gp3'} for i in range(options.volumes)]
+    results = Pipeline(ec2, instance_id, az, DeviceAllocator(ec2, instance_id)).run(specs)
+    failed = [r for r in results if r['status'] != 'attached']
+    if failed:
+        raise Exception(f"{len(failed)} volume(s) not attached")
+
+
+def run_sql_legacy(fake, instance_id, az, options):
+    module = load_sql_script()
+    created = []
+    for config in sql_layout(module):
+        for n in range(1, config['disk_count'] + 1):
+            name = f"{config['name']}-Disk{n}" if config['disk_count'] > 1 else config['name']
+            created.append(legacy_create(fake, az, name, config['size_per_disk'],
+                                         config['volume_type'], config['iops_per_disk']))
+    for volume_id in created:
+        legacy_attach(fake, instance_id, volume_id, options.poll_interval)
+
+
+def run_sql(fake, instance_id, az, options):
+    module = load_sql_script()
+    ec2 = ResilientClient(fake)
+    module.provision_volume_sets(ec2, instance_id, az, DeviceAllocator(ec2, instance_id), sql_layout(module), {})
+
+
+def seed_batch(fake, instance_id, options):
+    """Attach a batch of ``--volumes`` tagged volumes for the rollback scenarios to delete"""
+    for i, device in zip(range(options.volumes), candidate_device_names()):
+        fake.add_volume(instance_id, device, tags={'Name': f"Bench-{i+1}", 'BatchId': 'bench'})
+
+
+def run_rollback_legacy(fake, instance_id, az, options):
+    """Detach, wait for and delete one volume at a time, as done by hand in the console"""
+    volumes = fake.describe_volumes(Filters=[{'Name': 'tag:BatchId', 'Values': ['bench']}])['Volumes']
+    for volume in volumes:
+        fake.detach_volume(VolumeId=volume['VolumeId'])
+        while fake.describe_volumes(VolumeIds=[volume['VolumeId']])['Volumes'][0]['State'] != 'available':
+            time.sleep(options.poll_interval)
+        fake.delete_volume(VolumeId=volume['VolumeId'])
+
+
+def run_rollback(fake, instance_id, az, options):
+    ec2 = ResilientClient(fake)
+    result = rollback(ec2, find_batch_volumes(ec2, 'bench'))
+    if result['failed']:
+        raise Exception(f"{len(result['failed'])} volume(s) not deleted")
+
+
+SCENARIOS = {
+    'createebs-legacy': run_createebs_legacy,
+    'createebs': run_createebs,
+    'sql-legacy': run_sql_legacy,
+    'sql': run_sql,
+    'rollback-legacy': run_rollback_legacy,
+    'rollback': run_rollback,
+}
+# Scenarios that start from existing volumes, set up before the clock starts
+SETUPS = {
+    'rollback-legacy': seed_batch,
+    'rollback': seed_batch,
+}
+
+
+def phase_windows(fake, started):
+    """Return ``{phase: (start, end, calls)}`` relative to ``started``"""
+    windows = {}
+    for phase, action in PHASES:
+        spans = [(s, e) for a, s, e in fake.call_log if a == action]
+        if spans:
+            windows[phase] = (
+                round(min(s for s, _ in spans) - started, 3),
+                round(max(e for _, e in spans) - started, 3),
+                len(spans)
+            )
+    return windows
+
+
+def run_scenario(name, options):
+    fake = FakeEC2(
+        latency=REAL_LATENCY * options.scale,
+        create_delay=REAL_CREATE_DELAY * options.scale,
+        attach_delay=REAL_ATTACH_DELAY * options.scale,
+        throttle_rate=options.throttle_rate,
+        error_rate=options.error_rate,
+        seed=options.seed
+    )
+    instance_id = fake.add_instance(name='bench-sql-01')
+    az = fake.instances[instance_id]['Placement']['AvailabilityZone']
+    if name in SETUPS:
+        SETUPS[name](fake, instance_id, options)
+
+    existing = set(fake.volumes)
+    started = time.monotonic()
+    error = None
+    # Scenario output is the scripts' own progress lines; keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            SCENARIOS[name](fake, instance_id, az, options)
+        except Exception as e:
+            error = str(e)
+    elapsed = time.monotonic() - started
+    # Count from the stand-in so a failed run still shows how far it got
+    attached = sum(
+        1 for volume_id, volume in fake.volumes.items()
+        if volume_id not in existing and volume['Attachments']
+    )
+    deleted = len(existing - set(fake.volumes))
+
+    return {
+        'scenario': name,
+        'elapsed_seconds': round(elapsed, 3),
+        'volumes': attached,
+        'deleted': deleted,
+        'error': error,
+        'api_calls': dict(fake.calls),
+        'throttled': dict(fake.throttled),
+        'phases': phase_windows(fake, started)
+    }
+
+
+def print_result(result):
+    status = f"FAILED: {result['error']}" if result['error'] else f"{result['volumes']} volume(s)"
+    if result['deleted']:
+        status += f", {result['deleted']} deleted"
+    print(f"\n{result['scenario']}: {result['elapsed_seconds']:.2f}s ({status})")
+    calls = ', '.join(f"{action}={count}" for action, count in sorted(result['api_calls'].items()))
+    print(f"  API calls: {sum(result['api_calls'].values())} ({calls})")
+    if result['throttled']:
+        print(f"  Throttled: {sum(result['throttled'].values())}")
+    print(f"  {'phase':<10} {'start':>8} {'end':>8} {'calls':>6}")
+    for phase, (start, end, calls) in result['phases'].items():
+        print(f"  {phase:<10} {start:>8.2f} {end:>8.2f} {calls:>6}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark EBS provisioning against a local EC2 stand-in")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="Scenario to run (repeatable, default: all)")
+    parser.add_argument('--volumes', type=int, default=28, help="Volumes in the createebs batch (default: 28)")
+    parser.add_argument('--scale', type=float, default=0.1,
+                        help="Multiplier applied to real-world delays (default: 0.1)")
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help="Chance that any call is throttled (default: 0)")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Chance that a new volume ends up in the error state (default: 0)")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed for injected faults")
+    parser.add_argument('--json', metavar='PATH', help="Also write the results as JSON")
+    return parser.parse_args()
+
+
+def main():
+    options = parse_args()
+    options.poll_interval = REAL_POLL_INTERVAL * options.scale
+    # Import the script up front so its import time is not charged to the first scenario
+    load_sql_script()
+    # Scale the batched waiter's backoff the same way as the legacy poll interval
+    waiter.BASE_DELAY *= options.scale
+    waiter.MAX_DELAY *= options.scale
+
+    results = [run_scenario(name, options) for name in options.scenario or SCENARIOS]
+    for result in results:
+        print_result(result)
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    # A scenario that did not finish makes the comparison meaningless
+    failed = [result['scenario'] for result in results if result['error']]
+    if failed:
+        print(f"\nScenarios that did not finish: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
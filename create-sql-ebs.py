@@ -1,161 +1,230 @@
-import boto3
-import time
-
-def list_instances(ec2):
-    instances = []
-    for reservation in ec2.describe_instances()['Reservations']:
-        for inst in reservation['Instances']:
-            instances.append(inst)
-    return instances
-
-def get_used_device_names(ec2, instance_id):
-    """Get list of device names already in use on the instance"""
-    used_devices = set()
-    
-    # Get instance details including block device mappings
-    response = ec2.describe_instances(InstanceIds=[instance_id])
-    instance = response['Reservations'][0]['Instances'][0]
-    
-    # Check root device
-    if 'RootDeviceName' in instance:
-        used_devices.add(instance['RootDeviceName'])
-    
-    # Check attached volumes
-    if 'BlockDeviceMappings' in instance:
-        for mapping in instance['BlockDeviceMappings']:
-            used_devices.add(mapping['DeviceName'])
-    
-    return used_devices
+import argparse
+import asyncio
+import os
+import sys
 
-def find_next_available_device(ec2, instance_id):
-    """Find the next available device name for volume attachment"""
-    used_devices = get_used_device_names(ec2, instance_id)
-    
-    # Start from /dev/xvdf and find first available
-    for i in range(26):  # a-z
-        device_letter = chr(102 + i)  # Start from 'f' (102)
-        device_name = f"/dev/xvd{device_letter}"
-        
-        if device_name not in used_devices:
-            return device_name
-    
-    # If all xvd* are taken, try sd* devices
-    for i in range(26):
-        device_letter = chr(97 + i)  # Start from 'a' (97)
-        device_name = f"/dev/sd{device_letter}"
-        
-        if device_name not in used_devices:
-            return device_name
-    
-    raise Exception("No available device names found")
-
-def create_volume(ec2, az, volume_name, size, volume_type='gp3', iops=None, throughput=None):
-    """Create and return a volume with the specified parameters"""
-    params = {
-        'AvailabilityZone': az,
-        'Size': size,
-        'VolumeType': volume_type,
-        'Encrypted': True
-    }
-    if iops:
-        params['Iops'] = iops
-    if throughput:
-        params['Throughput'] = throughput
+from ebs_core.aio import provision_raid_sets
+from ebs_core.api import DEFAULT_API_BUDGET, BudgetedClient, api_budget
+from ebs_core.cache import instance_source
+from ebs_core.catalog import report_bandwidth
+from ebs_core.cli import (add_cache_arguments, add_discovery_arguments, add_fanout_arguments,
+                          add_manifest_arguments, add_metrics_arguments, add_preflight_arguments,
+                          add_resume_arguments, add_rollback_arguments, add_tag_arguments)
+from ebs_core.clients import build_clients, configure_pool, target_client
+from ebs_core.devices import DeviceAllocator, get_used_device_names
+from ebs_core.discovery import select_profile, stream_and_select, stream_and_select_many
+from ebs_core.fleet import print_raid_summary, provision_fleet, volume_specs, write_report
+from ebs_core.fanout import discover, fan_out, merge_reports, target_for
+from ebs_core.journal import JournalError, open_journal, print_resume_hint, resume_groups
+from ebs_core.manifest import run_manifest_command
+from ebs_core.metrics import finish_run, mark_ready, phase, timed
+from ebs_core.pipeline import log, volume_params
+from ebs_core.planner import DEFAULT_MAX_DISKS, format_layout, parse_target, plan_layouts, summarize_layout
+from ebs_core.preflight import SIZE_LIMITS, PreflightError, preflight, preflight_groups, print_problems
+from ebs_core.raidscript import DEFAULT_TOOLS, LINUX_TOOLS, WINDOWS_TOOLS, write_raid_scripts
+from ebs_core.retune import (MODIFIABLE_TYPES, RetuneError, check_modifiable, plan_retune, raid_sets_on, retune,
+                             tag_value, uniform_layout)
+from ebs_core.rollback import run_rollback_command
+from ebs_core.tags import BATCH_KEY, RAID_SET_KEY, batch_tags, new_batch_id
+
+SCRIPT = 'create-sql-ebs.py'
+
+# Define SQL volume configurations with defaults (name, disk_count, size_per_disk, volume_type, iops_per_disk)
+SQL_VOLUME_DEFAULTS = {
+    "SQL-Data": {"disks": 4, "size": 250, "type": "gp3", "iops": 3000},
+    "SQL-Log": {"disks": 2, "size": 100, "type": "gp3", "iops": 3000},
+    "SQL-Temp": {"disks": 2, "size": 100, "type": "gp3", "iops": 3000},
+    "SQL-CommonFiles": {"disks": 1, "size": 50, "type": "gp3", "iops": 3000},
+    "SQL-Backup": {"disks": 2, "size": 500, "type": "gp3", "iops": 3000}
+}
+
+def create_volume(ec2, az, volume_name, size, volume_type='gp3', iops=None, throughput=None, tags=None,
+                  client_token=None):
+    """Create and return a volume with the specified parameters, tagged in the same request"""
+    params = volume_params(az, size, volume_type, iops, throughput, volume_name, tags)
+    if client_token:
+        params['ClientToken'] = client_token
 
     vol = ec2.create_volume(**params)
     volume_id = vol['VolumeId']
     
-    # Set volume name tag
-    ec2.create_tags(
-        Resources=[volume_id],
-        Tags=[{'Key': 'Name', 'Value': volume_name}]
-    )
-    
-    print(f"Created volume {volume_id} with name '{volume_name}' ({size} GiB)")
+    log(f"Created volume {volume_id} with name '{volume_name}' ({size} GiB)")
     return volume_id
 
-def wait_for_volume_available(ec2, volume_id):
-    """Wait for volume to become available"""
-    print("Waiting for volume to become available...")
-    while True:
-        desc = ec2.describe_volumes(VolumeIds=[volume_id])
-        state = desc['Volumes'][0]['State']
-        if state == 'available':
-            break
-        time.sleep(2)
+def sql_default_volume_sets():
+    """Return SQL_VOLUME_DEFAULTS as manifest volume sets"""
+    return [{'name': name, **defaults} for name, defaults in SQL_VOLUME_DEFAULTS.items()]
 
-def main():
-    # List available profiles
-    session = boto3.Session()
-    profiles = session.available_profiles
-    if not profiles:
-        print("No AWS profiles found. Please configure your AWS credentials.")
-        return
+def print_created_disks(disks, batch_id):
+    """List the volumes a stopped run created and how to remove them"""
+    print("Volumes created so far:")
+    for disk in disks:
+        if disk['volume_id']:
+            print(f"  - {disk['name']}: {disk['volume_id']} ({disk['device'] or 'not attached'})")
+    print(f"They are tagged {BATCH_KEY}={batch_id}; "
+          f"python {SCRIPT} --rollback {batch_id} deletes them.")
 
-    print("\nAvailable AWS Profiles:")
-    for idx, prof in enumerate(profiles):
-        print(f"[{idx+1}] {prof}")
+def provision_volume_sets(ec2, instance_id, az, allocator, volume_configs, common_tags, journal=None):
+    """Create, wait for and attach every disk of ``volume_configs`` concurrently
 
-    while True:
-        try:
-            prof_idx = int(input(f"Select profile (1-{len(profiles)}): "))
-            if 1 <= prof_idx <= len(profiles):
-                profile = profiles[prof_idx-1]
-                break
-        except ValueError:
-            pass
-        print("Invalid selection.")
+    Each RAID set's disks attach in disk order. Ctrl-C, or any disk
+    failing, stops every disk cleanly and lists the volumes created so far
+    before exiting. With a
+    ``journal`` every step is recorded, and disks it already has are picked
+    up where they were left. A disk counts as attached once EC2 reports the
+    attachment, and one EC2 drops is attached again on another device name.
+    Returns ``(volume_id, disk_name, raid_set, device, time_to_attached)``
+    for every created disk.
+    """
+    print(f"\n=== Creating SQL Server Volumes ===")
+    raid_sets = []
+    for config in volume_configs:
+        vol_name = config['name']
+        disk_count = config['disk_count']
+        
+        print(f"Creating {disk_count} disk(s) for {vol_name}...")
+        
+        raid_set = []
+        for disk_num in range(1, disk_count + 1):
+            if disk_count > 1:
+                disk_name = f"{vol_name}-Disk{disk_num}"
+            else:
+                disk_name = vol_name
+            raid_set.append({'name': disk_name, 'raid_set': vol_name, 'config': config, 'token': None})
+        raid_sets.append(raid_set)
+    specs = [disk for raid_set in raid_sets for disk in raid_set]
 
-    # Use the selected profile
-    session = boto3.Session(profile_name=profile)
-    ec2 = session.client('ec2')
+    # Disks the journal shows as attached are reported as they are and not provisioned again
+    done = {}
+    if journal:
+        tokens = [journal.planned(instance_id, disk['name'], disk['raid_set']) for disk in specs]
+        for disk, token in zip(specs, journal.reconcile(ec2, tokens)):
+            disk['token'] = token
+            state = journal.disk(token)
+            if state['status'] == 'attached':
+                log(f"{disk['name']} is already attached ({state['volume_id']} on {state['device']})")
+                done[disk['name']] = {'name': disk['name'], 'volume_id': state['volume_id'],
+                                      'device': state['device'], 'status': 'attached', 'time_to_attached': None}
+    pending_sets = [[disk for disk in raid_set if disk['name'] not in done] for raid_set in raid_sets]
 
-    instances = list_instances(ec2)
-    if not instances:
-        print("No EC2 instances found.")
-        return
+    def create(disk):
+        if disk['token']:
+            state = journal.disk(disk['token'])
+            if state['status'] == 'failed' and state['volume_id']:
+                raise Exception(f"{disk['name']}: {state['error']}")
+            if state['volume_id']:
+                return state['volume_id']
+        config = disk['config']
+        volume_id = create_volume(
+            ec2, 
+            az, 
+            disk['name'], 
+            config['size_per_disk'], 
+            config['volume_type'], 
+            config['iops_per_disk'], 
+            config['throughput_per_disk'],
+            {**common_tags, RAID_SET_KEY: disk['raid_set']},
+            disk['token']
+        )
+        if disk['token']:
+            journal.created(disk['token'], volume_id)
+        return volume_id
+
+    def attach(disk, volume_id):
+        if disk['token']:
+            journal.available(disk['token'])
+        device = allocator.attach(
+            volume_id,
+            lambda device_name: log(f"Attaching {disk['name']} ({volume_id}) to {instance_id} as {device_name}")
+        )
+        if disk['token']:
+            journal.attaching(disk['token'], device)
+        return device
+
+    def attached(disk, volume_id, device):
+        if disk['token']:
+            journal.attached(disk['token'], device)
+
+    disks = []
+    try:
+        if any(pending_sets):
+            asyncio.run(provision_raid_sets(ec2, [s for s in pending_sets if s], create, attach, disks,
+                                            instance_id=instance_id, on_attached=attached))
+    except KeyboardInterrupt:
+        print("\nInterrupted.")
+        print_created_disks(disks, common_tags.get(BATCH_KEY))
+        sys.exit(130)
+    except Exception as e:
+        # Every other disk has been stopped by now; say what is left behind rather than a bare traceback
+        print(f"\nProvisioning failed: {e}")
+        print_created_disks(disks, common_tags.get(BATCH_KEY))
+        sys.exit(1)
 
-    print("\nAvailable EC2 Instances:")
-    for idx, inst in enumerate(instances):
-        name = next((tag['Value'] for tag in inst.get('Tags', []) if tag['Key'] == 'Name'), 'No Name')
-        print(f"[{idx+1}] InstanceId: {inst['InstanceId']} | Name: {name}")
+    records = {**done, **{disk['name']: disk for disk in disks}}
+    return [(records[spec['name']]['volume_id'], spec['name'], spec['raid_set'], records[spec['name']]['device'],
+             records[spec['name']]['time_to_attached'])
+            for spec in specs]
 
-    while True:
+def prompt_planned_layout(vol_name):
+    """Plan a volume set from a performance target; returns the chosen layout, or None to configure it manually"""
+    target_input = input(
+        f"Performance target for {vol_name} (e.g. 12000 iops 500 MBps 1000 GiB) or Enter to configure manually: "
+    ).strip()
+    while target_input:
         try:
-            selection = int(input(f"\nSelect instance (1-{len(instances)}): "))
-            if 1 <= selection <= len(instances):
-                selected = instances[selection-1]
-                break
-        except ValueError:
-            pass
-        print("Invalid selection.")
+            target = parse_target(target_input)
+        except ValueError as e:
+            print(e)
+            target_input = input("Target (or Enter to configure manually): ").strip()
+            continue
 
-    instance_id = selected['InstanceId']
-    az = selected['Placement']['AvailabilityZone']
-    print(f"\nSelected Instance: {instance_id} in AZ: {az}")
+        layouts = plan_layouts(target)[:3]
+        if not layouts:
+            print(f"No gp3 or io2 layout of up to {DEFAULT_MAX_DISKS} disks meets that target.")
+            target_input = input("Target (or Enter to configure manually): ").strip()
+            continue
+        print("Cheapest layouts:")
+        for idx, layout in enumerate(layouts):
+            print(f"[{idx+1}] {format_layout(layout)}")
 
-    # Count initial volumes attached to the instance
-    initial_volume_count = len(get_used_device_names(ec2, instance_id))
+        choice = input(
+            f"Select layout (1-{len(layouts)}) [default: 1], type another target, or m to configure manually: "
+        ).strip()
+        if not choice:
+            return layouts[0]
+        if choice.lower() == 'm':
+            return None
+        if choice.isdigit() and 1 <= int(choice) <= len(layouts):
+            return layouts[int(choice)-1]
+        # Anything else is a new target; re-plan with it
+        target_input = choice
+    return None
 
+def prompt_volume_configs():
+    """Prompt for each SQL volume set and return the chosen configurations"""
     print("\n=== SQL Server Volume Configuration ===")
     print("This will create volumes for RAID striping: Data, Log, Temp, CommonFiles, and Backup")
     
-    # Define SQL volume configurations with defaults (name, disk_count, size_per_disk, volume_type, iops_per_disk)
-    sql_volume_defaults = {
-        "SQL-Data": {"disks": 4, "size": 250, "type": "gp3", "iops": 3000},
-        "SQL-Log": {"disks": 2, "size": 100, "type": "gp3", "iops": 3000},
-        "SQL-Temp": {"disks": 2, "size": 100, "type": "gp3", "iops": 3000},
-        "SQL-CommonFiles": {"disks": 1, "size": 50, "type": "gp3", "iops": 3000},
-        "SQL-Backup": {"disks": 2, "size": 500, "type": "gp3", "iops": 3000}
-    }
-
     print("\nConfigure each volume set (or press Enter for defaults):")
     volume_configs = []
     
-    for vol_name, defaults in sql_volume_defaults.items():
+    for vol_name, defaults in SQL_VOLUME_DEFAULTS.items():
         print(f"\n--- {vol_name} Configuration ---")
         print(f"Default: {defaults['disks']} disks x {defaults['size']} GiB each = {defaults['disks'] * defaults['size']} GiB total")
         
+        layout = prompt_planned_layout(vol_name)
+        if layout:
+            print(f"Configuration: {format_layout(layout)}")
+            volume_configs.append({
+                'name': vol_name,
+                'disk_count': layout['disks'],
+                'size_per_disk': layout['size'],
+                'volume_type': layout['volume_type'],
+                'iops_per_disk': layout['iops'],
+                'throughput_per_disk': layout['throughput']
+            })
+            continue
+
         # Get number of disks
         while True:
             try:
@@ -168,18 +237,6 @@ def main():
             except ValueError:
                 print("Invalid number. Please enter a valid disk count.")
         
-        # Get size per disk
-        while True:
-            try:
-                size_input = input(f"Size per disk (GiB) for {vol_name} [default: {defaults['size']}]: ").strip()
-                size_per_disk = int(size_input) if size_input else defaults['size']
-                if 1 <= size_per_disk <= 16384:
-                    break
-                else:
-                    print("Size must be between 1 and 16384 GiB.")
-            except ValueError:
-                print("Invalid size. Please enter a number.")
-        
         # Get volume type
         ebs_types = ["gp2", "gp3", "io1", "io2", "st1", "sc1"]
         print(f"Volume types: {', '.join([f'{i+1}={t}' for i, t in enumerate(ebs_types)])}")
@@ -200,6 +257,20 @@ def main():
             except ValueError:
                 print("Invalid selection.")
         
+        # Get size per disk, within the chosen type's limits whether or not the preflight runs
+        min_size, max_size = SIZE_LIMITS[volume_type]
+        while True:
+            try:
+                size_input = input(f"Size per disk (GiB) for {vol_name} ({min_size}-{max_size}) "
+                                   f"[default: {defaults['size']}]: ").strip()
+                size_per_disk = int(size_input) if size_input else defaults['size']
+                if min_size <= size_per_disk <= max_size:
+                    break
+                else:
+                    print(f"{volume_type} size must be between {min_size} and {max_size} GiB.")
+            except ValueError:
+                print("Invalid size. Please enter a number.")
+        
         # Get IOPS if applicable
         iops_per_disk = None
         if volume_type in ("io1", "io2", "gp3"):
@@ -221,8 +292,8 @@ def main():
             throughput_input = input(f"Throughput (MB/s) per disk for {vol_name} [default: auto]: ").strip()
             throughput_per_disk = int(throughput_input) if throughput_input else None
         
-        total_size = disk_count * size_per_disk
-        print(f"Configuration: {disk_count} x {size_per_disk} GiB {volume_type} disks = {total_size} GiB total")
+        layout = summarize_layout(volume_type, disk_count, size_per_disk, iops_per_disk, throughput_per_disk)
+        print(f"Configuration: {format_layout(layout)}")
         
         volume_configs.append({
             'name': vol_name,
@@ -233,66 +304,488 @@ def main():
             'throughput_per_disk': throughput_per_disk
         })
 
-    print(f"\n=== Creating SQL Server Volumes ===")
-    created_volumes = []
+    return volume_configs
 
-    # Create all volumes based on configurations
-    for config in volume_configs:
-        vol_name = config['name']
-        disk_count = config['disk_count']
-        
-        print(f"\nCreating {disk_count} disk(s) for {vol_name}...")
-        
-        for disk_num in range(1, disk_count + 1):
-            if disk_count > 1:
-                disk_name = f"{vol_name}-Disk{disk_num}"
-            else:
-                disk_name = vol_name
-            
-            volume_id = create_volume(
-                ec2, 
-                az, 
-                disk_name, 
-                config['size_per_disk'], 
-                config['volume_type'], 
-                config['iops_per_disk'], 
-                config['throughput_per_disk']
-            )
-            created_volumes.append((volume_id, disk_name, vol_name))
-
-    # Wait for all volumes to become available and attach them
-    for volume_id, disk_name, vol_type in created_volumes:
-        wait_for_volume_available(ec2, volume_id)
-        
-        # Find next available device name
-        device_name = find_next_available_device(ec2, instance_id)
-        
-        print(f"Attaching {disk_name} ({volume_id}) to {instance_id} as {device_name}")
-        ec2.attach_volume(InstanceId=instance_id, VolumeId=volume_id, Device=device_name)
+def layouts_from_configs(volume_configs):
+    """Summarize each volume configuration's striped performance and cost"""
+    return [
+        summarize_layout(
+            config['volume_type'],
+            config['disk_count'],
+            config['size_per_disk'],
+            config['iops_per_disk'],
+            config['throughput_per_disk']
+        )
+        for config in volume_configs
+    ]
 
-    # Print summary
-    final_volume_count = len(get_used_device_names(ec2, instance_id))
-    print(f"\n=== SQL SERVER VOLUMES CREATED ===")
+def volume_sets_from_configs(volume_configs):
+    """Convert prompted volume configurations to fleet volume sets"""
+    return [
+        {
+            'name': config['name'],
+            'disks': config['disk_count'],
+            'size': config['size_per_disk'],
+            'type': config['volume_type'],
+            'iops': config['iops_per_disk'],
+            'throughput': config['throughput_per_disk']
+        }
+        for config in volume_configs
+    ]
+
+def configs_from_volume_sets(volume_sets):
+    """Convert fleet volume sets back to prompted volume configurations"""
+    return [
+        {
+            'name': volume_set['name'],
+            'disk_count': volume_set['disks'],
+            'size_per_disk': volume_set['size'],
+            'volume_type': volume_set['type'],
+            'iops_per_disk': volume_set['iops'],
+            'throughput_per_disk': volume_set['throughput']
+        }
+        for volume_set in volume_sets
+    ]
+
+def run_fleet(args, clients, instance_iter, journal):
+    """Apply one set of volume configurations to many instances at once and return an exit code"""
+    selected = stream_and_select_many(timed('discovery', instance_iter))
+    if not selected:
+        return
+
+    batch_id = args.batch_id
+    print(f"Batch ID: {batch_id}")
+
+    volume_configs = prompt_volume_configs()
+    volume_sets = volume_sets_from_configs(volume_configs)
+
+    # Every instance gets the same volumes, so check each distinct instance type once
+    layouts = layouts_from_configs(volume_configs)
+    checked = set()
+    for inst in selected:
+        target = target_for(clients, inst)
+        if (target, inst['InstanceType']) not in checked:
+            checked.add((target, inst['InstanceType']))
+            report_bandwidth(clients[target], inst['InstanceType'], layouts, refresh=args.refresh)
+
+    # Instances found through different profiles or regions are provisioned in parallel,
+    # each group through its own client, all drawing from one API budget
+    groups = {}
+    for inst in selected:
+        groups.setdefault(target_for(clients, inst), []).append(
+            (inst['InstanceId'], inst['AvailabilityZone'], volume_sets)
+        )
+
+    # Validate every disk on every instance before anything is created
+    if not args.no_preflight:
+        checks = {target: [] for target in groups}
+        for target, targets in groups.items():
+            for instance_id, az, sets in targets:
+                common_tags = batch_tags(batch_id, instance_id, args.owner, dict(args.tags))
+                checks[target].append((instance_id, az, volume_specs(sets, common_tags, "{name}-Disk{n}"), None))
+        try:
+            preflight_groups(clients, checks)
+        except PreflightError as e:
+            print_problems(e)
+            return 1
+        print(f"Preflight passed for {len(selected)} instance(s).")
+
+    platforms = {inst['InstanceId']: inst.get('Platform', 'linux') for inst in selected}
+    for target, targets in groups.items():
+        for instance_id, az, sets in targets:
+            journal.plan_instance(instance_id, az, sets, *target, platform=platforms[instance_id])
+    return provision_groups(args, clients, groups, platforms, journal)
+
+def provision_groups(args, clients, groups, platforms, journal):
+    """Provision fleet ``groups``, ``{(profile, region): [(instance_id, az, volume_sets), ...]}``, and report them
+
+    Returns 0 when every instance got all of its volumes, otherwise 1.
+    """
+    batch_id = args.batch_id
+    count = sum(len(targets) for targets in groups.values())
+
+    # Every instance gets its own worker pool, but all of them, in every profile and region, share one API budget
+    budget = api_budget(args.api_budget)
+
+    def provision_group(target, client):
+        return provision_fleet(
+            BudgetedClient(client, slots=budget),
+            groups[target],
+            batch_id,
+            args.owner,
+            dict(args.tags),
+            "{name}-Disk{n}",
+            max_workers=args.per_instance_concurrency,
+            journal=journal
+        )
+
+    print(f"\n=== Creating SQL Server Volumes on {count} instance(s) ===")
+    outcomes = fan_out(provision_group, {target: clients[target] for target in groups})
+    report = merge_reports(outcomes, batch_id)
+
+    print(f"\n=== SQL SERVER FLEET SUMMARY ===")
+    for target in report['targets']:
+        if target['status'] != 'ok':
+            print(f"{target['profile']}/{target['region']}: {target['status']}: {target['error']}")
+    print_raid_summary(report)
+    if args.output:
+        write_report(report, args.output)
+        print(f"\nResults written to {args.output}")
+
+    if report['succeeded']:
+        print(f"\nAll SQL Server volumes created and attached on {count} instance(s)!")
+        print("Ready for RAID configuration in the OS!")
+    # Scripts are written for every instance that got all of its volumes
+    for instance in report['instances']:
+        if instance['status'] == 'ok':
+            created_volumes = [(v['volume_id'], v['name'], v['raid_set'], v['device']) for v in instance['volumes']]
+            generate_raid_scripts(args, created_volumes, platforms.get(instance['instance_id'], 'linux'),
+                                  instance['instance_id'])
+    if not report['succeeded']:
+        failed = [i['instance_id'] for i in report['instances'] if i['status'] != 'ok']
+        print(f"\nProvisioning did not complete on: {', '.join(failed) or 'see errors above'}")
+        return 1
+    return 0
+
+def generate_raid_scripts(args, created_volumes, platform, instance_id=None):
+    """Write the OS-side RAID scripts for ``created_volumes`` unless ``--no-raid-scripts`` was given"""
+    if args.no_raid_scripts:
+        return []
+    platform = platform if args.raid_script_os == 'auto' else args.raid_script_os
+    tool = args.raid_tool or DEFAULT_TOOLS[platform]
+    if tool not in (WINDOWS_TOOLS if platform == 'windows' else LINUX_TOOLS):
+        print(f"--raid-tool {tool} does not apply to {platform}; using {DEFAULT_TOOLS[platform]}.")
+        tool = DEFAULT_TOOLS[platform]
+    directory = args.raid_script_dir or f"raid-scripts-{args.batch_id}"
+    if instance_id:
+        directory = os.path.join(directory, instance_id)
+    try:
+        paths = write_raid_scripts(created_volumes, directory, platform, tool, args.batch_id)
+    except OSError as e:
+        print(f"Could not write RAID scripts to {directory}: {e}")
+        return []
+    admin = 'Administrator' if platform == 'windows' else 'root'
+    print(f"\n{platform.capitalize()} RAID scripts ({tool}){f' for {instance_id}' if instance_id else ''}; "
+          f"copy them to the instance and run them as {admin}:")
+    for path in paths:
+        print(f"  {path}")
+    return paths
+
+def describe_disk(volume):
+    """One line such as ``250 GiB gp3, 3000 IOPS, 125 MiB/s``"""
+    settings = [f"{volume['Size']} GiB {volume['VolumeType']}"]
+    if volume.get('Iops'):
+        settings.append(f"{volume['Iops']} IOPS")
+    if volume.get('Throughput'):
+        settings.append(f"{volume['Throughput']} MiB/s")
+    return ", ".join(settings)
+
+def prompt_retune_values(args, volume):
+    """Return ``(size, volume_type, iops, throughput)`` from the command line, or prompt for each; None keeps a value
+
+    Returns None if the user quits with ``*``.
+    """
+    values = [args.size, args.volume_type, args.iops, args.throughput]
+    if any(value is not None for value in values):
+        return values
+    prompts = [("Size per disk (GiB)", 'Size', int), ("EBS type", 'VolumeType', str),
+               ("IOPS per disk", 'Iops', int), ("Throughput (MB/s) per disk", 'Throughput', int)]
+    for idx, (label, key, convert) in enumerate(prompts):
+        while True:
+            answer = input(f"{label} [current: {volume.get(key) or 'n/a'}, Enter to keep]: ").strip()
+            if answer == '*':
+                return None
+            if not answer:
+                break
+            if convert is str:
+                if answer in MODIFIABLE_TYPES:
+                    values[idx] = answer
+                    break
+                print(f"Please choose one of: {', '.join(MODIFIABLE_TYPES)}")
+                continue
+            try:
+                values[idx] = convert(answer)
+                break
+            except ValueError:
+                print("Please enter a number.")
+    return values
+
+def run_retune(args, ec2, selected):
+    """Modify every disk of one RAID set on the selected instance at once and return an exit code"""
+    instance_id = selected['InstanceId']
+    with phase('discovery'):
+        raid_sets = raid_sets_on(ec2, instance_id)
+    if not raid_sets:
+        print(f"No RAID sets (volumes named <set>-Disk<n>) are attached to {instance_id}.")
+        return 1
+
+    names = list(raid_sets)
+    raid_set = args.retune
+    if not raid_set:
+        print(f"\nRAID sets on {instance_id}:")
+        for idx, name in enumerate(names):
+            print(f"[{idx+1}] {name}: {len(raid_sets[name])} x {describe_disk(raid_sets[name][0])}")
+        while True:
+            choice = input(f"Select RAID set to retune (1-{len(names)}): ").strip()
+            if choice == '*':
+                return 0
+            if choice.isdigit() and 1 <= int(choice) <= len(names):
+                raid_set = names[int(choice)-1]
+                break
+            print("Invalid selection.")
+    elif raid_set not in raid_sets:
+        print(f"No RAID set named {raid_set} on {instance_id}; found: {', '.join(names)}")
+        return 1
+
+    volumes = raid_sets[raid_set]
+    print(f"\n{raid_set} on {instance_id}:")
+    for volume in volumes:
+        print(f"  - {tag_value(volume, 'Name')}: "
+              f"{volume['VolumeId']} ({describe_disk(volume)})")
+
+    values = prompt_retune_values(args, volumes[0])
+    if values is None:
+        print("Goodbye!")
+        return 0
+    size, volume_type, iops, throughput = values
+    try:
+        plan = plan_retune(raid_set, volumes, size, volume_type, iops, throughput)
+        if not plan:
+            print(f"Every disk of {raid_set} already has these settings.")
+            return 0
+        target = plan[0]['target']
+        new_layout = summarize_layout(target['VolumeType'], len(volumes), target['Size'], target['Iops'],
+                                      target['Throughput'])
+        print(f"\nNew {raid_set} layout: {format_layout(new_layout)}")
+        if len(plan) < len(volumes):
+            print(f"{len(volumes) - len(plan)} disk(s) already have these settings and are left alone.")
+
+        # Check the instance can drive the retuned set together with its other sets
+        others = [layout_of_set(disks) for name, disks in raid_sets.items() if name != raid_set]
+        report_bandwidth(ec2, selected['InstanceType'], [new_layout] + others, refresh=args.refresh)
+
+        with phase('discovery'):
+            check_modifiable(ec2, [entry['volume']['VolumeId'] for entry in plan])
+        while True:
+            answer = input(f"Modify {len(plan)} disk(s) of {raid_set}? (y/n) or * to quit: ").strip().lower()
+            if answer in ('y', 'yes'):
+                break
+            if answer in ('n', 'no', '*'):
+                print("Nothing was modified.")
+                return 0
+            print("Please enter 'y' for yes or 'n' for no.")
+    except RetuneError as e:
+        print(f"Cannot retune {raid_set}: {e}")
+        return 1
+
+    print(f"\n=== Retuning {raid_set} ===")
+    result = retune(ec2, plan)
+    layout = uniform_layout(ec2, [volume['VolumeId'] for volume in volumes])
+
+    print(f"\n=== RETUNE SUMMARY ===")
     print(f"Instance: {instance_id}")
-    print(f"Original volumes attached: {initial_volume_count}")
-    print(f"New SQL volumes created: {len(created_volumes)}")
-    print(f"Total volumes now attached: {final_volume_count}")
-    
-    # Group volumes by type for summary
+    print(f"Disks modified: {len(result['modified'])}/{len(plan)}")
+    for volume_id, error in result['failed'].items():
+        print(f"  - {volume_id}: FAILED: {error}")
+    if layout and not result['failed']:
+        print(f"\n{raid_set} stripe is uniformly upgraded: {format_layout(layout)}")
+        print("Disks still optimizing deliver between the old and the new performance until their modification completes.")
+        if size:
+            print("Grow the RAID device and filesystem in the OS to use the new capacity "
+                  "(mdadm --grow --size=max and xfs_growfs, or Resize-VirtualDisk and Resize-Partition).")
+        return 0
+    print(f"\n{raid_set} stripe is NOT uniform: the stripe runs at the speed of its slowest disk. "
+          f"Run the same retune again later to bring the remaining disks in line.")
+    return 1
+
+def layout_of_set(volumes):
+    """Summarize an existing RAID set from its first disk's settings"""
+    first = volumes[0]
+    return summarize_layout(first['VolumeType'], len(volumes), first['Size'], first.get('Iops'), first.get('Throughput'))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create and attach SQL Server RAID volume sets to an EC2 instance")
+    add_discovery_arguments(parser)
+    add_cache_arguments(parser)
+    add_fanout_arguments(parser)
+    add_tag_arguments(parser)
+    add_manifest_arguments(parser)
+    add_metrics_arguments(parser)
+    add_preflight_arguments(parser)
+    add_resume_arguments(parser)
+    add_rollback_arguments(parser)
+    group = parser.add_argument_group('fleet mode')
+    group.add_argument('--fleet', action='store_true',
+                       help="Select several instances and apply the same volume sets to all of them at once")
+    group.add_argument('--per-instance-concurrency', type=int, default=4, metavar='N',
+                       help="Worker threads per instance in fleet mode (default: 4)")
+    group.add_argument('--api-budget', type=int, default=DEFAULT_API_BUDGET, metavar='N',
+                       help=f"EC2 calls in flight across the whole fleet (default: {DEFAULT_API_BUDGET})")
+    group = parser.add_argument_group('retune mode')
+    group.add_argument('--retune', nargs='?', const='', metavar='SET',
+                       help="Modify every disk of an existing RAID set (e.g. SQL-Data) instead of creating volumes")
+    group.add_argument('--size', type=int, metavar='GIB', help="New size per disk for --retune")
+    group.add_argument('--volume-type', choices=MODIFIABLE_TYPES, help="New EBS type for --retune")
+    group.add_argument('--iops', type=int, metavar='N', help="New IOPS per disk for --retune")
+    group.add_argument('--throughput', type=int, metavar='MIBPS', help="New throughput per disk (gp3) for --retune")
+    group = parser.add_argument_group('OS RAID scripts')
+    group.add_argument('--raid-script-os', choices=('auto', 'linux', 'windows'), default='auto',
+                       help="Operating system to write the RAID scripts for (default: the instance's platform)")
+    group.add_argument('--raid-tool', choices=LINUX_TOOLS + WINDOWS_TOOLS,
+                       help="Tool the RAID scripts use (default: mdadm on Linux, storage-spaces on Windows)")
+    group.add_argument('--raid-script-dir', metavar='DIR',
+                       help="Directory to write the RAID scripts to (default: raid-scripts-<batch id>)")
+    group.add_argument('--no-raid-scripts', action='store_true',
+                       help="Do not write RAID scripts for the created volume sets")
+    return parser.parse_args()
+
+def print_volume_sets(created_volumes):
+    """Print the disks of ``created_volumes`` grouped by RAID set"""
     volume_groups = {}
-    for _, disk_name, vol_type in created_volumes:
+    for _, disk_name, vol_type, device, time_to_attached in created_volumes:
         if vol_type not in volume_groups:
             volume_groups[vol_type] = []
-        volume_groups[vol_type].append(disk_name)
+        # Disks a resumed run found already attached have no time of their own
+        timing = f", attached after {time_to_attached:.1f}s" if time_to_attached is not None else ""
+        volume_groups[vol_type].append(f"{disk_name} ({device}{timing})")
     
     print("\nRAID Volume Sets Created:")
     for vol_type, disks in volume_groups.items():
         print(f"  {vol_type}: {len(disks)} disk(s)")
         for disk in disks:
             print(f"    - {disk}")
+
+def resume_batch(args, journal):
+    """Finish an interrupted interactive or fleet batch from its journal without prompting"""
+    print(f"Resuming batch {args.batch_id}")
+    groups = resume_groups(journal)
+    clients = {}
+    for target in groups:
+        clients[target] = target_client(target)
+    platforms = {instance['instance_id']: instance['platform'] or 'linux' for instance in journal.instances.values()}
+    if journal.run['mode'] == 'fleet':
+        return provision_groups(args, clients, groups, platforms, journal)
+
+    # An interactive batch has a single instance
+    target, targets = next(iter(groups.items()))
+    instance_id, az, volume_sets = targets[0]
+    ec2 = clients[target]
+    print(f"\nInstance: {instance_id} in AZ: {az}")
+    common_tags = batch_tags(args.batch_id, instance_id, args.owner, dict(args.tags))
+    created_volumes = provision_volume_sets(ec2, instance_id, az, DeviceAllocator(ec2, instance_id),
+                                            configs_from_volume_sets(volume_sets), common_tags, journal)
+    print_volume_sets(created_volumes)
+    print("\nAll SQL Server volumes created and attached successfully!")
+    generate_raid_scripts(args, created_volumes, platforms[instance_id])
+
+def run(args):
+    """Run the interactive workflow, fleet mode, ``--manifest`` mode or ``--resume``, and return an exit code"""
+    if args.rollback:
+        return run_rollback_command(args)
+    try:
+        journal = open_journal(args, SCRIPT)
+    except JournalError as e:
+        print(e)
+        return 2
+    if args.manifest:
+        return run_manifest_command(args, "{name}-Disk{n}", sql_default_volume_sets(), journal)
+    if args.resume:
+        return resume_batch(args, journal)
+
+    if args.profiles or args.regions:
+        clients = build_clients(args.profiles, args.regions)
+    else:
+        profile = select_profile()
+        if not profile:
+            return
+        # Use the selected profile
+        clients = build_clients([profile], None)
+
+    if len(clients) == 1:
+        (profile, region), ec2 = next(iter(clients.items()))
+        instance_iter = instance_source(ec2, profile, region, args)
+    else:
+        instance_iter = discover(
+            clients,
+            lambda target, client: instance_source(client, target[0], target[1], args),
+            args.target_timeout
+        )
+    if args.fleet:
+        return run_fleet(args, clients, instance_iter, journal)
+
+    selected = stream_and_select(timed('discovery', instance_iter))
+    if not selected:
+        return
+    target = target_for(clients, selected)
+    ec2 = clients[target]
+    if args.retune is not None:
+        return run_retune(args, ec2, selected)
+
+    instance_id = selected['InstanceId']
+    az = selected['AvailabilityZone']
+    print(f"\nSelected Instance: {instance_id} in AZ: {az}")
+
+    # Tags applied to every volume in the same create_volume request
+    batch_id = args.batch_id
+    common_tags = batch_tags(batch_id, instance_id, args.owner, dict(args.tags))
+    print(f"Batch ID: {batch_id}")
+
+    # Load the instance's device names once; they are tracked locally from here on
+    allocator = DeviceAllocator(ec2, instance_id)
+
+    # Count initial volumes attached to the instance
+    with phase('discovery'):
+        initial_volume_count = len(allocator.load())
+
+    volume_configs = prompt_volume_configs()
+    report_bandwidth(ec2, selected['InstanceType'], layouts_from_configs(volume_configs), refresh=args.refresh)
+
+    # Validate every disk of every set before anything is created
+    if not args.no_preflight:
+        specs = volume_specs(volume_sets_from_configs(volume_configs), common_tags, "{name}-Disk{n}")
+        try:
+            preflight(ec2, [(instance_id, az, specs, allocator)])
+        except PreflightError as e:
+            print_problems(e)
+            return 1
+        print(f"Preflight passed for {len(specs)} volume(s).")
+
+    # Journal the plan first, so an interrupted run can be finished with --resume
+    journal.plan_instance(instance_id, az, volume_sets_from_configs(volume_configs), *target,
+                          platform=selected.get('Platform', 'linux'))
+    created_volumes = provision_volume_sets(ec2, instance_id, az, allocator, volume_configs, common_tags, journal)
+
+    # Print summary
+    with phase('summary'):
+        final_volume_count = len(get_used_device_names(ec2, instance_id))
+    print(f"\n=== SQL SERVER VOLUMES CREATED ===")
+    print(f"Instance: {instance_id}")
+    print(f"Original volumes attached: {initial_volume_count}")
+    print(f"New SQL volumes created: {len(created_volumes)}")
+    print(f"Total volumes now attached: {final_volume_count}")
+    print_volume_sets(created_volumes)
     
     print("\nAll SQL Server volumes created and attached successfully!")
     print("Ready for RAID configuration in the OS!")
+    generate_raid_scripts(args, created_volumes, selected.get('Platform', 'linux'))
+
+def main():
+    args = parse_args()
+    configure_pool(args)
+    # Everything before the first prompt is imported and parsed by now
+    mark_ready()
+    # One batch ID tags the run's volumes and names its metrics file
+    args.batch_id = args.resume or args.batch_id or new_batch_id()
+    try:
+        status = run(args)
+    finally:
+        if args.rollback:
+            # Keep the metrics of the run being rolled back
+            finish_run(args, f"{args.rollback}-rollback")
+        else:
+            finish_run(args, args.batch_id)
+            print_resume_hint(args.batch_id, SCRIPT)
+    sys.exit(status)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,116 +1,140 @@
-import boto3
-import time
+import argparse
+import sys
 
-def list_instances(ec2):
-    instances = []
-    for reservation in ec2.describe_instances()['Reservations']:
-        for inst in reservation['Instances']:
-            instances.append(inst)
-    return instances
+from ebs_core.cache import instance_source
+from ebs_core.catalog import report_bandwidth
+from ebs_core.cli import (add_cache_arguments, add_discovery_arguments, add_fanout_arguments,
+                          add_manifest_arguments, add_metrics_arguments, add_preflight_arguments,
+                          add_resume_arguments, add_rollback_arguments, add_tag_arguments)
+from ebs_core.clients import build_clients, configure_pool, target_client
+from ebs_core.devices import DeviceAllocator, get_used_device_names
+from ebs_core.discovery import select_profile, stream_and_select
+from ebs_core.fanout import discover, target_for
+from ebs_core.fleet import attached_after, disk_names
+from ebs_core.journal import JournalError, open_journal, print_resume_hint, resume_groups
+from ebs_core.manifest import run_manifest_command
+from ebs_core.metrics import finish_run, mark_ready, phase, timed
+from ebs_core.pipeline import Pipeline
+from ebs_core.planner import summarize_layout
+from ebs_core.preflight import SIZE_LIMITS, PreflightError, preflight, print_problems
+from ebs_core.rollback import run_rollback_command
+from ebs_core.tags import batch_tags, new_batch_id
 
-def get_used_device_names(ec2, instance_id):
-    """Get list of device names already in use on the instance"""
-    used_devices = set()
-    
-    # Get instance details including block device mappings
-    response = ec2.describe_instances(InstanceIds=[instance_id])
-    instance = response['Reservations'][0]['Instances'][0]
-    
-    # Check root device
-    if 'RootDeviceName' in instance:
-        used_devices.add(instance['RootDeviceName'])
-    
-    # Check attached volumes
-    if 'BlockDeviceMappings' in instance:
-        for mapping in instance['BlockDeviceMappings']:
-            used_devices.add(mapping['DeviceName'])
-    
-    return used_devices
-
-def find_next_available_device(ec2, instance_id):
-    """Find the next available device name for volume attachment"""
-    used_devices = get_used_device_names(ec2, instance_id)
-    
-    # Start from /dev/xvdf and find first available
-    for i in range(26):  # a-z
-        device_letter = chr(102 + i)  # Start from 'f' (102)
-        device_name = f"/dev/xvd{device_letter}"
-        
-        if device_name not in used_devices:
-            return device_name
-    
-    # If all xvd* are taken, try sd* devices
-    for i in range(26):
-        device_letter = chr(97 + i)  # Start from 'a' (97)
-        device_name = f"/dev/sd{device_letter}"
-        
-        if device_name not in used_devices:
-            return device_name
-    
-    raise Exception("No available device names found")
+SCRIPT = 'createebs.py'
 
-def main():
-    # List available profiles
-    session = boto3.Session()
-    profiles = session.available_profiles
-    if not profiles:
-        print("No AWS profiles found. Please configure your AWS credentials.")
-        return
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create and attach encrypted EBS volumes to an EC2 instance")
+    add_discovery_arguments(parser)
+    add_cache_arguments(parser)
+    add_fanout_arguments(parser)
+    add_tag_arguments(parser)
+    add_manifest_arguments(parser)
+    add_metrics_arguments(parser)
+    add_preflight_arguments(parser)
+    add_resume_arguments(parser)
+    add_rollback_arguments(parser)
+    return parser.parse_args()
 
-    print("\nAvailable AWS Profiles:")
-    for idx, prof in enumerate(profiles):
-        print(f"[{idx+1}] {prof}")
+def batch_specs(volume_set, common_tags):
+    """Return the pipeline spec of every volume in one batch, named ``<name>-<n>`` when there are several"""
+    return [
+        {
+            'name': name,
+            'size': volume_set['size'],
+            'volume_type': volume_set['type'],
+            'iops': volume_set['iops'],
+            'throughput': volume_set['throughput'],
+            'tags': common_tags
+        }
+        for name in disk_names(volume_set, "{name}-{n}")
+    ]
 
-    while True:
-        try:
-            prof_input = input(f"Select profile (1-{len(profiles)}) or * to quit: ").strip()
-            if prof_input == '*':
-                print("Goodbye!")
-                return
-            prof_idx = int(prof_input)
-            if 1 <= prof_idx <= len(profiles):
-                profile = profiles[prof_idx-1]
-                break
-        except ValueError:
-            pass
-        print("Invalid selection.")
+def report_results(results):
+    """Print how many of a batch's volumes were attached and why the others were not; return the attached count"""
+    attached = [r for r in results if r['status'] == 'attached']
+    failed = [r for r in results if r['status'] != 'attached']
+    if not failed:
+        print(f"\nAll {len(results)} volume(s) created and attached!")
+    else:
+        print(f"\n{len(attached)} of {len(results)} volume(s) created and attached.")
+    for r in attached:
+        print(f"  - {r['name']} ({r['volume_id']}) as {r['device']}, {attached_after(r)}")
+    if failed:
+        print("Failed:")
+        for r in failed:
+            volume_id = r['volume_id'] or 'not created'
+            print(f"  - {r['name']} ({volume_id}): {r['error']}")
+    return len(attached)
 
-    # Use the selected profile
-    session = boto3.Session(profile_name=profile)
-    ec2 = session.client('ec2')
+def resume_batch(args, journal):
+    """Finish every journaled batch of an interrupted run without prompting and return an exit code"""
+    print(f"Resuming batch {args.batch_id}")
+    complete = True
+    for target, targets in resume_groups(journal).items():
+        ec2 = target_client(target)
+        for instance_id, az, volume_sets in targets:
+            print(f"\nInstance: {instance_id} in AZ: {az}")
+            common_tags = batch_tags(args.batch_id, instance_id, args.owner, dict(args.tags))
+            specs = [spec for volume_set in volume_sets for spec in batch_specs(volume_set, common_tags)]
+            results = Pipeline(ec2, instance_id, az, DeviceAllocator(ec2, instance_id), journal=journal).run(specs)
+            complete = report_results(results) == len(results) and complete
+    return 0 if complete else 1
 
-    instances = list_instances(ec2)
-    if not instances:
-        print("No EC2 instances found.")
-        return
+def run(args):
+    """Run the interactive workflow, ``--manifest`` mode or ``--resume``, and return an exit code"""
+    if args.rollback:
+        return run_rollback_command(args)
+    try:
+        journal = open_journal(args, SCRIPT)
+    except JournalError as e:
+        print(e)
+        return 2
+    if args.manifest:
+        return run_manifest_command(args, "{name}-{n}", journal=journal)
+    if args.resume:
+        return resume_batch(args, journal)
 
-    print("\nAvailable EC2 Instances:")
-    for idx, inst in enumerate(instances):
-        name = next((tag['Value'] for tag in inst.get('Tags', []) if tag['Key'] == 'Name'), 'No Name')
-        print(f"[{idx+1}] InstanceId: {inst['InstanceId']} | Name: {name}")
+    if args.profiles or args.regions:
+        clients = build_clients(args.profiles, args.regions)
+    else:
+        profile = select_profile()
+        if not profile:
+            return
+        # Use the selected profile
+        clients = build_clients([profile], None)
 
-    while True:
-        try:
-            selection_input = input(f"\nSelect instance (1-{len(instances)}) or * to quit: ").strip()
-            if selection_input == '*':
-                print("Goodbye!")
-                return
-            selection = int(selection_input)
-            if 1 <= selection <= len(instances):
-                selected = instances[selection-1]
-                break
-        except ValueError:
-            pass
-        print("Invalid selection.")
+    if len(clients) == 1:
+        (profile, region), ec2 = next(iter(clients.items()))
+        instance_iter = instance_source(ec2, profile, region, args)
+    else:
+        instance_iter = discover(
+            clients,
+            lambda target, client: instance_source(client, target[0], target[1], args),
+            args.target_timeout
+        )
+    selected = stream_and_select(timed('discovery', instance_iter))
+    if not selected:
+        return
+    target = target_for(clients, selected)
+    ec2 = clients[target]
 
     instance_id = selected['InstanceId']
-    az = selected['Placement']['AvailabilityZone']
+    az = selected['AvailabilityZone']
     
+    # Load the instance's device names once; they are tracked locally from here on
+    allocator = DeviceAllocator(ec2, instance_id)
+
     # Count initial volumes attached to the instance
-    initial_volume_count = len(get_used_device_names(ec2, instance_id))
+    with phase('discovery'):
+        initial_volume_count = len(allocator.load())
     
+    # Tags applied to every volume in the same create_volume request
+    batch_id = args.batch_id
+    common_tags = batch_tags(batch_id, instance_id, args.owner, dict(args.tags))
+
     print(f"\nSelected Instance: {instance_id} in AZ: {az}")
     print(f"Currently attached volumes: {initial_volume_count}")
+    print(f"Batch ID: {batch_id}")
     
     total_volumes_created = 0
 
@@ -147,14 +171,16 @@ def main():
                 pass
             print("Invalid number.")
 
+        # Sizes are checked against the chosen type here, whether or not the preflight runs
+        min_size, max_size = SIZE_LIMITS[ebs_type]
         while True:
             try:
-                size_input = input("Enter size (GiB) for each volume (1-16384) or * to quit: ").strip()
+                size_input = input(f"Enter size (GiB) for each volume ({min_size}-{max_size}) or * to quit: ").strip()
                 if size_input == '*':
                     print("Goodbye!")
                     return
                 size = int(size_input)
-                if 1 <= size <= 16384:
+                if min_size <= size <= max_size:
                     break
             except ValueError:
                 pass
@@ -188,52 +214,40 @@ def main():
         if not volume_name:
             volume_name = "EBS-Volume"
 
-        # Create and attach volumes
-        for i in range(volume_count):
-            params = {
-                'AvailabilityZone': az,
-                'Size': size,
-                'VolumeType': ebs_type,
-                'Encrypted': True
-            }
-            if iops:
-                params['Iops'] = iops
-            if throughput:
-                params['Throughput'] = throughput
+        # Check the batch against the instance's EBS bandwidth before creating anything
+        report_bandwidth(
+            ec2,
+            selected['InstanceType'],
+            [summarize_layout(ebs_type, volume_count, size, iops, throughput)],
+            refresh=args.refresh
+        )
 
-            vol = ec2.create_volume(**params)
-            volume_id = vol['VolumeId']
-            
-            # Set volume name tag
-            if volume_count > 1:
-                tag_name = f"{volume_name}-{i+1}"
-            else:
-                tag_name = volume_name
-            
-            ec2.create_tags(
-                Resources=[volume_id],
-                Tags=[{'Key': 'Name', 'Value': tag_name}]
-            )
-            
-            print(f"Created volume {volume_id} with name '{tag_name}'")
+        # Create and attach volumes, named <name>-<n> when there are several
+        volume_set = {
+            'name': volume_name,
+            'disks': volume_count,
+            'size': size,
+            'type': ebs_type,
+            'iops': iops,
+            'throughput': throughput
+        }
+        specs = batch_specs(volume_set, common_tags)
 
-            # Wait for available
-            print("Waiting for volume to become available...")
-            while True:
-                desc = ec2.describe_volumes(VolumeIds=[volume_id])
-                state = desc['Volumes'][0]['State']
-                if state == 'available':
-                    break
-                time.sleep(2)
-
-            # Find next available device name
-            device_name = find_next_available_device(ec2, instance_id)
-
-            print(f"Attaching {volume_id} to {instance_id} as {device_name}")
-            ec2.attach_volume(InstanceId=instance_id, VolumeId=volume_id, Device=device_name)
+        # Validate the whole batch before anything is created
+        if not args.no_preflight:
+            try:
+                preflight(ec2, [(instance_id, az, specs, allocator)])
+            except PreflightError as e:
+                print_problems(e)
+                print("Enter the batch again with different settings, or * to quit.")
+                continue
+            print(f"Preflight passed for {volume_count} volume(s).")
 
-        total_volumes_created += volume_count
-        print(f"\nAll {volume_count} volume(s) created and attached!")
+        # Journal the batch first, so an interrupted run can be finished with --resume
+        journal.plan_instance(instance_id, az, [volume_set], *target)
+        pipeline = Pipeline(ec2, instance_id, az, allocator, journal=journal)
+        results = pipeline.run(specs)
+        total_volumes_created += report_results(results)
         
         # Ask if user wants to attach more volumes
         while True:
@@ -245,7 +259,8 @@ def main():
                 break
             elif again in ['n', 'no']:
                 # Print summary before exiting
-                final_volume_count = len(get_used_device_names(ec2, instance_id))
+                with phase('summary'):
+                    final_volume_count = len(get_used_device_names(ec2, instance_id))
                 print(f"\n=== SUMMARY ===")
                 print(f"Instance: {instance_id}")
                 print(f"Original volumes attached: {initial_volume_count}")
@@ -256,5 +271,23 @@ def main():
             else:
                 print("Please enter 'y' for yes or 'n' for no.")
 
+def main():
+    args = parse_args()
+    configure_pool(args)
+    # Everything before the first prompt is imported and parsed by now
+    mark_ready()
+    # One batch ID tags the run's volumes and names its metrics file
+    args.batch_id = args.resume or args.batch_id or new_batch_id()
+    try:
+        status = run(args)
+    finally:
+        if args.rollback:
+            # Keep the metrics of the run being rolled back
+            finish_run(args, f"{args.rollback}-rollback")
+        else:
+            finish_run(args, args.batch_id)
+            print_resume_hint(args.batch_id, SCRIPT)
+    sys.exit(status)
+
 if __name__ == "__main__":
     main() 
\ No newline at end of file
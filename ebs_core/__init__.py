@@ -0,0 +1,5 @@
+"""Shared building blocks for the EBS multi-create scripts."""
+import time
+
+# Taken on the scripts' first ebs_core import, so the startup time covers every import after it
+IMPORTED_AT = time.monotonic()
@@ -0,0 +1,228 @@
+"""asyncio engine that provisions the disks of several RAID sets as concurrent tasks
+
+boto3 calls block, so each one runs on the default thread pool through
+``asyncio.to_thread``; the event loop only decides what may run next. Every
+disk is one task that creates its volume, waits for it, attaches it and
+waits for the attachment, so the whole layout takes about as long as its
+slowest disk.
+"""
+import asyncio
+import time
+
+from ebs_core.devices import MAX_ATTACH_ATTEMPTS
+from ebs_core.metrics import phase
+from ebs_core.pipeline import log
+from ebs_core.waiter import AttachmentWaiter, VolumeStateError, VolumeWaiter
+
+
+class AsyncVolumeWaiter:
+    """Let many tasks await their own volume while one task polls all of them
+
+    Polling goes through a single ``VolumeWaiter``, so however many disks are
+    waiting, each tick is one describe_volumes call. A newly added volume
+    wakes the poller early, as the threaded pipeline does. Passing a
+    ``waiter``, such as an ``AttachmentWaiter``, polls through it instead, as
+    phase ``phase_name``.
+    """
+
+    def __init__(self, ec2, waiter=None, phase_name='wait', **waiter_options):
+        self._waiter = waiter or VolumeWaiter(ec2, **waiter_options)
+        self._phase_name = phase_name
+        self._futures = {}
+        self._added = asyncio.Event()
+        self._poller = None
+
+    async def wait(self, volume_id):
+        """Return the volume's description once it reaches the target state; raises ``VolumeStateError`` if it fails"""
+        future = asyncio.get_running_loop().create_future()
+        self._futures[volume_id] = future
+        self._waiter.add(volume_id)
+        self._added.set()
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.ensure_future(self._poll())
+        try:
+            return await future
+        finally:
+            self._futures.pop(volume_id, None)
+
+    async def close(self):
+        if self._poller is not None and not self._poller.done():
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+
+    def _waiting(self):
+        return [future for future in self._futures.values() if not future.done()]
+
+    async def _poll(self):
+        try:
+            while self._waiting():
+                with phase(self._phase_name):
+                    ready, failed = await asyncio.to_thread(self._waiter.poll)
+                for volume in ready:
+                    self._resolve(volume['VolumeId'], result=volume)
+                for error in failed:
+                    self._resolve(error.volume_id, error=error)
+                if not self._waiting():
+                    return
+
+                self._added.clear()
+                try:
+                    with phase('wait'):
+                        await asyncio.wait_for(self._added.wait(), self._waiter.next_delay())
+                except asyncio.TimeoutError:
+                    pass
+        except Exception as e:
+            # A poll that failed even after retries fails every disk still waiting on it
+            for future in self._waiting():
+                future.set_exception(e)
+
+    def _resolve(self, volume_id, result=None, error=None):
+        future = self._futures.get(volume_id)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+class _Interrupted(asyncio.CancelledError):
+    """Cancellation that arrived while a request was in flight, carrying the request's result"""
+
+    def __init__(self, result):
+        super().__init__()
+        self.result = result
+
+
+def _in_phase(phase_name, func, *args):
+    # Timed on the worker thread, so the phase covers the whole call and not just its scheduling
+    with phase(phase_name):
+        return func(*args)
+
+
+async def _in_flight(phase_name, func, *args):
+    """Run blocking ``func(*args)`` on a worker thread as phase ``phase_name`` and return its result
+
+    A request that has been sent cannot be taken back. If the awaiting task is
+    cancelled meanwhile, the call is still waited for and, if it succeeded,
+    cancellation is re-raised as ``_Interrupted`` carrying its result, so the
+    volume it created or attached is not lost track of.
+    """
+    task = asyncio.ensure_future(asyncio.to_thread(_in_phase, phase_name, func, *args))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        await asyncio.wait([task])
+        if task.cancelled() or task.exception() is not None:
+            raise
+        raise _Interrupted(task.result())
+
+
+async def _provision_disk(spec, record, create, attach, waiter, previous_attached, attached, confirmer=None,
+                          on_attached=None, started=None):
+    try:
+        record['volume_id'] = await _in_flight('create', create, spec)
+    except _Interrupted as e:
+        record['volume_id'] = e.result
+        record['status'] = 'created'
+        raise
+    record['status'] = 'created'
+
+    for attempt in range(1, MAX_ATTACH_ATTEMPTS + 1):
+        with phase('wait'):
+            await waiter.wait(record['volume_id'])
+        record['status'] = 'available'
+
+        # Disks of one RAID set attach strictly in order, whatever order they became available in
+        if previous_attached is not None:
+            await previous_attached.wait()
+        try:
+            record['device'] = await _in_flight('attach', attach, spec, record['volume_id'])
+        except _Interrupted as e:
+            record['device'] = e.result
+            record['status'] = 'attaching' if confirmer else 'attached'
+            raise
+        # The next disk of the set may send its request now; it does not wait for this one to be confirmed
+        attached.set()
+        if confirmer is None:
+            record['status'] = 'attached'
+            return
+
+        record['status'] = 'attaching'
+        try:
+            await confirmer.wait(record['volume_id'])
+        except VolumeStateError as e:
+            if e.state != 'detached' or attempt == MAX_ATTACH_ATTEMPTS:
+                raise
+            log(f"{record['volume_id']} did not stay attached as {record['device']}; "
+                f"attaching it again on another device name")
+            record['device'] = None
+            continue
+        record['status'] = 'attached'
+        record['time_to_attached'] = round(time.monotonic() - started, 3)
+        if on_attached:
+            on_attached(spec, record['volume_id'], record['device'])
+        log(f"{spec['name']} ({record['volume_id']}) is attached as {record['device']} "
+            f"after {record['time_to_attached']:.1f}s")
+        return
+
+
+async def provision_raid_sets(ec2, raid_sets, create, attach, disks=None, waiter_options=None, instance_id=None,
+                              on_attached=None):
+    """Create, wait for and attach every disk of ``raid_sets`` as concurrent tasks
+
+    ``raid_sets`` is a list of RAID sets, each a list of disk specs with at
+    least a ``name``. ``create(spec)`` and ``attach(spec, volume_id)`` are
+    blocking and return the new volume ID and the device name. Disks of one
+    set attach in list order, each only after the one before it, so a set's
+    device names ascend with its disk numbers; different sets never wait for
+    each other.
+
+    With an ``instance_id`` a disk only counts as attached once one
+    ``AttachmentWaiter``, polling every attachment in flight together, sees
+    it 'attached'; ``on_attached(spec, volume_id, device)`` is then called.
+    An attachment that EC2 drops is retried on a new device name, up to
+    ``MAX_ATTACH_ATTEMPTS`` times in all.
+
+    The first failure, or cancellation such as Ctrl-C, cancels every other
+    disk, after letting create and attach requests that were already sent
+    finish. One record per disk (``name``, ``volume_id``, ``device``,
+    ``status``, ``time_to_attached``) is appended to ``disks`` up front and updated as the disk
+    progresses, so the caller can report what exists after an interrupt.
+    Returns the records.
+    """
+    disks = [] if disks is None else disks
+    started = time.monotonic()
+    waiter = AsyncVolumeWaiter(ec2, **(waiter_options or {}))
+    confirmer = None
+    if instance_id:
+        confirmer = AsyncVolumeWaiter(ec2, AttachmentWaiter(ec2, instance_id, **(waiter_options or {})), 'confirm')
+    tasks = []
+    for raid_set in raid_sets:
+        previous_attached = None
+        for spec in raid_set:
+            record = {'name': spec['name'], 'volume_id': None, 'device': None, 'status': 'pending',
+                      'time_to_attached': None}
+            disks.append(record)
+            attached = asyncio.Event()
+            tasks.append(asyncio.ensure_future(
+                _provision_disk(spec, record, create, attach, waiter, previous_attached, attached, confirmer,
+                                on_attached, started)
+            ))
+            previous_attached = attached
+
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        # Reached on the first failure and on cancellation alike: stop every other disk
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await waiter.close()
+        if confirmer is not None:
+            await confirmer.close()
+
+    for task in tasks:
+        if not task.cancelled() and task.exception() is not None:
+            raise task.exception()
+    return disks
@@ -0,0 +1,234 @@
+"""Shared API budget, adaptive rate limiting and retries for EC2 calls made from many threads"""
+import random
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError
+
+from ebs_core.metrics import METRICS
+
+DEFAULT_API_BUDGET = 16
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 20
+
+# Client attributes that return helper objects rather than making an API call
+_PASSTHROUGH = ('get_paginator', 'get_waiter', 'can_paginate', 'meta', 'exceptions')
+
+THROTTLE_CODES = {
+    'RequestLimitExceeded', 'Throttling', 'ThrottlingException', 'RequestThrottled',
+    'TooManyRequestsException', 'RequestThrottledException'
+}
+TRANSIENT_CODES = {'InternalError', 'InternalFailure', 'ServiceUnavailable', 'Unavailable'}
+
+# (requests per second, burst) per action, roughly following the EC2 request
+# token buckets: describe calls refill quickly, mutating calls slowly
+DESCRIBE_RATE = (20, 100)
+MUTATING_RATE = (5, 50)
+
+
+class BudgetedClient:
+    """Proxy an EC2 client so that at most ``max_in_flight`` calls run at once
+
+    One instance is shared by every thread of a run, so many instances being
+    provisioned together draw from a single budget instead of each bringing
+    their own. Proxies for clients of other profiles or regions join the
+    same budget by being given its ``slots``, a semaphore from ``api_budget``.
+    Paginated calls take a slot per page.
+    """
+
+    def __init__(self, client, max_in_flight=DEFAULT_API_BUDGET, slots=None):
+        self._client = client
+        self._slots = slots or api_budget(max_in_flight)
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name in _PASSTHROUGH or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self._slots:
+                return attr(*args, **kwargs)
+        call.__name__ = name
+        return call
+
+    def get_paginator(self, operation_name):
+        return _Paginator(self, operation_name)
+
+
+def api_budget(max_in_flight=DEFAULT_API_BUDGET):
+    """Return the semaphore ``BudgetedClient`` proxies share to keep ``max_in_flight`` calls in flight in all"""
+    return threading.BoundedSemaphore(max_in_flight)
+
+
+class TokenBucket:
+    """Token bucket whose refill rate adapts to throttling (additive increase, multiplicative decrease)"""
+
+    def __init__(self, rate, burst, min_rate=0.5):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until it is available; returns the seconds waited"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            # A negative balance is a reservation: later callers queue behind it
+            wait = 0 if self._tokens >= 0 else -self._tokens / self.rate
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def throttled(self):
+        """Halve the rate and drop any saved-up burst after a throttling error"""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0)
+
+    def succeeded(self):
+        """Creep the rate back towards its maximum after a successful call"""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class RateLimiter:
+    """One adaptive token bucket per EC2 action"""
+
+    def __init__(self, rates=None):
+        self.rates = rates or {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, action):
+        with self._lock:
+            if action not in self._buckets:
+                default = DESCRIBE_RATE if action.startswith('describe_') else MUTATING_RATE
+                self._buckets[action] = TokenBucket(*self.rates.get(action, default))
+            return self._buckets[action]
+
+
+def error_code(error):
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code')
+    return None
+
+
+def is_throttle(error):
+    return error_code(error) in THROTTLE_CODES
+
+
+def is_retryable(action, error):
+    """Return True if retrying ``action`` after ``error`` cannot duplicate its effect
+
+    Throttled and 5xx-unavailable requests were never processed, so any
+    action may be retried. Connection errors may hide a request that did
+    succeed, so only reads and create_volume, which carries a ClientToken,
+    are retried after them.
+    """
+    if is_throttle(error) or error_code(error) in TRANSIENT_CODES:
+        return True
+    if isinstance(error, BotoConnectionError):
+        return action.startswith('describe_') or action == 'create_volume'
+    return False
+
+
+class ResilientClient:
+    """Proxy an EC2 client through per-action rate limits and idempotent retries
+
+    Every API call first takes a token from its action's bucket. Throttling
+    halves that action's rate, and throttled or transient failures are retried
+    with jittered exponential backoff. create_volume is given a ClientToken up
+    front, so a retried create returns the original volume instead of a
+    second one. Paginators are rebuilt on top of the proxy so paginated calls
+    are limited too. Every call, with its retries and the time spent waiting
+    on the rate limiter or backing off from throttling, is recorded in
+    ``metrics``.
+    """
+
+    def __init__(self, client, limiter=None, max_attempts=MAX_ATTEMPTS, metrics=METRICS):
+        self._client = client
+        self.limiter = limiter or RateLimiter()
+        self.max_attempts = max_attempts
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name in _PASSTHROUGH or not callable(attr):
+            return attr
+
+        def call(**kwargs):
+            return self._call(name, attr, kwargs)
+        call.__name__ = name
+        return call
+
+    def get_paginator(self, operation_name):
+        return _Paginator(self, operation_name)
+
+    def _call(self, action, method, kwargs):
+        if action == 'create_volume' and 'ClientToken' not in kwargs and not kwargs.get('DryRun'):
+            kwargs = {**kwargs, 'ClientToken': str(uuid.uuid4())}
+        bucket = self.limiter.bucket(action)
+        started = time.monotonic()
+        latencies = []
+        throttles = 0
+        throttled_seconds = 0.0
+        error = None
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                throttled_seconds += bucket.acquire()
+                sent = time.monotonic()
+                try:
+                    response = method(**kwargs)
+                except (ClientError, BotoConnectionError) as e:
+                    latencies.append(time.monotonic() - sent)
+                    if is_throttle(e):
+                        bucket.throttled()
+                        throttles += 1
+                    if attempt == self.max_attempts or not is_retryable(action, e):
+                        raise
+                    backoff = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                    if is_throttle(e):
+                        throttled_seconds += backoff
+                    time.sleep(backoff)
+                    continue
+                latencies.append(time.monotonic() - sent)
+                bucket.succeeded()
+                return response
+        except Exception as e:
+            # A dry run that would have succeeded is reported as an error, but is not a failed call
+            error = None if error_code(e) == 'DryRunOperation' else e
+            raise
+        finally:
+            self.metrics.record_call(
+                action, time.monotonic() - started, latencies, throttles, throttled_seconds, error
+            )
+
+
+class _Paginator:
+    """NextToken pagination that routes every page request through a ResilientClient or BudgetedClient"""
+
+    def __init__(self, client, operation_name):
+        self._client = client
+        self._operation_name = operation_name
+
+    def paginate(self, PaginationConfig=None, **kwargs):
+        page_size = (PaginationConfig or {}).get('PageSize')
+        if page_size and 'InstanceIds' not in kwargs and 'VolumeIds' not in kwargs:
+            kwargs['MaxResults'] = page_size
+        method = getattr(self._client, self._operation_name)
+        while True:
+            page = method(**kwargs)
+            yield page
+            token = page.get('NextToken')
+            if not token:
+                return
+            kwargs['NextToken'] = token
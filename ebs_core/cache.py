@@ -0,0 +1,159 @@
+"""On-disk instance inventory cache keyed by profile, region and discovery filters"""
+import hashlib
+import json
+import os
+import time
+
+from ebs_core.discovery import instance_filters, iter_instances, summarize_instance
+
+DEFAULT_TTL = 300
+# Bumped whenever instance summaries gain a field, so older caches are re-fetched
+CACHE_VERSION = 2
+
+# describe_instances accepts at most 1000 instance IDs per call
+ID_CHUNK = 1000
+
+
+def cache_dir():
+    """Return the directory cache files are written to"""
+    return os.environ.get('EBS_MULTICREATE_CACHE_DIR') or os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+        'ebs-multicreate'
+    )
+
+
+def _safe(value):
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in str(value))
+
+
+class InventoryCache:
+    """Instance summaries for one profile, region and set of discovery filters
+
+    Within ``ttl`` seconds of the last fetch the cached list is returned with
+    no API calls. After that, ``describe_instance_status`` is used to find
+    instances whose state changed, appeared or disappeared, and only those are
+    described again. The cache is for choosing an instance; device-name checks
+    before attaching always go to AWS.
+    """
+
+    def __init__(self, profile, region, ttl=DEFAULT_TTL, state='running', az=None, tags=(), id_prefix=None):
+        self.ttl = ttl
+        self.state = state
+        self.az = az
+        self.tags = list(tags)
+        self.id_prefix = id_prefix
+        filters = json.dumps(instance_filters(state, az, self.tags, id_prefix), sort_keys=True)
+        digest = hashlib.sha1(filters.encode()).hexdigest()[:10]
+        self.path = os.path.join(cache_dir(), f"inventory-{_safe(profile)}-{_safe(region)}-{digest}.json")
+
+    def load(self):
+        """Return the cached document, or None if it is missing or unreadable"""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != CACHE_VERSION:
+            return None
+        return data
+
+    def save(self, instances, excluded=None):
+        """Write the inventory; ``excluded`` maps IDs that failed the filters to their state"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        data = {
+            'version': CACHE_VERSION,
+            'fetched_at': time.time(),
+            'instances': instances,
+            'excluded': excluded or {}
+        }
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def instances(self, ec2, refresh=False):
+        """Yield instance summaries, from the cache when possible
+
+        ``refresh`` forces a full re-fetch.
+        """
+        data = None if refresh else self.load()
+        if data is None:
+            yield from self._full_fetch(ec2)
+        elif time.time() - data['fetched_at'] <= self.ttl:
+            yield from data['instances']
+        else:
+            yield from self._incremental_refresh(ec2, data['instances'], data.get('excluded', {}))
+
+    def _full_fetch(self, ec2):
+        instances = []
+        for instance in iter_instances(ec2, self.state, self.az, self.tags, self.id_prefix):
+            instances.append(instance)
+            yield instance
+        # Instances excluded by tag filters are only learned on the next refresh,
+        # where they are described once and then remembered
+        self.save(instances)
+
+    def _current_states(self, ec2):
+        filters = [f for f in instance_filters(self.state, self.az) if f['Name'] != 'instance-id']
+        states = {}
+        paginator = ec2.get_paginator('describe_instance_status')
+        for page in paginator.paginate(IncludeAllInstances=True, Filters=filters):
+            for status in page['InstanceStatuses']:
+                instance_id = status['InstanceId']
+                if self.id_prefix and not instance_id.startswith(self.id_prefix):
+                    continue
+                states[instance_id] = status['InstanceState']['Name']
+        return states
+
+    def _incremental_refresh(self, ec2, cached, excluded):
+        states = self._current_states(ec2)
+        known = {i['InstanceId']: i.get('State') for i in cached}
+        known.update(excluded)
+        cached_by_id = {i['InstanceId']: i for i in cached}
+        changed = [
+            instance_id for instance_id, state in states.items()
+            if known.get(instance_id) != state
+        ]
+
+        refreshed = {}
+        filters = instance_filters(self.state, self.az, self.tags)
+        for start in range(0, len(changed), ID_CHUNK):
+            response = ec2.describe_instances(InstanceIds=changed[start:start + ID_CHUNK], Filters=filters)
+            for reservation in response['Reservations']:
+                for instance in reservation['Instances']:
+                    refreshed[instance['InstanceId']] = summarize_instance(instance)
+
+        # Unchanged instances keep their cached entry; changed ones are
+        # replaced, or remembered as excluded if they no longer match the filters
+        changed = set(changed)
+        instances = []
+        still_excluded = {}
+        for instance_id, state in states.items():
+            if instance_id in refreshed:
+                instances.append(refreshed[instance_id])
+            elif instance_id in changed or instance_id not in cached_by_id:
+                still_excluded[instance_id] = state
+            else:
+                instances.append(cached_by_id[instance_id])
+        self.save(instances, still_excluded)
+        yield from instances
+
+
+def instance_source(ec2, profile, region, args):
+    """Return the instance iterator that the discovery and cache options of ``args`` ask for"""
+    filters = {
+        'state': args.state,
+        'az': args.az,
+        'tags': args.filter_tags,
+        'id_prefix': args.instance_prefix
+    }
+    if args.no_cache:
+        return iter_instances(ec2, **filters)
+    cache = InventoryCache(profile, region, args.cache_ttl, **filters)
+    return cache.instances(ec2, refresh=args.refresh)
@@ -0,0 +1,141 @@
+"""Instance-type EBS bandwidth limits from a local catalog, and the check of new volumes against them
+
+An instance can only drive so much EBS traffic, however many volumes are
+striped together. ``describe_instance_types`` reports that ceiling as a
+baseline and, for smaller types, a burst maximum. The answers are cached
+per instance type for ``CATALOG_TTL`` seconds, since they do not change.
+"""
+import json
+import os
+import time
+
+from ebs_core.cache import cache_dir
+from ebs_core.metrics import phase
+
+CATALOG_VERSION = 1
+CATALOG_TTL = 30 * 24 * 3600
+# Instance limits are reported in MB/s, volume throughput in MiB/s
+MB_PER_MIB = 1.048576
+# Instances smaller than 4xlarge can run at their maximum for 30 minutes per 24 hours
+BURST_MINUTES_PER_DAY = 30
+
+
+def ebs_limits(instance_type_info):
+    """Return ``{baseline_iops, baseline_throughput, burst_iops, burst_throughput}`` (MiB/s) or None
+
+    None means the type has no EBS-optimized figures (it does not support
+    EBS optimization).
+    """
+    info = instance_type_info.get('EbsInfo', {}).get('EbsOptimizedInfo')
+    if not info:
+        return None
+    return {
+        'baseline_iops': info['BaselineIops'],
+        'baseline_throughput': round(info['BaselineThroughputInMBps'] / MB_PER_MIB, 1),
+        'burst_iops': info['MaximumIops'],
+        'burst_throughput': round(info['MaximumThroughputInMBps'] / MB_PER_MIB, 1)
+    }
+
+
+class InstanceTypeCatalog:
+    """EBS limits per instance type, fetched on first use and then read from disk"""
+
+    def __init__(self, ttl=CATALOG_TTL, path=None):
+        self.ttl = ttl
+        self.path = path or os.path.join(cache_dir(), 'instance-types.json')
+
+    def load(self):
+        """Return the cached ``{instance_type: entry}`` map, empty if missing or unreadable"""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('version') != CATALOG_VERSION:
+            return {}
+        return data.get('types', {})
+
+    def save(self, types):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': CATALOG_VERSION, 'types': types}, f)
+        os.replace(tmp_path, self.path)
+
+    def limits(self, ec2, instance_type, refresh=False):
+        """Return the EBS limits of ``instance_type``, calling describe_instance_types only on a miss"""
+        types = self.load()
+        entry = types.get(instance_type)
+        if entry and not refresh and time.time() - entry['fetched_at'] < self.ttl:
+            return entry['limits']
+
+        response = ec2.describe_instance_types(InstanceTypes=[instance_type])
+        limits = ebs_limits(response['InstanceTypes'][0])
+        types[instance_type] = {'fetched_at': time.time(), 'limits': limits}
+        try:
+            self.save(types)
+        except OSError:
+            pass
+        return limits
+
+
+def check_bandwidth(limits, layouts):
+    """Compare the summed IOPS and throughput of ``layouts`` with an instance's EBS limits
+
+    ``layouts`` are ``planner.summarize_layout`` dicts; volume types without
+    an IOPS or throughput figure count as 0. Returns the provisioned totals,
+    the effective sustained and burst figures, and how many times over the
+    baseline each total is.
+    """
+    iops = sum(layout['total_iops'] or 0 for layout in layouts)
+    throughput = sum(layout['total_throughput'] or 0 for layout in layouts)
+    return {
+        'iops': iops,
+        'throughput': throughput,
+        'effective_iops': min(iops, limits['baseline_iops']),
+        'effective_throughput': min(throughput, limits['baseline_throughput']),
+        'burst_iops': min(iops, limits['burst_iops']),
+        'burst_throughput': min(throughput, limits['burst_throughput']),
+        'iops_ratio': iops / limits['baseline_iops'] if limits['baseline_iops'] else 0,
+        'throughput_ratio': throughput / limits['baseline_throughput'] if limits['baseline_throughput'] else 0
+    }
+
+
+def report_bandwidth(ec2, instance_type, layouts, catalog=None, refresh=False):
+    """Print an instance's EBS ceiling against the volumes about to be created and warn if they exceed it
+
+    Returns the ``check_bandwidth`` result, or None when the limits could not
+    be looked up (which only skips the check).
+    """
+    try:
+        with phase('discovery'):
+            limits = (catalog or InstanceTypeCatalog()).limits(ec2, instance_type, refresh)
+    except Exception as e:
+        print(f"Could not look up EBS limits for {instance_type}: {e}")
+        return None
+    if limits is None:
+        print(f"{instance_type} is not EBS-optimized; volume performance is not guaranteed.")
+        return None
+
+    check = check_bandwidth(limits, layouts)
+    bursts = (limits['burst_iops'], limits['burst_throughput']) != (limits['baseline_iops'], limits['baseline_throughput'])
+    ceiling = f"{limits['baseline_iops']} IOPS, {limits['baseline_throughput']:.0f} MiB/s sustained"
+    effective = f"{check['effective_iops']} IOPS, {check['effective_throughput']:.0f} MiB/s sustained"
+    if bursts:
+        ceiling += (f" ({limits['burst_iops']} IOPS, {limits['burst_throughput']:.0f} MiB/s burst, "
+                    f"{BURST_MINUTES_PER_DAY} min/day)")
+        effective += f", {check['burst_iops']} IOPS, {check['burst_throughput']:.0f} MiB/s burst"
+    print(f"\n{instance_type} EBS limit: {ceiling}")
+    print(f"New volumes provide: {check['iops']} IOPS, {check['throughput']:.0f} MiB/s")
+    print(f"Expected effective: {effective}")
+
+    over = []
+    if check['iops_ratio'] > 1:
+        over.append(f"IOPS {check['iops_ratio']:.1f}x")
+    if check['throughput_ratio'] > 1:
+        over.append(f"throughput {check['throughput_ratio']:.1f}x")
+    if over:
+        print(f"WARNING: the volumes are oversubscribed ({', '.join(over)} the instance's sustained limit). "
+              f"The instance, not the volumes, will be the bottleneck; provisioned IOPS or throughput above "
+              f"the limit is paid for but unusable.")
+    return check
@@ -0,0 +1,116 @@
+"""Command-line options shared by both scripts"""
+import argparse
+
+from ebs_core.cache import DEFAULT_TTL
+
+
+def parse_tag(value):
+    """Parse a KEY=VALUE tag argument"""
+    key, sep, tag_value = value.partition('=')
+    if not sep or not key:
+        raise argparse.ArgumentTypeError(f"Tag must be KEY=VALUE, got '{value}'")
+    return key, tag_value
+
+
+def add_tag_arguments(parser):
+    """Add the options that control the tags applied to every created volume"""
+    group = parser.add_argument_group('tagging')
+    group.add_argument('--owner', help="Value for the Owner tag on every created volume")
+    group.add_argument('--tag', dest='tags', action='append', type=parse_tag, default=[],
+                       metavar='KEY=VALUE', help="Extra tag for every created volume (repeatable)")
+    group.add_argument('--batch-id', help="Value for the BatchId tag (default: generated per run)")
+
+
+def add_discovery_arguments(parser):
+    """Add the server-side filters used when listing instances"""
+    group = parser.add_argument_group('instance discovery')
+    group.add_argument('--state', default='running',
+                       help="Only list instances in this state, or 'any' (default: running)")
+    group.add_argument('--az', help="Only list instances in this availability zone")
+    group.add_argument('--filter-tag', dest='filter_tags', action='append', type=parse_tag_filter, default=[],
+                       metavar='KEY[=VALUE]', help="Only list instances with this tag (repeatable)")
+    group.add_argument('--instance-prefix', help="Only list instances whose ID starts with this prefix")
+
+
+def parse_tag_filter(value):
+    """Parse a KEY or KEY=VALUE tag filter"""
+    key, _, tag_value = value.partition('=')
+    if not key:
+        raise argparse.ArgumentTypeError(f"Tag filter must be KEY or KEY=VALUE, got '{value}'")
+    return key, tag_value
+
+
+def add_cache_arguments(parser):
+    """Add the options that control the on-disk instance inventory cache"""
+    group = parser.add_argument_group('inventory cache')
+    group.add_argument('--cache-ttl', type=int, default=DEFAULT_TTL, metavar='SECONDS',
+                       help=f"Reuse the cached instance list for this long before refreshing it (default: {DEFAULT_TTL})")
+    group.add_argument('--refresh', action='store_true', help="Re-fetch the full instance list")
+    group.add_argument('--no-cache', action='store_true', help="Neither read nor write the instance cache")
+
+
+def add_manifest_arguments(parser):
+    """Add the options for non-interactive, manifest-driven runs"""
+    group = parser.add_argument_group('batch mode')
+    group.add_argument('--manifest', metavar='PATH',
+                       help="Provision the instances and volume sets in this JSON or YAML file without prompting")
+    group.add_argument('--profile', help="AWS profile to use with --manifest (default: the manifest's profile)")
+    group.add_argument('--region', help="AWS region to use with --manifest (default: the manifest's region)")
+    group.add_argument('--concurrency', type=int, metavar='N',
+                       help="Worker limit shared by every instance in the manifest (default: 8)")
+    group.add_argument('--output', metavar='PATH',
+                       help="Where to write the JSON results (default: ebs-results-<batch id>.json)")
+
+
+def parse_list(value):
+    """Parse a comma-separated list argument"""
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def add_fanout_arguments(parser):
+    """Add the options for working across several profiles and regions at once"""
+    group = parser.add_argument_group('multiple accounts and regions')
+    group.add_argument('--profiles', type=parse_list, metavar='A,B',
+                       help="Discover instances in every one of these AWS profiles in parallel")
+    group.add_argument('--regions', type=parse_list, metavar='R1,R2',
+                       help="Discover instances in every one of these regions in parallel")
+    group.add_argument('--target-timeout', type=float, default=60, metavar='SECONDS',
+                       help="Stop waiting for a profile/region that has not answered discovery (default: 60)")
+
+
+def add_metrics_arguments(parser):
+    """Add the options controlling the run's metrics file and profile"""
+    group = parser.add_argument_group('metrics')
+    group.add_argument('--metrics', metavar='PATH',
+                       help="Where to write the run's JSON metrics (default: ebs-metrics-<batch id>.json)")
+    group.add_argument('--profile-run', action='store_true',
+                       help="Print a table of the phases and EC2 calls the run spent its time in")
+
+
+def add_preflight_arguments(parser):
+    """Add the option that skips the DryRun preflight"""
+    group = parser.add_argument_group('preflight')
+    group.add_argument('--no-preflight', action='store_true',
+                       help="Skip the local limit checks and DryRun calls made before any volume is created")
+
+
+def add_resume_arguments(parser):
+    """Add the option that finishes an interrupted batch from its journal"""
+    group = parser.add_argument_group('resume')
+    group.add_argument('--resume', metavar='BATCH_ID',
+                       help="Finish an interrupted batch: skip the steps its journal shows as done and carry on "
+                            "without prompting")
+
+
+def add_rollback_arguments(parser):
+    """Add the options that delete every volume of a batch"""
+    group = parser.add_argument_group('rollback')
+    group.add_argument('--rollback', metavar='BATCH_ID',
+                       help="Detach and delete every volume tagged with this BatchId instead of creating volumes")
+    group.add_argument('--rollback-tag', dest='rollback_tags', action='append', type=parse_tag_filter, default=[],
+                       metavar='KEY[=VALUE]',
+                       help="Only roll back the batch's volumes that also have this tag, e.g. InstanceId=i-... "
+                            "(repeatable)")
+    group.add_argument('--force-detach', action='store_true',
+                       help="Force-detach attached volumes; the instance gets no chance to flush them")
+    group.add_argument('--yes', action='store_true', help="Do not ask before deleting the volumes")
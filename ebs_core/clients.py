@@ -0,0 +1,119 @@
+"""Pooled EC2 clients shared by every thread of a run, built on first use
+
+boto3 takes a few hundred milliseconds to import, so nothing here imports it
+until the first client is needed; the profile prompt reads the AWS config
+files directly and appears at once. Each ``(profile, region)`` gets one
+client, whose HTTP connection pool is sized for the run's concurrency so
+that parallel calls do not queue for, or throw away, connections, and whose
+connections use TCP keep-alive so they survive the waits between polls.
+"""
+import configparser
+import os
+import threading
+
+from ebs_core.api import DEFAULT_API_BUDGET, ResilientClient
+
+# botocore's own default is 10, fewer than the calls a run has in flight
+DEFAULT_POOL_SIZE = DEFAULT_API_BUDGET
+
+
+class ClientPool:
+    """Thread-safe cache of one ``ResilientClient`` per ``(profile, region)``
+
+    boto3 sessions are not thread-safe, so sessions and clients are only built
+    under the pool's lock; the clients themselves are shared by worker threads.
+    Asking for the same profile and region again returns the same client,
+    with its connections and its rate limiter.
+    """
+
+    def __init__(self, max_pool_connections=DEFAULT_POOL_SIZE):
+        self.max_pool_connections = max_pool_connections
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def configure(self, max_pool_connections):
+        """Size the connection pool of the clients built from now on; the pool never shrinks"""
+        with self._lock:
+            self.max_pool_connections = max(self.max_pool_connections, max_pool_connections)
+
+    def get(self, profile=None, region=None):
+        """Return ``((profile, region), ec2_client)`` with the region resolved from the profile if not given"""
+        with self._lock:
+            if (profile, region) not in self._clients:
+                self._clients[(profile, region)] = self._build(profile, region)
+            return self._clients[(profile, region)]
+
+    def _build(self, profile, region):
+        # The client is wrapped in a ResilientClient so every call is rate limited
+        # and retried there; botocore's own retries are turned off so the two do not multiply
+        import boto3
+        from botocore.config import Config
+
+        session = boto3.Session(profile_name=profile, region_name=region)
+        client = session.client('ec2', config=Config(
+            retries={'mode': 'standard', 'total_max_attempts': 1},
+            max_pool_connections=self.max_pool_connections,
+            tcp_keepalive=True
+        ))
+        return (profile or 'default', session.region_name), ResilientClient(client)
+
+
+POOL = ClientPool()
+
+
+def build_client(profile=None, region=None):
+    """Return ``((profile, region), ec2_client)`` from the shared pool"""
+    return POOL.get(profile, region)
+
+
+def build_clients(profiles, regions):
+    """Return ``{(profile, region): ec2_client}`` for every profile and region pair
+
+    A profile or region of None means the default credential chain or the
+    profile's configured region.
+    """
+    clients = {}
+    for profile in profiles or [None]:
+        for region in regions or [None]:
+            target, client = build_client(profile, region)
+            clients[target] = client
+    return clients
+
+
+def target_client(target):
+    """Return the client for a ``(profile, region)`` recorded by an earlier run"""
+    profile, region = target
+    # A default-profile run is recorded as 'default', which may not exist as a named profile
+    return build_client(None if profile == 'default' else profile, region)[1]
+
+
+def configure_pool(args):
+    """Size the shared pool for the most calls the run's options let it have in flight"""
+    POOL.configure(max(DEFAULT_POOL_SIZE, getattr(args, 'concurrency', None) or 0,
+                       getattr(args, 'api_budget', None) or 0))
+
+
+def list_profiles():
+    """Return the AWS profile names in the config and credentials files, as boto3 would list them
+
+    The files are read directly so that listing profiles does not wait for boto3 to import.
+    """
+    profiles = []
+    config_file = os.path.expanduser(os.environ.get('AWS_CONFIG_FILE', '~/.aws/config'))
+    for section in _sections(config_file):
+        if section == 'default':
+            profiles.append(section)
+        elif section.startswith('profile '):
+            profiles.append(section[len('profile '):].strip())
+    credentials_file = os.path.expanduser(os.environ.get('AWS_SHARED_CREDENTIALS_FILE', '~/.aws/credentials'))
+    profiles.extend(section for section in _sections(credentials_file) if section not in profiles)
+    return profiles
+
+
+def _sections(path):
+    parser = configparser.RawConfigParser()
+    try:
+        parser.read(path)
+    except configparser.Error:
+        return []
+    return parser.sections()
@@ -0,0 +1,117 @@
+"""Per-instance device-name allocator for volume attachments"""
+import threading
+
+from botocore.exceptions import ClientError
+
+MAX_CONFLICT_RETRIES = 5
+# Attempts to attach one volume, counting the first, when EC2 drops the attachment again
+MAX_ATTACH_ATTEMPTS = 3
+
+
+def candidate_device_names():
+    """Yield device names in the order they are handed out: /dev/xvdf-z, then /dev/sda-z"""
+    for code in range(ord('f'), ord('z') + 1):
+        yield f"/dev/xvd{chr(code)}"
+    for code in range(ord('a'), ord('z') + 1):
+        yield f"/dev/sd{chr(code)}"
+
+
+def instance_device_names(instance):
+    """Return the root and block-device-mapping names of an instance description"""
+    used_devices = set()
+    if 'RootDeviceName' in instance:
+        used_devices.add(instance['RootDeviceName'])
+    for mapping in instance.get('BlockDeviceMappings', []):
+        used_devices.add(mapping['DeviceName'])
+    return used_devices
+
+
+def get_used_device_names(ec2, instance_id):
+    """Return the device names in use on an instance, from one describe_instances call"""
+    response = ec2.describe_instances(InstanceIds=[instance_id])
+    return instance_device_names(response['Reservations'][0]['Instances'][0])
+
+
+def is_device_conflict(error):
+    """Return True if an attach_volume error means the device name is already taken"""
+    if not isinstance(error, ClientError):
+        return False
+    err = error.response.get('Error', {})
+    return err.get('Code') == 'InvalidParameterValue' and 'already in use' in err.get('Message', '')
+
+
+class DeviceAllocator:
+    """Hand out device names for one instance without a describe_instances call per attach
+
+    The instance's block-device mappings are loaded once. Names are then
+    reserved locally under a lock as they are handed out, so attachments that
+    are still in flight are never handed out twice. AWS is only asked again
+    when an attach fails because the name turned out to be taken.
+    """
+
+    def __init__(self, ec2, instance_id):
+        self.ec2 = ec2
+        self.instance_id = instance_id
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._known_used = None
+        self._reserved = set()
+
+    def load(self):
+        """Fetch the instance's device names from AWS and return every name in use"""
+        used = get_used_device_names(self.ec2, self.instance_id)
+        with self._lock:
+            self._known_used = used
+            return self._known_used | self._reserved
+
+    def reserve(self):
+        """Reserve and return the next free device name"""
+        if self._known_used is None:
+            # Only the first of several concurrent attaches loads the mappings
+            with self._load_lock:
+                if self._known_used is None:
+                    self.load()
+        with self._lock:
+            used = self._known_used | self._reserved
+            for device_name in candidate_device_names():
+                if device_name not in used:
+                    self._reserved.add(device_name)
+                    return device_name
+        raise Exception("No available device names found")
+
+    def release(self, device_name):
+        """Return a reserved name whose attachment never happened"""
+        with self._lock:
+            self._reserved.discard(device_name)
+
+    def reconcile(self, conflicting=None):
+        """Reload used names from AWS after a conflict, keeping local reservations"""
+        with self._lock:
+            if conflicting:
+                self._reserved.discard(conflicting)
+        used = self.load()
+        if conflicting:
+            with self._lock:
+                self._known_used.add(conflicting)
+        return used
+
+    def attach(self, volume_id, on_device=None):
+        """Attach a volume on a freshly reserved device name and return the name
+
+        ``on_device`` is called with the chosen name just before each attempt.
+        The name stays reserved after the call, so if the attachment is later
+        dropped, attaching the volume again picks a different name.
+        """
+        for _ in range(MAX_CONFLICT_RETRIES):
+            device_name = self.reserve()
+            if on_device:
+                on_device(device_name)
+            try:
+                self.ec2.attach_volume(InstanceId=self.instance_id, VolumeId=volume_id, Device=device_name)
+                return device_name
+            except ClientError as e:
+                if not is_device_conflict(e):
+                    self.release(device_name)
+                    raise
+                self.reconcile(device_name)
+        raise Exception(f"Could not find a free device name for {volume_id} after {MAX_CONFLICT_RETRIES} attempts")
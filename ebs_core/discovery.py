@@ -0,0 +1,236 @@
+"""Paginated, server-side filtered instance discovery with a searchable selection prompt"""
+from ebs_core.clients import list_profiles
+
+PAGE_SIZE = 500
+
+
+def select_profile():
+    """Prompt for one of the configured AWS profiles and return it, or None to quit"""
+    profiles = list_profiles()
+    if not profiles:
+        print("No AWS profiles found. Please configure your AWS credentials.")
+        return None
+
+    print("\nAvailable AWS Profiles:")
+    for idx, prof in enumerate(profiles):
+        print(f"[{idx+1}] {prof}")
+
+    while True:
+        try:
+            prof_input = input(f"Select profile (1-{len(profiles)}) or * to quit: ").strip()
+            if prof_input == '*':
+                print("Goodbye!")
+                return None
+            prof_idx = int(prof_input)
+            if 1 <= prof_idx <= len(profiles):
+                return profiles[prof_idx-1]
+        except ValueError:
+            pass
+        print("Invalid selection.")
+
+
+def instance_filters(state='running', az=None, tags=(), id_prefix=None):
+    """Build describe_instances filters
+
+    ``tags`` is a list of ``(key, value)`` pairs; an empty value matches any
+    instance that has the key.
+    """
+    filters = []
+    if state and state != 'any':
+        filters.append({'Name': 'instance-state-name', 'Values': [state]})
+    if az:
+        filters.append({'Name': 'availability-zone', 'Values': [az]})
+    for key, value in tags:
+        if value:
+            filters.append({'Name': f'tag:{key}', 'Values': [value]})
+        else:
+            filters.append({'Name': 'tag-key', 'Values': [key]})
+    if id_prefix:
+        filters.append({'Name': 'instance-id', 'Values': [f'{id_prefix}*']})
+    return filters
+
+
+def instance_name(instance):
+    """Return the Name tag of an instance description"""
+    return next((tag['Value'] for tag in instance.get('Tags', []) if tag['Key'] == 'Name'), 'No Name')
+
+
+def summarize_instance(instance):
+    """Reduce a describe_instances entry to the fields the scripts use"""
+    return {
+        'InstanceId': instance['InstanceId'],
+        'Name': instance_name(instance),
+        'AvailabilityZone': instance['Placement']['AvailabilityZone'],
+        'InstanceType': instance.get('InstanceType'),
+        'State': instance.get('State', {}).get('Name'),
+        'RootDeviceName': instance.get('RootDeviceName'),
+        # EC2 only sets Platform for Windows instances
+        'Platform': instance.get('Platform', 'linux'),
+        'BlockDeviceMappings': [
+            {'DeviceName': m['DeviceName'], 'VolumeId': m.get('Ebs', {}).get('VolumeId')}
+            for m in instance.get('BlockDeviceMappings', [])
+        ]
+    }
+
+
+def iter_instances(ec2, state='running', az=None, tags=(), id_prefix=None):
+    """Yield instance summaries page by page as describe_instances returns them"""
+    paginator = ec2.get_paginator('describe_instances')
+    pages = paginator.paginate(
+        Filters=instance_filters(state, az, tags, id_prefix),
+        PaginationConfig={'PageSize': PAGE_SIZE}
+    )
+    for page in pages:
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                # The instance-id filter is a wildcard match; keep it a strict prefix
+                if id_prefix and not instance['InstanceId'].startswith(id_prefix):
+                    continue
+                yield summarize_instance(instance)
+
+
+def format_instance(index, instance):
+    line = (f"[{index}] InstanceId: {instance['InstanceId']} | Name: {instance['Name']} "
+            f"| {instance['InstanceType']} | {instance['AvailabilityZone']}")
+    if 'Profile' in instance:
+        line += f" | {instance['Profile']}"
+    return line
+
+
+def matches(instance, query):
+    """Return True if every word of ``query`` appears in the instance's ID, name, type or AZ"""
+    haystack = ' '.join(
+        str(instance.get(key) or '') for key in ('InstanceId', 'Name', 'InstanceType', 'AvailabilityZone', 'Profile')
+    ).lower()
+    return all(word in haystack for word in query.lower().split())
+
+
+def _enable_completion(instances):
+    """Tab-complete instance IDs and names at the selection prompt when readline is available"""
+    try:
+        import readline
+    except ImportError:
+        return
+    words = sorted({i['InstanceId'] for i in instances} | {i['Name'] for i in instances})
+
+    def complete(text, state):
+        options = [w for w in words if w.lower().startswith(text.lower())]
+        return options[state] if state < len(options) else None
+
+    readline.set_completer_delims(' ')
+    readline.set_completer(complete)
+    readline.parse_and_bind('tab: complete')
+
+
+def _stream(instance_iter):
+    """Print instances as they are discovered and return them as a list"""
+    instances = []
+    print("\nAvailable EC2 Instances:")
+    for instance in instance_iter:
+        instances.append(instance)
+        print(format_instance(len(instances), instance))
+    if not instances:
+        print("No EC2 instances found.")
+    return instances
+
+
+def _search(instances, query):
+    """Print and return the ``(number, instance)`` pairs matching a search"""
+    shown = [(idx, inst) for idx, inst in enumerate(instances, 1) if matches(inst, query)]
+    if not shown:
+        print(f"No instances match '{query}'.")
+    for idx, instance in shown:
+        print(format_instance(idx, instance))
+    return shown
+
+
+def stream_and_select(instance_iter):
+    """Print instances as they are discovered, then let the user search and pick one
+
+    Typing a number selects that instance, typing text narrows the list to the
+    instances whose ID, name, type or AZ contain every word, an empty line
+    clears the search and ``*`` quits. Returns the selected instance summary,
+    or None if there was nothing to select or the user quit.
+    """
+    instances = _stream(instance_iter)
+    if not instances:
+        return None
+
+    _enable_completion(instances)
+    while True:
+        selection_input = input(
+            f"\nSelect instance (1-{len(instances)}), type to search, or * to quit: "
+        ).strip()
+        if selection_input == '*':
+            print("Goodbye!")
+            return None
+        if selection_input.isdigit():
+            selection = int(selection_input)
+            if 1 <= selection <= len(instances):
+                return instances[selection-1]
+            print("Invalid selection.")
+            continue
+
+        if selection_input:
+            matched = [(idx, inst) for idx, inst in enumerate(instances, 1) if matches(inst, selection_input)]
+            if len(matched) == 1:
+                idx, instance = matched[0]
+                confirm = input(f"Use {format_instance(idx, instance)}? (y/n): ").strip().lower()
+                if confirm in ('y', 'yes'):
+                    return instance
+                continue
+        _search(instances, selection_input)
+
+
+def parse_selection(text, count):
+    """Parse a selection such as ``1,3,5-7`` into sorted 1-based numbers, or None if invalid"""
+    numbers = set()
+    for part in text.replace(' ', '').split(','):
+        low, sep, high = part.partition('-')
+        if not low.isdigit() or (sep and not high.isdigit()):
+            return None
+        low = int(low)
+        high = int(high) if sep else low
+        if not 1 <= low <= high <= count:
+            return None
+        numbers.update(range(low, high + 1))
+    return sorted(numbers)
+
+
+def stream_and_select_many(instance_iter):
+    """Like ``stream_and_select`` but returns a list of instances
+
+    Accepts numbers and ranges such as ``1,3,5-7``, or ``all`` for every
+    instance in the current search. Returns an empty list if the user quit.
+    """
+    instances = _stream(instance_iter)
+    if not instances:
+        return []
+
+    _enable_completion(instances)
+    shown = list(enumerate(instances, 1))
+    while True:
+        selection_input = input(
+            f"\nSelect instances (e.g. 1,3,5-7 or all), type to search, or * to quit: "
+        ).strip()
+        if selection_input == '*':
+            print("Goodbye!")
+            return []
+        if selection_input.lower() == 'all':
+            selected = shown
+        elif selection_input and selection_input[0].isdigit():
+            numbers = parse_selection(selection_input, len(instances))
+            if numbers is None:
+                print("Invalid selection.")
+                continue
+            selected = [(n, instances[n-1]) for n in numbers]
+        else:
+            shown = _search(instances, selection_input)
+            continue
+
+        print(f"\nSelected {len(selected)} instance(s):")
+        for idx, instance in selected:
+            print(f"  {format_instance(idx, instance)}")
+        confirm = input("Continue with these instances? (y/n): ").strip().lower()
+        if confirm in ('y', 'yes'):
+            return [instance for _, instance in selected]
@@ -0,0 +1,539 @@
+"""In-process stand-in for the EC2 API calls the scripts make, with simulated latency
+
+``FakeEC2`` keeps instances and volumes in memory and moves them through
+their states on a timer, so provisioning runs can be timed and counted
+without an AWS account::
+
+    ec2 = FakeEC2(latency=0.02, create_delay=0.5, throttle_rate=0.05)
+    instance_id = ec2.add_instance(name='sql-node-1')
+    ec2.fail('attach_volume', 'VolumeInUse', count=1)
+
+Errors are raised as botocore ``ClientError`` with the codes EC2 uses, so
+the retry and error handling paths run exactly as they would against AWS.
+"""
+import fnmatch
+import itertools
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+
+# EbsOptimizedInfo for a few common types: (baseline Mbps, MB/s, IOPS, maximum Mbps, MB/s, IOPS)
+INSTANCE_TYPE_EBS = {
+    'm5.large': (650, 81.25, 3600, 4750, 593.75, 18750),
+    'm5.xlarge': (1150, 143.75, 6000, 4750, 593.75, 18750),
+    'm5.2xlarge': (2300, 287.5, 12000, 4750, 593.75, 18750),
+    'r5.4xlarge': (4750, 593.75, 18750, 4750, 593.75, 18750),
+    'r5.8xlarge': (6800, 850.0, 30000, 6800, 850.0, 30000),
+    'r6i.16xlarge': (20000, 2500.0, 80000, 20000, 2500.0, 80000),
+}
+
+
+def client_error(code, operation, message=None):
+    return ClientError({'Error': {'Code': code, 'Message': message or code}}, operation)
+
+
+def _operation_name(action):
+    return ''.join(part.title() for part in action.split('_'))
+
+
+class FakeEC2:
+    """Thread-safe fake of describe_instances, describe_instance_types,
+    create_volume, create_tags, describe_volumes, attach_volume, detach_volume,
+    delete_volume and modify_volume
+
+    ``latency`` is added to every call. ``create_delay``, ``attach_delay`` and
+    ``modify_delay`` are the seconds a volume spends creating, attaching (or
+    detaching) and modifying. ``throttle_rate`` is the chance that any call fails with
+    RequestLimitExceeded, ``error_rate`` the chance that a new volume
+    ends up in the 'error' state instead of 'available', and
+    ``attach_failure_rate`` the chance that an attachment is dropped, leaving
+    the volume available again, instead of completing.
+    """
+
+    def __init__(self, region='us-east-1', latency=0.0, create_delay=0.5, attach_delay=0.2,
+                 modify_delay=0.5, throttle_rate=0.0, error_rate=0.0, attach_failure_rate=0.0, seed=None):
+        self.region = region
+        self.latency = latency
+        self.create_delay = create_delay
+        self.attach_delay = attach_delay
+        self.modify_delay = modify_delay
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.attach_failure_rate = attach_failure_rate
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.call_log = []
+        self.instances = {}
+        self.volumes = {}
+        self.modifications = {}
+        self._client_tokens = {}
+        self._failures = []
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+
+    # -- setup ---------------------------------------------------------------
+
+    def add_instance(self, instance_id=None, name=None, az=None, instance_type='m5.xlarge',
+                     state='running', root_device='/dev/xvda', tags=None, platform=None):
+        """Add an instance with only its root volume attached and return its ID"""
+        with self._lock:
+            instance_id = instance_id or f"i-{next(self._ids):017x}"
+            az = az or f"{self.region}a"
+            root_volume = self._new_volume_id()
+            self.volumes[root_volume] = {
+                'VolumeId': root_volume,
+                'AvailabilityZone': az,
+                'Size': 8,
+                'VolumeType': 'gp3',
+                'State': 'in-use',
+                'Tags': [],
+                'Attachments': [{
+                    'VolumeId': root_volume, 'InstanceId': instance_id,
+                    'Device': root_device, 'State': 'attached'
+                }],
+                '_ready_at': 0
+            }
+            instance_tags = [{'Key': k, 'Value': v} for k, v in (tags or {}).items()]
+            if name:
+                instance_tags.append({'Key': 'Name', 'Value': name})
+            self.instances[instance_id] = {
+                'InstanceId': instance_id,
+                'InstanceType': instance_type,
+                'Placement': {'AvailabilityZone': az},
+                'State': {'Name': state},
+                'RootDeviceName': root_device,
+                'Tags': instance_tags,
+                'BlockDeviceMappings': [
+                    {'DeviceName': root_device, 'Ebs': {'VolumeId': root_volume, 'Status': 'attached'}}
+                ]
+            }
+            if platform == 'windows':
+                # EC2 only sets Platform for Windows instances
+                self.instances[instance_id]['Platform'] = 'windows'
+            return instance_id
+
+    def add_volume(self, instance_id=None, device=None, size=100, volume_type='gp3', tags=None):
+        """Add an available volume, attached to ``instance_id`` as ``device`` if given, and return its ID"""
+        with self._lock:
+            volume_id = self._new_volume_id()
+            instance = self.instances.get(instance_id)
+            az = instance['Placement']['AvailabilityZone'] if instance else f"{self.region}a"
+            self.volumes[volume_id] = {
+                'VolumeId': volume_id,
+                'AvailabilityZone': az,
+                'Size': size,
+                'VolumeType': volume_type,
+                'Encrypted': True,
+                'State': 'in-use' if instance else 'available',
+                'Tags': [{'Key': k, 'Value': v} for k, v in (tags or {}).items()],
+                'Attachments': [],
+                '_ready_at': 0
+            }
+            if instance:
+                self.volumes[volume_id]['Attachments'].append({
+                    'VolumeId': volume_id, 'InstanceId': instance_id, 'Device': device, 'State': 'attached'
+                })
+                instance['BlockDeviceMappings'].append(
+                    {'DeviceName': device, 'Ebs': {'VolumeId': volume_id, 'Status': 'attached'}}
+                )
+            return volume_id
+
+    def fail(self, action, code, message=None, count=1, match=None):
+        """Make the next ``count`` calls to ``action`` fail with ``code``
+
+        ``match`` is an optional predicate over the call's keyword arguments.
+        """
+        with self._lock:
+            self._failures.append({'action': action, 'code': code, 'message': message,
+                                   'count': count, 'match': match})
+
+    # -- plumbing ------------------------------------------------------------
+
+    def _new_volume_id(self):
+        return f"vol-{next(self._ids):017x}"
+
+    def _enter(self, action, kwargs):
+        """Record a call, sleep for the simulated latency and raise any injected error"""
+        started = time.monotonic()
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls[action] += 1
+            self.call_log.append((action, started, time.monotonic()))
+            for failure in self._failures:
+                if failure['action'] == action and failure['count'] > 0 and \
+                        (failure['match'] is None or failure['match'](kwargs)):
+                    failure['count'] -= 1
+                    raise client_error(failure['code'], _operation_name(action), failure['message'])
+            if self.throttle_rate and self._random.random() < self.throttle_rate:
+                self.throttled[action] += 1
+                raise client_error('RequestLimitExceeded', _operation_name(action),
+                                   "Request limit exceeded.")
+        if kwargs.get('DryRun'):
+            raise client_error('DryRunOperation', _operation_name(action),
+                               "Request would have succeeded, but DryRun flag is set.")
+
+    def _refresh(self, volume):
+        """Advance a volume and its attachment through their timed states"""
+        now = time.monotonic()
+        if volume['State'] == 'creating' and now >= volume['_ready_at']:
+            volume['State'] = volume.pop('_final_state', 'available')
+        for attachment in list(volume['Attachments']):
+            if attachment['State'] == 'attaching' and now >= attachment.get('_ready_at', 0) \
+                    and attachment.get('_dropped'):
+                volume['Attachments'].remove(attachment)
+                volume['State'] = 'available'
+                self._unmap(attachment['InstanceId'], volume['VolumeId'])
+            elif attachment['State'] == 'attaching' and now >= attachment.get('_ready_at', 0):
+                attachment['State'] = 'attached'
+                attachment.pop('_ready_at', None)
+                self._set_mapping_status(attachment['InstanceId'], volume['VolumeId'], 'attached')
+            if attachment['State'] == 'detaching' and now >= attachment.get('_ready_at', 0):
+                volume['Attachments'].remove(attachment)
+                if not volume['Attachments']:
+                    volume['State'] = 'available'
+                self._unmap(attachment['InstanceId'], volume['VolumeId'])
+
+    def _set_mapping_status(self, instance_id, volume_id, status):
+        instance = self.instances.get(instance_id)
+        for mapping in instance['BlockDeviceMappings'] if instance else ():
+            if mapping['Ebs']['VolumeId'] == volume_id:
+                mapping['Ebs']['Status'] = status
+
+    def _unmap(self, instance_id, volume_id):
+        instance = self.instances.get(instance_id)
+        if instance:
+            instance['BlockDeviceMappings'] = [
+                m for m in instance['BlockDeviceMappings'] if m['Ebs']['VolumeId'] != volume_id
+            ]
+
+    def _public_volume(self, volume):
+        self._refresh(volume)
+        result = {k: v for k, v in volume.items() if not k.startswith('_')}
+        result['Attachments'] = [
+            {k: v for k, v in a.items() if not k.startswith('_')} for a in volume['Attachments']
+        ]
+        result['Tags'] = list(volume['Tags'])
+        return result
+
+    @staticmethod
+    def _matches(resource, filters, getters):
+        for f in filters or ():
+            name = f['Name']
+            if name.startswith('tag:'):
+                value = next((t['Value'] for t in resource.get('Tags', []) if t['Key'] == name[4:]), None)
+            elif name == 'tag-key':
+                if not any(t['Key'] in f['Values'] for t in resource.get('Tags', [])):
+                    return False
+                continue
+            elif name in getters:
+                value = getters[name](resource)
+            else:
+                raise client_error('InvalidParameterValue', 'Describe', f"The filter '{name}' is invalid")
+            if not any(_wildcard_match(pattern, value) for pattern in f['Values']):
+                return False
+        return True
+
+    # -- instances -----------------------------------------------------------
+
+    def describe_instances(self, InstanceIds=None, Filters=None, MaxResults=None, NextToken=None, **kwargs):
+        self._enter('describe_instances', kwargs)
+        getters = {
+            'instance-id': lambda i: i['InstanceId'],
+            'instance-state-name': lambda i: i['State']['Name'],
+            'availability-zone': lambda i: i['Placement']['AvailabilityZone'],
+            'instance-type': lambda i: i['InstanceType'],
+        }
+        with self._lock:
+            if InstanceIds:
+                missing = [i for i in InstanceIds if i not in self.instances]
+                if missing:
+                    raise client_error('InvalidInstanceID.NotFound', 'DescribeInstances',
+                                       f"The instance IDs '{', '.join(missing)}' do not exist")
+            candidates = [self.instances[i] for i in InstanceIds] if InstanceIds else list(self.instances.values())
+            matched = [dict(i) for i in candidates if self._matches(i, Filters, getters)]
+        page, next_token = _page(matched, MaxResults, NextToken)
+        response = {'Reservations': [{'Instances': [i]} for i in page]}
+        if next_token:
+            response['NextToken'] = next_token
+        return response
+
+    def describe_instance_status(self, InstanceIds=None, IncludeAllInstances=False, Filters=None,
+                                 MaxResults=None, NextToken=None, **kwargs):
+        self._enter('describe_instance_status', kwargs)
+        getters = {
+            'instance-state-name': lambda i: i['State']['Name'],
+            'availability-zone': lambda i: i['Placement']['AvailabilityZone'],
+        }
+        with self._lock:
+            statuses = [
+                {'InstanceId': i['InstanceId'], 'InstanceState': dict(i['State']),
+                 'AvailabilityZone': i['Placement']['AvailabilityZone']}
+                for i in self.instances.values()
+                if (not InstanceIds or i['InstanceId'] in InstanceIds)
+                and (IncludeAllInstances or i['State']['Name'] == 'running')
+                and self._matches(i, Filters, getters)
+            ]
+        page, next_token = _page(statuses, MaxResults, NextToken)
+        response = {'InstanceStatuses': page}
+        if next_token:
+            response['NextToken'] = next_token
+        return response
+
+    def describe_instance_types(self, InstanceTypes=None, **kwargs):
+        self._enter('describe_instance_types', kwargs)
+        unknown = [t for t in InstanceTypes or [] if t not in INSTANCE_TYPE_EBS]
+        if unknown:
+            raise client_error('InvalidInstanceType', 'DescribeInstanceTypes',
+                               f"The following supplied instance types do not exist: [{', '.join(unknown)}]")
+        types = []
+        for instance_type in InstanceTypes or sorted(INSTANCE_TYPE_EBS):
+            base_mbps, base_mb, base_iops, max_mbps, max_mb, max_iops = INSTANCE_TYPE_EBS[instance_type]
+            types.append({
+                'InstanceType': instance_type,
+                'EbsInfo': {
+                    'EbsOptimizedSupport': 'default',
+                    'NvmeSupport': 'required',
+                    'EbsOptimizedInfo': {
+                        'BaselineBandwidthInMbps': base_mbps,
+                        'BaselineThroughputInMBps': base_mb,
+                        'BaselineIops': base_iops,
+                        'MaximumBandwidthInMbps': max_mbps,
+                        'MaximumThroughputInMBps': max_mb,
+                        'MaximumIops': max_iops
+                    }
+                }
+            })
+        return {'InstanceTypes': types}
+
+    # -- volumes -------------------------------------------------------------
+
+    def create_volume(self, AvailabilityZone, Size=None, VolumeType='gp2', Iops=None, Throughput=None,
+                      Encrypted=False, TagSpecifications=None, ClientToken=None, KmsKeyId=None, **kwargs):
+        self._enter('create_volume', {**kwargs, 'ClientToken': ClientToken})
+        with self._lock:
+            if ClientToken and ClientToken in self._client_tokens:
+                volume = self.volumes[self._client_tokens[ClientToken]]
+                return self._public_volume(volume)
+            volume_id = self._new_volume_id()
+            tags = []
+            for spec in TagSpecifications or ():
+                if spec.get('ResourceType') == 'volume':
+                    tags.extend(dict(t) for t in spec['Tags'])
+            volume = {
+                'VolumeId': volume_id,
+                'AvailabilityZone': AvailabilityZone,
+                'Size': Size,
+                'VolumeType': VolumeType,
+                'Encrypted': Encrypted,
+                'State': 'creating',
+                'Tags': tags,
+                'Attachments': [],
+                'CreateTime': datetime.now(timezone.utc),
+                '_ready_at': time.monotonic() + self.create_delay
+            }
+            if VolumeType == 'gp3':
+                # EC2 reports the included gp3 baseline when none is provisioned
+                Iops, Throughput = Iops or 3000, Throughput or 125
+            if Iops:
+                volume['Iops'] = Iops
+            if Throughput:
+                volume['Throughput'] = Throughput
+            if self.error_rate and self._random.random() < self.error_rate:
+                volume['_final_state'] = 'error'
+            self.volumes[volume_id] = volume
+            if ClientToken:
+                self._client_tokens[ClientToken] = volume_id
+            return self._public_volume(volume)
+
+    def create_tags(self, Resources, Tags, **kwargs):
+        self._enter('create_tags', kwargs)
+        with self._lock:
+            for resource_id in Resources:
+                volume = self.volumes.get(resource_id)
+                if volume is None:
+                    raise client_error('InvalidVolume.NotFound', 'CreateTags',
+                                       f"The volume '{resource_id}' does not exist.")
+                keys = {t['Key'] for t in Tags}
+                volume['Tags'] = [t for t in volume['Tags'] if t['Key'] not in keys] + [dict(t) for t in Tags]
+        return {}
+
+    def describe_volumes(self, VolumeIds=None, Filters=None, MaxResults=None, NextToken=None, **kwargs):
+        self._enter('describe_volumes', kwargs)
+        getters = {
+            'volume-id': lambda v: v['VolumeId'],
+            'status': lambda v: v['State'],
+            'availability-zone': lambda v: v['AvailabilityZone'],
+            'attachment.instance-id': lambda v: next((a['InstanceId'] for a in v['Attachments']), None),
+        }
+        with self._lock:
+            if VolumeIds:
+                missing = [v for v in VolumeIds if v not in self.volumes]
+                if missing:
+                    raise client_error('InvalidVolume.NotFound', 'DescribeVolumes',
+                                       f"The volume '{missing[0]}' does not exist.")
+            candidates = [self.volumes[v] for v in VolumeIds] if VolumeIds else list(self.volumes.values())
+            for volume in candidates:
+                self._refresh(volume)
+            matched = [self._public_volume(v) for v in candidates if self._matches(v, Filters, getters)]
+        page, next_token = _page(matched, MaxResults, NextToken)
+        response = {'Volumes': page}
+        if next_token:
+            response['NextToken'] = next_token
+        return response
+
+    def attach_volume(self, InstanceId, VolumeId, Device, **kwargs):
+        self._enter('attach_volume', kwargs)
+        with self._lock:
+            instance = self.instances.get(InstanceId)
+            if instance is None:
+                raise client_error('InvalidInstanceID.NotFound', 'AttachVolume',
+                                   f"The instance ID '{InstanceId}' does not exist")
+            volume = self.volumes.get(VolumeId)
+            if volume is None:
+                raise client_error('InvalidVolume.NotFound', 'AttachVolume',
+                                   f"The volume '{VolumeId}' does not exist.")
+            self._refresh(volume)
+            if volume['State'] != 'available':
+                raise client_error('IncorrectState', 'AttachVolume',
+                                   f"vol '{VolumeId}' is not 'available'.")
+            if volume['AvailabilityZone'] != instance['Placement']['AvailabilityZone']:
+                raise client_error('InvalidVolume.ZoneMismatch', 'AttachVolume',
+                                   "The volume is not in the same availability zone as the instance")
+            if any(m['DeviceName'] == Device for m in instance['BlockDeviceMappings']):
+                raise client_error('InvalidParameterValue', 'AttachVolume',
+                                   f"Invalid value '{Device}' for unixDevice. "
+                                   f"Attachment point {Device} is already in use")
+            attachment = {
+                'VolumeId': VolumeId, 'InstanceId': InstanceId, 'Device': Device,
+                'State': 'attaching', 'AttachTime': time.time(),
+                '_ready_at': time.monotonic() + self.attach_delay,
+                '_dropped': bool(self.attach_failure_rate) and self._random.random() < self.attach_failure_rate
+            }
+            volume['Attachments'] = [attachment]
+            volume['State'] = 'in-use'
+            instance['BlockDeviceMappings'].append(
+                {'DeviceName': Device, 'Ebs': {'VolumeId': VolumeId, 'Status': 'attaching'}}
+            )
+            return {k: v for k, v in attachment.items() if not k.startswith('_')}
+
+    def detach_volume(self, VolumeId, InstanceId=None, Device=None, Force=False, **kwargs):
+        self._enter('detach_volume', kwargs)
+        with self._lock:
+            volume = self.volumes.get(VolumeId)
+            if volume is None:
+                raise client_error('InvalidVolume.NotFound', 'DetachVolume',
+                                   f"The volume '{VolumeId}' does not exist.")
+            self._refresh(volume)
+            attachment = next((a for a in volume['Attachments']
+                               if InstanceId is None or a['InstanceId'] == InstanceId), None)
+            if attachment is None:
+                raise client_error('IncorrectState', 'DetachVolume', f"Volume '{VolumeId}' is in the "
+                                   f"'{volume['State']}' state.")
+            if attachment['State'] != 'detaching':
+                attachment['State'] = 'detaching'
+                attachment['_ready_at'] = time.monotonic() + self.attach_delay
+                self._set_mapping_status(attachment['InstanceId'], VolumeId, 'detaching')
+            return {k: v for k, v in attachment.items() if not k.startswith('_')}
+
+    def delete_volume(self, VolumeId, **kwargs):
+        self._enter('delete_volume', kwargs)
+        with self._lock:
+            volume = self.volumes.get(VolumeId)
+            if volume is None:
+                raise client_error('InvalidVolume.NotFound', 'DeleteVolume',
+                                   f"The volume '{VolumeId}' does not exist.")
+            self._refresh(volume)
+            if volume['State'] not in ('available', 'error'):
+                raise client_error('VolumeInUse', 'DeleteVolume', f"Volume {VolumeId} is currently attached")
+            # EC2 shows a deleted volume as 'deleting' for a short while; here it goes at once
+            del self.volumes[VolumeId]
+            return {}
+
+    def modify_volume(self, VolumeId, Size=None, VolumeType=None, Iops=None, Throughput=None, **kwargs):
+        self._enter('modify_volume', kwargs)
+        with self._lock:
+            volume = self.volumes.get(VolumeId)
+            if volume is None:
+                raise client_error('InvalidVolume.NotFound', 'ModifyVolume',
+                                   f"The volume '{VolumeId}' does not exist.")
+            current = self.modifications.get(VolumeId)
+            if current and self._modification_state(current) in ('modifying', 'optimizing'):
+                raise client_error('IncorrectModificationState', 'ModifyVolume',
+                                   f"Volume {VolumeId} is already being modified")
+            now = time.monotonic()
+            modification = {
+                'VolumeId': VolumeId,
+                'OriginalSize': volume['Size'], 'TargetSize': Size or volume['Size'],
+                'OriginalVolumeType': volume['VolumeType'], 'TargetVolumeType': VolumeType or volume['VolumeType'],
+                'OriginalIops': volume.get('Iops'), 'TargetIops': Iops or volume.get('Iops'),
+                'OriginalThroughput': volume.get('Throughput'),
+                'TargetThroughput': Throughput or volume.get('Throughput'),
+                'StartTime': datetime.now(timezone.utc),
+                '_optimizing_at': now + self.modify_delay,
+                '_completed_at': now + 2 * self.modify_delay
+            }
+            self.modifications[VolumeId] = modification
+            for key, target in (('Size', 'TargetSize'), ('VolumeType', 'TargetVolumeType'),
+                                ('Iops', 'TargetIops'), ('Throughput', 'TargetThroughput')):
+                if modification[target] is not None:
+                    volume[key] = modification[target]
+            return {'VolumeModification': self._public_modification(modification)}
+
+    def _modification_state(self, modification):
+        now = time.monotonic()
+        if now >= modification['_completed_at']:
+            return 'completed'
+        if now >= modification['_optimizing_at']:
+            return 'optimizing'
+        return 'modifying'
+
+    def _public_modification(self, modification):
+        result = {k: v for k, v in modification.items() if not k.startswith('_')}
+        result['ModificationState'] = self._modification_state(modification)
+        result['Progress'] = 100 if result['ModificationState'] == 'completed' else 50
+        return result
+
+    def describe_volumes_modifications(self, VolumeIds=None, Filters=None, MaxResults=None, NextToken=None,
+                                       **kwargs):
+        self._enter('describe_volumes_modifications', kwargs)
+        getters = {
+            'volume-id': lambda m: m['VolumeId'],
+            'modification-state': lambda m: self._modification_state(m),
+        }
+        with self._lock:
+            if VolumeIds:
+                missing = [v for v in VolumeIds if v not in self.modifications]
+                if missing:
+                    raise client_error('InvalidVolumeModification.NotFound', 'DescribeVolumesModifications',
+                                       f"Modification for volume '{missing[0]}' does not exist.")
+            candidates = [self.modifications[v] for v in VolumeIds] if VolumeIds else list(self.modifications.values())
+            matched = [self._public_modification(m) for m in candidates if self._matches(m, Filters, getters)]
+        page, next_token = _page(matched, MaxResults, NextToken)
+        response = {'VolumesModifications': page}
+        if next_token:
+            response['NextToken'] = next_token
+        return response
+
+
+def _wildcard_match(pattern, value):
+    """Match an EC2 filter value, where '*' matches any run of characters"""
+    if value is None:
+        return False
+    if '*' not in pattern:
+        return pattern == value
+    return fnmatch.fnmatchcase(value, pattern)
+
+
+def _page(items, max_results, next_token):
+    start = int(next_token or 0)
+    if not max_results:
+        return items[start:], None
+    end = start + max_results
+    return items[start:end], (str(end) if end < len(items) else None)
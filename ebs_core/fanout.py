@@ -0,0 +1,143 @@
+"""Run discovery and provisioning across several profiles and regions in parallel"""
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from ebs_core.metrics import phase
+from ebs_core.pipeline import log
+
+
+def target_for(clients, instance):
+    """Return the ``(profile, region)`` key an instance summary was discovered through"""
+    if len(clients) == 1:
+        return next(iter(clients))
+    return (instance['Profile'], instance['Region'])
+
+
+def target_label(target):
+    profile, region = target
+    return f"{profile}/{region}"
+
+
+def fan_out(func, clients, timeout=None, on_result=None):
+    """Call ``func(target, client)`` for every target in parallel
+
+    Returns one outcome dict per target with its status ('ok', 'failed' or
+    'timed out'), result, error and elapsed time. ``on_result`` is called with
+    each outcome as soon as its target finishes, so a slow or throttled region
+    never holds up reporting for the others. Targets still running after
+    ``timeout`` seconds are reported as timed out and their results discarded.
+    """
+    outcomes = {
+        target: {
+            'profile': target[0],
+            'region': target[1],
+            'status': 'timed out',
+            'result': None,
+            'error': None,
+            'elapsed_seconds': None
+        }
+        for target in clients
+    }
+    started = time.monotonic()
+
+    def run(target, client):
+        begin = time.monotonic()
+        try:
+            return func(target, client)
+        finally:
+            outcomes[target]['elapsed_seconds'] = round(time.monotonic() - begin, 3)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, len(clients)))
+    futures = {executor.submit(run, target, client): target for target, client in clients.items()}
+    pending = set(futures)
+    try:
+        while pending:
+            remaining = None if timeout is None else timeout - (time.monotonic() - started)
+            if remaining is not None and remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                outcome = outcomes[futures[future]]
+                try:
+                    outcome['result'] = future.result()
+                    outcome['status'] = 'ok'
+                except Exception as e:
+                    outcome['status'] = 'failed'
+                    outcome['error'] = str(e)
+                if on_result:
+                    on_result(outcome)
+    finally:
+        # Do not wait for timed-out targets; they finish in the background
+        executor.shutdown(wait=not pending, cancel_futures=True)
+
+    for future in pending:
+        outcome = outcomes[futures[future]]
+        outcome['error'] = f"No response within {timeout}s"
+        log(f"{target_label(futures[future])}: {outcome['error']}")
+    return list(outcomes.values())
+
+
+def discover(clients, list_instances, timeout=None):
+    """Yield instances from every target, each target's list as soon as it finishes
+
+    ``list_instances(target, client)`` returns the instance summaries for one
+    target; each summary is tagged with its ``Profile`` and ``Region``.
+    """
+    finished = queue.Queue()
+
+    def collect(target, client):
+        instances = []
+        with phase('discovery'):
+            for instance in list_instances(target, client):
+                instances.append({**instance, 'Profile': target[0], 'Region': target[1]})
+        return instances
+
+    def report(outcome):
+        label = target_label((outcome['profile'], outcome['region']))
+        if outcome['status'] == 'ok':
+            log(f"{label}: {len(outcome['result'])} instance(s) in {outcome['elapsed_seconds']}s")
+            finished.put(outcome['result'])
+        else:
+            log(f"{label}: discovery failed: {outcome['error']}")
+
+    def run():
+        try:
+            fan_out(collect, clients, timeout, report)
+        finally:
+            finished.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+    while True:
+        instances = finished.get()
+        if instances is None:
+            return
+        yield from instances
+
+
+def merge_reports(outcomes, batch_id):
+    """Merge per-target provisioning reports into one report"""
+    merged = {
+        'batch_id': batch_id,
+        'targets': [],
+        'instances': []
+    }
+    for outcome in outcomes:
+        report = outcome['result'] or {}
+        merged['targets'].append({
+            'profile': outcome['profile'],
+            'region': outcome['region'],
+            'status': outcome['status'],
+            'error': outcome['error'],
+            'elapsed_seconds': outcome['elapsed_seconds']
+        })
+        for instance in report.get('instances', []):
+            merged['instances'].append({**instance, 'profile': outcome['profile'], 'region': outcome['region']})
+    elapsed = [o['elapsed_seconds'] for o in outcomes if o['elapsed_seconds'] is not None]
+    merged['elapsed_seconds'] = max(elapsed) if elapsed else 0
+    merged['succeeded'] = (
+        all(o['status'] == 'ok' for o in outcomes)
+        and all(i['status'] == 'ok' for i in merged['instances'])
+    )
+    return merged
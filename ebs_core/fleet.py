@@ -0,0 +1,179 @@
+"""Provision the same or different volume sets on many instances at once"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ebs_core.devices import DeviceAllocator
+from ebs_core.pipeline import DEFAULT_MAX_WORKERS, Pipeline, log
+from ebs_core.tags import RAID_SET_KEY, batch_tags
+
+# Instance drivers only poll and hand work to the worker pools, so they are cheap
+MAX_INSTANCE_DRIVERS = 32
+
+
+def disk_names(volume_set, name_format):
+    """Return the Name tag of every disk in a volume set"""
+    if volume_set.get('names'):
+        return list(volume_set['names'])
+    if volume_set['disks'] == 1:
+        return [volume_set['name']]
+    return [name_format.format(name=volume_set['name'], n=n) for n in range(1, volume_set['disks'] + 1)]
+
+
+def volume_specs(volume_sets, common_tags, name_format):
+    """Return the pipeline spec of every disk in ``volume_sets``, in volume set order"""
+    specs = []
+    for volume_set in volume_sets:
+        tags = {**common_tags, RAID_SET_KEY: volume_set['name']}
+        for name in disk_names(volume_set, name_format):
+            specs.append({
+                'name': name,
+                'raid_set': volume_set['name'],
+                'size': volume_set['size'],
+                'volume_type': volume_set['type'],
+                'iops': volume_set.get('iops'),
+                'throughput': volume_set.get('throughput'),
+                'tags': tags
+            })
+    return specs
+
+
+def provision_instance(ec2, instance_id, az, volume_sets, common_tags, name_format,
+                       executor=None, max_workers=DEFAULT_MAX_WORKERS, journal=None):
+    """Create and attach every disk of ``volume_sets`` on one instance
+
+    Returns one result dict per disk, in volume set order.
+    """
+    specs = volume_specs(volume_sets, common_tags, name_format)
+    allocator = DeviceAllocator(ec2, instance_id)
+    pipeline = Pipeline(ec2, instance_id, az, allocator, max_workers=max_workers, executor=executor,
+                        journal=journal)
+    results = pipeline.run(specs)
+    volumes = []
+    for spec, result in zip(specs, results):
+        volumes.append({
+            **result,
+            'raid_set': spec['raid_set'],
+            'size': spec['size'],
+            'volume_type': spec['volume_type'],
+            'iops': spec['iops'],
+            'throughput': spec['throughput']
+        })
+    return volumes
+
+
+def provision_fleet(ec2, targets, batch_id, owner=None, extra_tags=None, name_format="{name}-{n}",
+                    executor=None, max_workers=DEFAULT_MAX_WORKERS, journal=None):
+    """Provision ``targets``, a list of ``(instance_id, az, volume_sets)``, concurrently
+
+    With ``executor`` every instance shares that worker pool; without it each
+    instance gets its own pool of ``max_workers``. A target whose ``az`` is
+    None is reported as not found. Every step is recorded in ``journal`` if
+    one is given. Returns a result report.
+    """
+    started = time.time()
+    report = {
+        'batch_id': batch_id,
+        'started_at': started,
+        'instances': []
+    }
+    futures = {}
+    drivers = ThreadPoolExecutor(max_workers=max(1, min(MAX_INSTANCE_DRIVERS, len(targets))))
+    with drivers:
+        for instance_id, az, volume_sets in targets:
+            if az is None:
+                continue
+            log(f"Provisioning {sum(s['disks'] for s in volume_sets)} volume(s) on {instance_id}")
+            common_tags = batch_tags(batch_id, instance_id, owner, extra_tags)
+            futures[instance_id] = drivers.submit(
+                provision_instance, ec2, instance_id, az, volume_sets, common_tags, name_format,
+                executor, max_workers, journal
+            )
+
+        for instance_id, az, _ in targets:
+            entry = {'instance_id': instance_id, 'availability_zone': az}
+            if instance_id not in futures:
+                entry.update({'status': 'failed', 'error': "Instance not found", 'volumes': []})
+                report['instances'].append(entry)
+                continue
+            try:
+                volumes = futures[instance_id].result()
+            except Exception as e:
+                entry.update({'status': 'failed', 'error': str(e), 'volumes': []})
+            else:
+                attached = sum(1 for v in volumes if v['status'] == 'attached')
+                if attached == len(volumes):
+                    status = 'ok'
+                else:
+                    status = 'partial' if attached else 'failed'
+                entry.update({'status': status, 'error': None, 'volumes': volumes})
+            report['instances'].append(entry)
+
+    report['finished_at'] = time.time()
+    report['elapsed_seconds'] = round(report['finished_at'] - started, 3)
+    report['succeeded'] = all(i['status'] == 'ok' for i in report['instances'])
+    return report
+
+
+def write_report(report, path):
+    """Write a result report as JSON"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def attached_after(volume):
+    """Describe how long an attached volume took to be confirmed attached"""
+    # Volumes a resumed run found already attached, and older reports, have no time of their own
+    if volume.get('time_to_attached') is None:
+        return "already attached"
+    return f"attached after {volume['time_to_attached']:.1f}s"
+
+
+def print_report(report):
+    """Print a per-instance summary of a result report"""
+    print(f"\n=== BATCH {report['batch_id']} SUMMARY ===")
+    for instance in report['instances']:
+        volumes = instance['volumes']
+        attached = sum(1 for v in volumes if v['status'] == 'attached')
+        print(f"Instance: {instance['instance_id']} - {instance['status']} "
+              f"({attached}/{len(volumes)} volume(s) attached)")
+        if instance['error']:
+            print(f"  Error: {instance['error']}")
+        for volume in volumes:
+            if volume['status'] == 'attached':
+                print(f"  - {volume['name']} ({volume['volume_id']} on {volume['device']}), {attached_after(volume)}")
+            else:
+                print(f"  - {volume['name']} ({volume['volume_id'] or 'not created'}): {volume['error']}")
+    print(f"Elapsed: {report['elapsed_seconds']}s")
+
+
+def print_raid_summary(report):
+    """Print one RAID-set summary per instance of a result report"""
+    for instance in report['instances']:
+        volumes = instance['volumes']
+        attached = sum(1 for v in volumes if v['status'] == 'attached')
+        location = instance['availability_zone'] or 'unknown AZ'
+        if instance.get('profile'):
+            location = f"{instance['profile']}, {location}"
+        print(f"\nInstance: {instance['instance_id']} ({location}) - "
+              f"{instance['status']}, {attached}/{len(volumes)} volume(s) attached")
+        if instance['error']:
+            print(f"  Error: {instance['error']}")
+            continue
+
+        # Group volumes by RAID set, keeping volume set order
+        volume_groups = {}
+        for volume in volumes:
+            volume_groups.setdefault(volume['raid_set'], []).append(volume)
+        print("  RAID Volume Sets Created:")
+        for raid_set, disks in volume_groups.items():
+            print(f"    {raid_set}: {len(disks)} disk(s)")
+            for disk in disks:
+                if disk['status'] == 'attached':
+                    print(f"      - {disk['name']} ({disk['volume_id']} on {disk['device']}), {attached_after(disk)}")
+                else:
+                    print(f"      - {disk['name']} FAILED ({disk['volume_id'] or 'not created'}): {disk['error']}")
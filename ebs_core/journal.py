@@ -0,0 +1,336 @@
+"""Append-only journal of a batch's progress, so an interrupted run can be resumed
+
+Every disk of a batch gets a create_volume ClientToken derived from the run
+the journal was started by, the instance, the disk's name and how often that
+name was planned before in the batch, so planning the same batch again gives
+every disk the same token, while a later run that reuses the batch ID gets
+new ones. As the run goes, one JSON line per step is appended to
+``journals/<batch id>.jsonl`` in the cache directory: the run's settings,
+each instance's volume sets, and each disk as it is planned, created,
+available, attaching and attached.
+
+``--resume BATCH_ID`` replays the file and carries on from the last step.
+Attached disks are skipped and created ones are waited for and attached.
+The rest are created with their original ClientToken, which EC2 answers with
+the volume a lost response had already created rather than a second one.
+Only the journaled volume IDs are described, so resuming never lists the
+account's volumes.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from ebs_core.cache import cache_dir
+from ebs_core.metrics import phase
+from ebs_core.pipeline import log
+from ebs_core.waiter import FILTER_CHUNK, AttachmentWaiter
+
+# A journaled volume in one of these states, or gone, is created again under a new ClientToken
+REPLACE_STATES = ('error', 'deleting', 'deleted')
+
+
+class JournalError(Exception):
+    """Raised when a batch cannot be resumed from its journal"""
+
+
+def client_token(run_id, instance_id, name, occurrence=1, attempt=0):
+    """Return the create_volume ClientToken of one disk; the same disk of a run always gets the same token"""
+    key = f"{run_id}/{instance_id}/{name}/{occurrence}/{attempt}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def journal_path(batch_id):
+    safe = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in batch_id)
+    return os.path.join(cache_dir(), 'journals', f"{safe}.jsonl")
+
+
+class Journal:
+    """Thread-safe, append-only record of one batch
+
+    An existing journal for ``batch_id`` is replayed on creation. Nothing is
+    written until the first instance is planned, so a run that is abandoned
+    at a prompt leaves no journal behind.
+    """
+
+    def __init__(self, batch_id, path=None):
+        self.batch_id = batch_id
+        self.path = path or journal_path(batch_id)
+        self.run = None
+        self.instances = {}
+        self._disks = {}
+        self._by_token = {}
+        self._occurrences = {}
+        self._pending_run = None
+        self._file = None
+        self._lock = threading.RLock()
+        self._replay()
+        self.run_id = self.run['run_id'] if self.run else uuid.uuid4().hex
+
+    @classmethod
+    def resume(cls, batch_id, script):
+        """Return the journal of a batch started by ``script``; raises ``JournalError`` if there is none"""
+        journal = cls(batch_id)
+        if journal.run is None:
+            raise JournalError(f"No journal for batch {batch_id} in {os.path.dirname(journal.path)}")
+        if journal.run['script'] != script:
+            raise JournalError(f"Batch {batch_id} was started by {journal.run['script']}; resume it with that script")
+        return journal
+
+    def _replay(self):
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line of a run killed mid-write may be cut short
+                continue
+            self._apply(record)
+
+    def _apply(self, record):
+        event = record['event']
+        if event == 'run':
+            self.run = self.run or record
+        elif event == 'instance':
+            instance = self.instances.setdefault(record['instance_id'], {
+                'instance_id': record['instance_id'],
+                'availability_zone': record['availability_zone'],
+                'profile': record.get('profile'),
+                'region': record.get('region'),
+                'platform': record.get('platform'),
+                'volume_sets': []
+            })
+            instance['volume_sets'].extend(record['volume_sets'])
+        elif event == 'planned':
+            key = (record['instance_id'], record['name'], record['occurrence'])
+            self._disks[key] = {
+                'instance_id': record['instance_id'],
+                'name': record['name'],
+                'raid_set': record.get('raid_set'),
+                'token': record['token'],
+                'attempt': 0,
+                'status': 'planned',
+                'volume_id': None,
+                'device': None,
+                'error': None
+            }
+            self._by_token[record['token']] = key
+        else:
+            disk = self._disks[self._by_token[record['token']]]
+            if event == 'replaced':
+                disk.update(token=record['new_token'], attempt=record['attempt'], status='planned',
+                            volume_id=None, device=None, error=None)
+                self._by_token[record['new_token']] = self._by_token[record['token']]
+            else:
+                disk['status'] = event
+                for field in ('volume_id', 'device', 'error'):
+                    if field in record:
+                        disk[field] = record[field]
+
+    def _append(self, event, **fields):
+        record = {'event': event, 'time': round(time.time(), 3), **fields}
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, 'a')
+            if self._pending_run is not None and event != 'run':
+                pending, self._pending_run = self._pending_run, None
+                self._append('run', **pending)
+            # One flushed line per step: a crash loses at most the step in flight
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+            self._apply(record)
+
+    def begin(self, script, mode, **settings):
+        """Record how the batch was started; written along with the first instance"""
+        with self._lock:
+            if self.run is None:
+                self._pending_run = {'batch_id': self.batch_id, 'run_id': self.run_id, 'script': script, 'mode': mode,
+                                     **settings}
+
+    def plan_instance(self, instance_id, az, volume_sets, profile=None, region=None, platform=None):
+        """Record volume sets to be created on an instance; repeated calls add to them"""
+        self._append('instance', instance_id=instance_id, availability_zone=az, volume_sets=volume_sets,
+                     profile=profile, region=region, platform=platform)
+
+    def planned(self, instance_id, name, raid_set=None):
+        """Return the ClientToken of the next disk called ``name`` on an instance, recording it if new"""
+        with self._lock:
+            occurrence = self._occurrences.get((instance_id, name), 0) + 1
+            self._occurrences[(instance_id, name)] = occurrence
+            disk = self._disks.get((instance_id, name, occurrence))
+            if disk:
+                return disk['token']
+            token = client_token(self.run_id, instance_id, name, occurrence)
+            self._append('planned', token=token, instance_id=instance_id, name=name, occurrence=occurrence,
+                         raid_set=raid_set)
+            return token
+
+    def disk(self, token):
+        """Return the journaled state of a disk: its status, volume_id, device and error"""
+        with self._lock:
+            return dict(self._disks[self._by_token[token]])
+
+    def created(self, token, volume_id):
+        self._append('created', token=token, volume_id=volume_id)
+
+    def available(self, token):
+        self._append('available', token=token)
+
+    def attaching(self, token, device):
+        self._append('attaching', token=token, device=device)
+
+    def attached(self, token, device):
+        self._append('attached', token=token, device=device)
+
+    def failed(self, token, error):
+        self._append('failed', token=token, error=str(error))
+
+    def replace(self, token):
+        """Give a disk a new ClientToken so that it is created again; return the token"""
+        with self._lock:
+            disk = self.disk(token)
+            attempt = disk['attempt'] + 1
+            new_token = client_token(self.run_id, disk['instance_id'], disk['name'],
+                                     self._by_token[token][2], attempt)
+            self._append('replaced', token=token, new_token=new_token, attempt=attempt)
+            return new_token
+
+    def reconcile(self, ec2, tokens):
+        """Bring the journaled disks of ``tokens`` up to date with EC2 and return their current tokens
+
+        The steps a run was killed in the middle of are not in the journal, so
+        every journaled volume that is not yet attached is described, with one
+        describe_volumes call per 200 volumes. A volume attached to its
+        instance is recorded as attached; one still attaching is waited for
+        first and recorded as available if the attachment is dropped, so it is
+        attached again. A deleted or failed volume is replaced, so the disk is
+        created again; one attached to another instance is recorded as failed.
+        """
+        disks = [self.disk(token) for token in tokens]
+        pending = [disk for disk in disks if disk['volume_id'] and disk['status'] != 'attached']
+        found = {}
+        for start in range(0, len(pending), FILTER_CHUNK):
+            volume_ids = [disk['volume_id'] for disk in pending[start:start + FILTER_CHUNK]]
+            with phase('resume'):
+                response = ec2.describe_volumes(Filters=[{'Name': 'volume-id', 'Values': volume_ids}])
+            found.update((volume['VolumeId'], volume) for volume in response['Volumes'])
+
+        current = {}
+        attaching = []
+        for disk in pending:
+            volume = found.get(disk['volume_id'])
+            attachments = volume['Attachments'] if volume else []
+            mine = [a for a in attachments
+                    if a['InstanceId'] == disk['instance_id'] and a['State'] in ('attaching', 'attached')]
+            if volume is None or volume['State'] in REPLACE_STATES:
+                state = f"in the {volume['State']} state" if volume else "gone"
+                log(f"{disk['name']}: {disk['volume_id']} is {state}; creating it again")
+                current[disk['token']] = self.replace(disk['token'])
+            elif mine and mine[0]['State'] == 'attached':
+                self.attached(disk['token'], mine[0]['Device'])
+            elif mine:
+                attaching.append((disk, mine[0]['Device']))
+            elif attachments:
+                self.failed(disk['token'], f"{disk['volume_id']} is attached to {attachments[0]['InstanceId']}")
+            elif volume['State'] == 'available' and disk['status'] != 'available':
+                self.available(disk['token'])
+        by_instance = {}
+        for disk, device in attaching:
+            by_instance.setdefault(disk['instance_id'], {})[disk['volume_id']] = (disk, device)
+        for instance_id, disks in by_instance.items():
+            self._confirm(ec2, instance_id, disks)
+        return [current.get(token, token) for token in tokens]
+
+    def _confirm(self, ec2, instance_id, disks):
+        """Wait for the attachments a run was killed in the middle of, and record how each ended
+
+        ``disks`` maps each volume ID to its ``(disk, device)``; they are all
+        polled together.
+        """
+        waiter = AttachmentWaiter(ec2, instance_id)
+        for volume_id in disks:
+            waiter.add(volume_id)
+        while waiter.pending:
+            with phase('resume'):
+                confirmed, dropped = waiter.poll()
+            for volume in confirmed:
+                disk, device = disks[volume['VolumeId']]
+                self.attached(disk['token'], device)
+            for error in dropped:
+                disk, _ = disks[error.volume_id]
+                if error.state == 'detached':
+                    log(f"{disk['name']}: {error.volume_id} did not stay attached; attaching it again")
+                    self.available(disk['token'])
+                else:
+                    self.failed(disk['token'], error)
+            if waiter.pending:
+                with phase('resume'):
+                    time.sleep(waiter.next_delay())
+
+    def unfinished(self):
+        """Return how many journaled disks are not attached"""
+        with self._lock:
+            return sum(1 for disk in self._disks.values() if disk['status'] != 'attached')
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def resume_groups(journal):
+    """Return ``{(profile, region): [(instance_id, az, volume_sets), ...]}`` for every journaled instance"""
+    groups = {}
+    for instance in journal.instances.values():
+        groups.setdefault((instance['profile'], instance['region']), []).append(
+            (instance['instance_id'], instance['availability_zone'], instance['volume_sets'])
+        )
+    return groups
+
+
+def open_journal(args, script):
+    """Return the journal for this run of ``script``
+
+    With ``--resume BATCH_ID`` the batch's journal is replayed and ``args``
+    takes back the batch's owner and tags, so resumed creates repeat the
+    exact parameters their ClientToken was first sent with. A resumed
+    manifest run also takes back its manifest. Otherwise a journal is
+    started for ``args.batch_id``; the finished journal of an earlier run
+    with the same batch ID is kept alongside with a timestamp suffix.
+    """
+    if args.resume:
+        journal = Journal.resume(args.resume, script)
+        args.owner = journal.run['owner']
+        args.tags = list(journal.run['tags'].items())
+        if journal.run['mode'] == 'manifest':
+            args.manifest = args.manifest or journal.run['manifest']
+        return journal
+    path = journal_path(args.batch_id)
+    if os.path.exists(path):
+        if Journal(args.batch_id).unfinished():
+            raise JournalError(f"Batch {args.batch_id} has volumes that are not attached yet; finish it with "
+                               f"--resume {args.batch_id} or choose another --batch-id")
+        os.replace(path, f"{path}.{time.strftime('%Y%m%d-%H%M%S')}")
+    journal = Journal(args.batch_id)
+    mode = 'manifest' if args.manifest else 'fleet' if getattr(args, 'fleet', False) else 'interactive'
+    journal.begin(script, mode, owner=args.owner, tags=dict(args.tags),
+                  manifest=os.path.abspath(args.manifest) if args.manifest else None)
+    return journal
+
+
+def print_resume_hint(batch_id, script):
+    """Say how to finish the batch if its journal still has disks that are not attached"""
+    if not os.path.exists(journal_path(batch_id)):
+        return
+    unfinished = Journal(batch_id).unfinished()
+    if unfinished:
+        print(f"\n{unfinished} volume(s) of batch {batch_id} are not attached yet. Finish them with:")
+        print(f"  python {script} --resume {batch_id}")
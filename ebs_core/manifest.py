@@ -0,0 +1,287 @@
+"""Declarative batch manifests and the scheduler that runs them without prompts
+
+A manifest is a JSON or YAML document::
+
+    profile: prod                 # optional, --profile wins
+    region: us-east-1             # optional, --region wins; entries may
+                                  # set their own profile and region
+    concurrency: 16               # worker limit shared by every instance
+    tags: {Owner: dba-team}       # added to every volume
+    defaults: {type: gp3, iops: 3000}
+    instances:
+      - instance_id: i-0123456789abcdef0
+        volume_sets:
+          - {name: SQL-Data, disks: 4, size: 250, throughput: 250}
+          - {name: SQL-Log, disks: 2, size: 100}
+
+Volume set keys mirror ``SQL_VOLUME_DEFAULTS`` in create-sql-ebs.py: ``name``,
+``disks`` (or ``count``), ``size``, ``type``, ``iops``, ``throughput`` and an
+optional ``names`` list that overrides the generated per-disk names.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from ebs_core.fleet import print_report, provision_fleet, volume_specs, write_report
+from ebs_core.metrics import phase
+from ebs_core.pipeline import DEFAULT_MAX_WORKERS
+from ebs_core.planner import VOLUME_LIMITS
+from ebs_core.preflight import PreflightError, preflight_groups, print_problems
+from ebs_core.tags import batch_tags
+
+EBS_TYPES = ("gp2", "gp3", "io1", "io2", "st1", "sc1", "standard")
+MAX_DISKS_PER_SET = 28
+MAX_VOLUME_SIZE = max(limits['max_size'] for limits in VOLUME_LIMITS.values())
+
+
+class ManifestError(Exception):
+    """Raised when a manifest cannot be read or fails validation"""
+
+
+def load_manifest(path):
+    """Read a JSON or YAML manifest file and return the parsed document"""
+    try:
+        with open(path) as f:
+            text = f.read()
+    except OSError as e:
+        raise ManifestError(f"Cannot read manifest {path}: {e}")
+
+    if path.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise ManifestError("PyYAML is required for YAML manifests (pip install pyyaml)")
+        try:
+            manifest = yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise ManifestError(f"Invalid YAML in {path}: {e}")
+    else:
+        try:
+            manifest = json.loads(text)
+        except ValueError as e:
+            raise ManifestError(f"Invalid JSON in {path}: {e}")
+
+    if not isinstance(manifest, dict) or not manifest.get('instances'):
+        raise ManifestError(f"Manifest {path} must contain a non-empty 'instances' list")
+    return manifest
+
+
+def _int_field(volume_set, key, low, high, required=True):
+    value = volume_set.get(key)
+    if value is None:
+        if required:
+            raise ManifestError(f"Volume set '{volume_set.get('name')}' is missing '{key}'")
+        return None
+    if not isinstance(value, int) or isinstance(value, bool) or not low <= value <= high:
+        raise ManifestError(f"Volume set '{volume_set.get('name')}' has invalid {key} {value!r} "
+                            f"(must be an integer from {low} to {high})")
+    return value
+
+
+def normalize_volume_set(raw, defaults=None):
+    """Merge a volume set with the manifest defaults and validate it"""
+    volume_set = {**(defaults or {}), **raw}
+    if 'count' in volume_set and 'disks' not in raw:
+        volume_set['disks'] = volume_set['count']
+    if not volume_set.get('name'):
+        raise ManifestError(f"Volume set {raw!r} is missing 'name'")
+
+    volume_type = volume_set.get('type', 'gp3')
+    if volume_type not in EBS_TYPES:
+        raise ManifestError(f"Volume set '{volume_set['name']}' has unknown type '{volume_type}'")
+
+    normalized = {
+        'name': volume_set['name'],
+        'disks': _int_field(volume_set, 'disks', 1, MAX_DISKS_PER_SET),
+        # The per-type limits are checked by the preflight
+        'size': _int_field(volume_set, 'size', 1, MAX_VOLUME_SIZE),
+        'type': volume_type,
+        'iops': _int_field(volume_set, 'iops', 100, 256000, required=False),
+        'throughput': _int_field(volume_set, 'throughput', 125, 4000, required=False),
+        'names': volume_set.get('names')
+    }
+    if normalized['iops'] and volume_type not in ('io1', 'io2', 'gp3'):
+        normalized['iops'] = None
+    if normalized['throughput'] and volume_type != 'gp3':
+        normalized['throughput'] = None
+    if normalized['names'] is not None and len(normalized['names']) != normalized['disks']:
+        raise ManifestError(f"Volume set '{normalized['name']}' lists {len(normalized['names'])} names "
+                            f"for {normalized['disks']} disks")
+    return normalized
+
+
+def check_instance_ids(entries):
+    """Raise ``ManifestError`` unless every instance entry has an ``instance_id`` listed only once"""
+    seen = set()
+    for entry in entries:
+        instance_id = entry.get('instance_id')
+        if not instance_id:
+            raise ManifestError(f"Instance entry {entry!r} is missing 'instance_id'")
+        if instance_id in seen:
+            raise ManifestError(f"Instance {instance_id} is listed more than once")
+        seen.add(instance_id)
+
+
+def plan_instance(entry, manifest, default_sets=None):
+    """Return the validated volume sets for one manifest instance entry"""
+    raw_sets = entry.get('volume_sets') or default_sets
+    if not raw_sets:
+        raise ManifestError(f"Instance {entry.get('instance_id')} has no volume_sets")
+    defaults = manifest.get('defaults', {})
+    return [normalize_volume_set(raw, defaults) for raw in raw_sets]
+
+
+def resolve_instances(ec2, instance_ids):
+    """Return ``{instance_id: availability_zone}`` for the instances that exist"""
+    zones = {}
+    # The instance-id filter, unlike InstanceIds, does not fail the whole
+    # call when one of the IDs does not exist
+    paginator = ec2.get_paginator('describe_instances')
+    for start in range(0, len(instance_ids), 200):
+        chunk = instance_ids[start:start + 200]
+        for page in paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': chunk}]):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    zones[instance['InstanceId']] = instance['Placement']['AvailabilityZone']
+    return zones
+
+
+def preflight_targets(ec2, entries, manifest, batch_id, owner=None, extra_tags=None, name_format="{name}-{n}",
+                      default_sets=None):
+    """Return the ``preflight`` targets for manifest entries provisioned through ``ec2``
+
+    Instances that do not exist are left out; the run reports them as not found.
+    """
+    with phase('discovery'):
+        zones = resolve_instances(ec2, [entry['instance_id'] for entry in entries if entry.get('instance_id')])
+    tags = {**manifest.get('tags', {}), **(extra_tags or {})}
+    targets = []
+    for entry in entries:
+        instance_id = entry.get('instance_id')
+        if instance_id not in zones:
+            continue
+        common_tags = batch_tags(batch_id, instance_id, owner, tags)
+        specs = volume_specs(plan_instance(entry, manifest, default_sets), common_tags, name_format)
+        targets.append((instance_id, zones[instance_id], specs, None))
+    return targets
+
+
+def run_manifest(ec2, manifest, batch_id, owner=None, extra_tags=None, name_format="{name}-{n}",
+                 concurrency=None, default_sets=None, journal=None, target=(None, None), executor=None):
+    """Provision every instance in a manifest and return a result report
+
+    All API work runs on one pool of ``concurrency`` workers shared by every
+    instance, or on ``executor`` when one is given, so that several
+    manifests' targets can share it. ``default_sets`` is used for instance
+    entries without ``volume_sets``. With a ``journal`` each instance is
+    recorded under ``target``, its ``(profile, region)``, and every step of
+    every disk as it happens.
+    """
+    entries = manifest['instances']
+    check_instance_ids(entries)
+    plans = {entry['instance_id']: plan_instance(entry, manifest, default_sets) for entry in entries}
+
+    with phase('discovery'):
+        zones = resolve_instances(ec2, list(plans))
+    tags = {**manifest.get('tags', {}), **(extra_tags or {})}
+    workers = manifest_workers(manifest, concurrency)
+    targets = [(instance_id, zones.get(instance_id), volume_sets) for instance_id, volume_sets in plans.items()]
+    if journal:
+        for instance_id, az, volume_sets in targets:
+            # A resumed run re-reads the manifest, so its instances are already journaled
+            if az and instance_id not in journal.instances:
+                journal.plan_instance(instance_id, az, volume_sets, *target)
+
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            report = provision_fleet(ec2, targets, batch_id, owner, tags, name_format, executor=executor,
+                                     journal=journal)
+    else:
+        report = provision_fleet(ec2, targets, batch_id, owner, tags, name_format, executor=executor,
+                                 journal=journal)
+    report['concurrency'] = workers
+    return report
+
+
+def manifest_workers(manifest, concurrency=None):
+    """Return the worker limit of a run: ``--concurrency``, else the manifest's, else the default"""
+    return concurrency or manifest.get('concurrency') or DEFAULT_MAX_WORKERS
+
+
+def run_manifest_command(args, name_format, default_sets=None, journal=None):
+    """Run ``--manifest`` mode for a script and return a process exit code
+
+    Instance entries may name their own ``profile`` and ``region``; each
+    profile and region pair is provisioned in parallel through its own client,
+    all on one worker pool of the run's concurrency, and the results are
+    merged into one report. The whole manifest is validated before anything
+    is created. With ``--resume`` the preflight is skipped, since the batch
+    passed it when it was started.
+    """
+    from ebs_core.clients import POOL, build_client
+    from ebs_core.fanout import fan_out, merge_reports, target_label
+    from ebs_core.tags import new_batch_id
+
+    try:
+        manifest = load_manifest(args.manifest)
+        # Every entry of every target is checked before any target starts creating volumes
+        check_instance_ids(manifest['instances'])
+        # The manifest's own concurrency is only known now, before any client is built
+        POOL.configure(manifest.get('concurrency') or 0)
+        groups = {}
+        for entry in manifest['instances']:
+            key = (
+                entry.get('profile') or args.profile or manifest.get('profile'),
+                entry.get('region') or args.region or manifest.get('region')
+            )
+            groups.setdefault(key, []).append(entry)
+
+        clients = {}
+        entries_by_target = {}
+        for (profile, region), entries in groups.items():
+            target, client = build_client(profile, region)
+            clients[target] = client
+            entries_by_target.setdefault(target, []).extend(entries)
+
+        batch_id = args.batch_id or new_batch_id()
+        print(f"Batch ID: {batch_id}")
+
+        # Validate every group before any of them starts creating volumes
+        for target, entries in entries_by_target.items():
+            for entry in entries:
+                plan_instance(entry, manifest, default_sets)
+        if not args.no_preflight and not args.resume:
+            preflight_groups(clients, {
+                target: preflight_targets(clients[target], entries, manifest, batch_id, args.owner,
+                                          dict(args.tags), name_format, default_sets)
+                for target, entries in entries_by_target.items()
+            })
+
+        def run_target(target, client):
+            return run_manifest(
+                client, {**manifest, 'instances': entries_by_target[target]}, batch_id,
+                args.owner, dict(args.tags), name_format, args.concurrency, default_sets, journal, target,
+                executor
+            )
+
+        def on_result(outcome):
+            label = target_label((outcome['profile'], outcome['region']))
+            if outcome['status'] == 'ok':
+                print(f"{label}: finished in {outcome['elapsed_seconds']}s")
+            else:
+                print(f"{label}: {outcome['status']}: {outcome['error']}")
+
+        # One pool for every target, so the concurrency is the limit for the whole run
+        with ThreadPoolExecutor(max_workers=manifest_workers(manifest, args.concurrency)) as executor:
+            report = merge_reports(fan_out(run_target, clients, on_result=on_result), batch_id)
+    except ManifestError as e:
+        print(f"Manifest error: {e}")
+        return 2
+    except PreflightError as e:
+        print_problems(e)
+        return 2
+
+    output = args.output or f"ebs-results-{batch_id}.json"
+    write_report(report, output)
+    print_report(report)
+    print(f"Results written to {output}")
+    return 0 if report['succeeded'] else 1
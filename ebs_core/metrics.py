@@ -0,0 +1,280 @@
+"""Per-phase timing and per-call EC2 metrics for a run
+
+Every ``ResilientClient`` records its calls into the process-wide ``METRICS``
+registry, attributed to the phase (discovery, preflight, resume, create, wait, attach, confirm, detach, delete, summary)
+the call is made in, along with how long the script took to start. At the
+end of a run the registry is written as JSON and, with ``--profile-run``,
+printed as a hot-spot table.
+"""
+import contextlib
+import contextvars
+import json
+import threading
+import time
+from datetime import datetime, timezone
+
+from ebs_core import IMPORTED_AT
+
+# Upper bounds, in seconds, of the latency histogram buckets; one more bucket catches the rest
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+HOT_SPOT_ROWS = 15
+NO_PHASE = '-'
+
+
+class Histogram:
+    """Fixed-bucket latency histogram"""
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = next((i for i, bound in enumerate(self.bounds) if value <= bound), len(self.bounds))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket holding the ``q`` quantile (the max for the last bucket)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def to_dict(self):
+        labels = [f"<={bound}s" for bound in self.bounds] + [f">{self.bounds[-1]}s"]
+        return {
+            'count': self.count,
+            'total_seconds': round(self.total, 3),
+            'mean_seconds': round(self.total / self.count, 3) if self.count else 0.0,
+            'p50_seconds': round(self.quantile(0.5), 3),
+            'p95_seconds': round(self.quantile(0.95), 3),
+            'max_seconds': round(self.max, 3),
+            'buckets': dict(zip(labels, self.counts))
+        }
+
+
+class CallStats:
+    """Counters for one EC2 action within one phase"""
+
+    def __init__(self):
+        self.calls = 0
+        self.attempts = 0
+        self.throttles = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.throttled_seconds = 0.0
+        # Latency of every individual request, retries included
+        self.latency = Histogram()
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.attempts += other.attempts
+        self.throttles += other.throttles
+        self.errors += other.errors
+        self.total_seconds += other.total_seconds
+        self.throttled_seconds += other.throttled_seconds
+        self.latency.merge(other.latency)
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'attempts': self.attempts,
+            'retries': self.attempts - self.calls,
+            'throttles': self.throttles,
+            'errors': self.errors,
+            'total_seconds': round(self.total_seconds, 3),
+            'throttled_seconds': round(self.throttled_seconds, 3),
+            'latency': self.latency.to_dict()
+        }
+
+
+def _union_seconds(intervals):
+    """Return the wall-clock time covered by possibly overlapping ``(start, end)`` intervals"""
+    total = 0.0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+
+class Metrics:
+    """Thread-safe registry of phase timings and EC2 call statistics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # A context variable rather than a thread-local, so every asyncio task has its own
+        # phase and asyncio.to_thread carries it over to the worker thread
+        self._phases_var = contextvars.ContextVar('phases', default=())
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.monotonic()
+            self.started_at = datetime.now(timezone.utc)
+            self._calls = {}
+            self._phases = {}
+            self.startup_seconds = None
+
+    def mark_ready(self, since=IMPORTED_AT):
+        """Record the time from ``since`` until the script is ready for its first prompt"""
+        self.startup_seconds = time.monotonic() - since
+
+    def current_phase(self):
+        stack = self._phases_var.get()
+        return stack[-1] if stack else NO_PHASE
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time a block as part of phase ``name`` and attribute the EC2 calls made inside it to it
+
+        Phases entered on several threads at once are summed in
+        ``total_seconds``; ``wall_seconds`` counts overlapping time once.
+        """
+        token = self._phases_var.set(self._phases_var.get() + (name,))
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            end = time.monotonic()
+            self._phases_var.reset(token)
+            with self._lock:
+                self._phases.setdefault(name, []).append((start, end))
+
+    def timed(self, name, iterable):
+        """Yield from ``iterable``, counting only the time spent producing items as phase ``name``"""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def record_call(self, action, seconds, attempt_latencies, throttles=0, throttled_seconds=0.0, error=None):
+        """Record one logical EC2 call, made of one request per entry in ``attempt_latencies``"""
+        key = (self.current_phase(), action)
+        with self._lock:
+            stats = self._calls.get(key)
+            if stats is None:
+                stats = self._calls[key] = CallStats()
+            stats.calls += 1
+            stats.attempts += len(attempt_latencies)
+            stats.throttles += throttles
+            stats.errors += 1 if error else 0
+            stats.total_seconds += seconds
+            stats.throttled_seconds += throttled_seconds
+            for latency in attempt_latencies:
+                stats.latency.observe(latency)
+
+    def has_data(self):
+        with self._lock:
+            return bool(self._calls or self._phases)
+
+    def hot_spots(self):
+        """Return ``(phase, action, CallStats)`` rows, most total time first"""
+        with self._lock:
+            rows = [(phase, action, stats) for (phase, action), stats in self._calls.items()]
+        return sorted(rows, key=lambda row: row[2].total_seconds, reverse=True)
+
+    def snapshot(self):
+        with self._lock:
+            phases = {name: list(intervals) for name, intervals in self._phases.items()}
+            calls = dict(self._calls)
+        by_action = {}
+        for (_, action), stats in calls.items():
+            by_action.setdefault(action, CallStats()).merge(stats)
+        return {
+            'started_at': self.started_at.isoformat(),
+            'elapsed_seconds': round(time.monotonic() - self.started, 3),
+            'startup_seconds': None if self.startup_seconds is None else round(self.startup_seconds, 3),
+            'phases': {
+                name: {
+                    'count': len(intervals),
+                    'total_seconds': round(sum(end - start for start, end in intervals), 3),
+                    'wall_seconds': round(_union_seconds(intervals), 3)
+                }
+                for name, intervals in phases.items()
+            },
+            'api_calls': {action: stats.to_dict() for action, stats in sorted(by_action.items())},
+            'hot_spots': [
+                {'phase': phase, 'action': action, **stats.to_dict()}
+                for phase, action, stats in self.hot_spots()
+            ]
+        }
+
+
+METRICS = Metrics()
+phase = METRICS.phase
+mark_ready = METRICS.mark_ready
+timed = METRICS.timed
+
+
+def write_metrics(path, batch_id=None, metrics=METRICS):
+    snapshot = metrics.snapshot()
+    if batch_id:
+        snapshot = {'batch_id': batch_id, **snapshot}
+    with open(path, 'w') as f:
+        json.dump(snapshot, f, indent=2)
+
+
+def print_hot_spots(metrics=METRICS, limit=HOT_SPOT_ROWS):
+    snapshot = metrics.snapshot()
+    print(f"\n=== RUN PROFILE ({snapshot['elapsed_seconds']:.1f}s) ===")
+    if snapshot['startup_seconds'] is not None:
+        print(f"Startup: {snapshot['startup_seconds']:.3f}s to the first prompt")
+    print(f"{'Phase':<10} {'Count':>6} {'Busy s':>8} {'Wall s':>8}")
+    for name, stats in snapshot['phases'].items():
+        print(f"{name:<10} {stats['count']:>6} {stats['total_seconds']:>8.2f} {stats['wall_seconds']:>8.2f}")
+
+    rows = metrics.hot_spots()[:limit]
+    if not rows:
+        return
+    print(f"\n{'Phase':<10} {'Action':<32} {'Calls':>6} {'Retry':>6} {'Total s':>8} "
+          f"{'p50 s':>7} {'p95 s':>7} {'Throttled s':>12}")
+    for phase_name, action, stats in rows:
+        print(f"{phase_name:<10} {action:<32} {stats.calls:>6} {stats.attempts - stats.calls:>6} "
+              f"{stats.total_seconds:>8.2f} {stats.latency.quantile(0.5):>7.2f} "
+              f"{stats.latency.quantile(0.95):>7.2f} {stats.throttled_seconds:>12.2f}")
+
+
+def finish_run(args, batch_id, metrics=METRICS):
+    """Write the metrics file for a run and print the hot-spot table if ``--profile-run`` was given
+
+    Runs that never reached AWS (the user quit at a prompt) write nothing.
+    """
+    if not metrics.has_data():
+        return
+    path = args.metrics or f"ebs-metrics-{batch_id}.json"
+    try:
+        write_metrics(path, batch_id, metrics)
+    except OSError as e:
+        print(f"Could not write metrics to {path}: {e}")
+    else:
+        print(f"Metrics written to {path}")
+    if args.profile_run:
+        print_hot_spots(metrics)
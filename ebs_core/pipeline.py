@@ -0,0 +1,234 @@
+"""Concurrent create/wait/attach pipeline for batches of EBS volumes"""
+import contextlib
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from ebs_core.devices import MAX_ATTACH_ATTEMPTS
+from ebs_core.metrics import phase
+from ebs_core.tags import tag_specifications
+from ebs_core.waiter import AttachmentWaiter, VolumeWaiter
+
+DEFAULT_MAX_WORKERS = 8
+
+_print_lock = threading.Lock()
+
+
+def log(message):
+    """Print a line without interleaving output from worker threads"""
+    with _print_lock:
+        print(message)
+
+
+def volume_params(az, size, volume_type='gp3', iops=None, throughput=None, name=None, tags=None):
+    """Build create_volume parameters for an encrypted volume, tagged on create when named"""
+    params = {
+        'AvailabilityZone': az,
+        'Size': size,
+        'VolumeType': volume_type,
+        'Encrypted': True
+    }
+    if iops:
+        params['Iops'] = iops
+    if throughput:
+        params['Throughput'] = throughput
+    if name:
+        params['TagSpecifications'] = tag_specifications(name, tags)
+    return params
+
+
+class Pipeline:
+    """Create volumes on a bounded worker pool and attach each one as soon as it is available
+
+    Creates run on the pool while the calling thread drives a single
+    ``VolumeWaiter`` over every volume created so far, so the whole batch is
+    polled with one describe_volumes call per tick. A volume only counts as
+    attached once an ``AttachmentWaiter``, which polls every attachment in
+    flight with one more describe_volumes call per tick, sees it 'attached'.
+    An attachment that EC2 drops is retried on a new device name, up to
+    ``MAX_ATTACH_ATTEMPTS`` times in all.
+
+    Device names come from ``allocator``, a ``DeviceAllocator`` for the
+    instance, so concurrent attaches never pick the same name. Passing an
+    ``executor`` shares one worker pool, and so one concurrency limit, between
+    pipelines for several instances.
+
+    With a ``journal`` every step is recorded as it happens and each create
+    carries the disk's ClientToken. Disks the journal already has are picked
+    up where they were left: attached ones are reported as they are and
+    created ones go straight to the waiter.
+    """
+
+    def __init__(self, ec2, instance_id, az, allocator, max_workers=DEFAULT_MAX_WORKERS,
+                 waiter_options=None, executor=None, journal=None):
+        self.ec2 = ec2
+        self.instance_id = instance_id
+        self.az = az
+        self.allocator = allocator
+        self.max_workers = max_workers
+        self.waiter_options = waiter_options or {}
+        self.executor = executor
+        self.journal = journal
+
+    def run(self, specs):
+        """Provision every spec and return one result dict per spec, in input order
+
+        ``status`` ends as 'attached' or 'failed', with the reason in
+        ``error``. ``time_to_attached`` is the seconds from the start of the
+        run until the volume's attachment was confirmed, or None.
+        """
+        started = time.monotonic()
+        results = [
+            {
+                'name': spec['name'],
+                'volume_id': None,
+                'device': None,
+                'status': 'pending',
+                'error': None,
+                'time_to_attached': None
+            }
+            for spec in specs
+        ]
+        if not specs:
+            return results
+
+        tokens = [None] * len(specs)
+        if self.journal:
+            tokens = [self.journal.planned(self.instance_id, spec['name'], spec.get('raid_set')) for spec in specs]
+            tokens = self.journal.reconcile(self.ec2, tokens)
+
+        waiter = VolumeWaiter(self.ec2, **self.waiter_options)
+        attachments = AttachmentWaiter(self.ec2, self.instance_id, **self.waiter_options)
+        # {volume_id: (result, token)}
+        by_volume = {}
+        # {volume_id: attach_volume calls made}
+        attempts = {}
+        if self.executor:
+            pool_context = contextlib.nullcontext(self.executor)
+        else:
+            pool_context = ThreadPoolExecutor(max_workers=min(self.max_workers, len(specs)))
+        with pool_context as pool:
+            creates = {}
+            for spec, token, result in zip(specs, tokens, results):
+                disk = self.journal.disk(token) if token else None
+                if disk is None or not disk['volume_id']:
+                    creates[pool.submit(self._create, spec, token)] = (result, token)
+                elif disk['status'] == 'attached':
+                    result.update(volume_id=disk['volume_id'], device=disk['device'], status='attached')
+                    log(f"'{spec['name']}' is already attached ({disk['volume_id']} on {disk['device']})")
+                elif disk['status'] == 'failed':
+                    result['volume_id'] = disk['volume_id']
+                    self._fail(result, disk['error'])
+                else:
+                    result.update(volume_id=disk['volume_id'], status='created')
+                    by_volume[disk['volume_id']] = (result, token)
+                    waiter.add(disk['volume_id'])
+            attaches = {}
+
+            while creates or attaches or waiter.pending or attachments.pending:
+                for future in [f for f in creates if f.done()]:
+                    result, token = creates.pop(future)
+                    try:
+                        result['volume_id'] = future.result()
+                    except Exception as e:
+                        self._fail(result, e, token)
+                        continue
+                    result['status'] = 'created'
+                    by_volume[result['volume_id']] = (result, token)
+                    waiter.add(result['volume_id'])
+
+                for future in [f for f in attaches if f.done()]:
+                    result, token = attaches.pop(future)
+                    try:
+                        result['device'] = future.result()
+                    except Exception as e:
+                        self._fail(result, e, token)
+                        continue
+                    result['status'] = 'attaching'
+                    attachments.add(result['volume_id'])
+
+                if waiter.pending:
+                    with phase('wait'):
+                        ready, failed = waiter.poll()
+                    for volume in ready:
+                        result, token = by_volume[volume['VolumeId']]
+                        result['status'] = 'available'
+                        if token:
+                            self.journal.available(token)
+                        attempts[volume['VolumeId']] = attempts.get(volume['VolumeId'], 0) + 1
+                        attaches[pool.submit(self._attach, volume['VolumeId'], token)] = (result, token)
+                    for error in failed:
+                        result, token = by_volume[error.volume_id]
+                        self._fail(result, error, token)
+
+                if attachments.pending:
+                    with phase('confirm'):
+                        confirmed, dropped = attachments.poll()
+                    for volume in confirmed:
+                        result, token = by_volume[volume['VolumeId']]
+                        result.update(status='attached', time_to_attached=round(time.monotonic() - started, 3))
+                        if token:
+                            self.journal.attached(token, result['device'])
+                        log(f"{volume['VolumeId']} is attached as {result['device']} "
+                            f"after {result['time_to_attached']:.1f}s")
+                    for error in dropped:
+                        result, token = by_volume[error.volume_id]
+                        if error.state == 'detached' and attempts[error.volume_id] < MAX_ATTACH_ATTEMPTS:
+                            log(f"{error.volume_id} did not stay attached as {result['device']}; "
+                                f"attaching it again on another device name")
+                            result.update(status='available', device=None)
+                            waiter.add(error.volume_id)
+                        else:
+                            self._fail(result, error, token)
+
+                # Sleep until the next tick, waking early when a create or attach call finishes
+                in_flight = list(creates) + list(attaches)
+                if waiter.pending or attachments.pending:
+                    delay = min(w.next_delay() for w in (waiter, attachments) if w.pending)
+                    with phase('wait'):
+                        if in_flight:
+                            wait(in_flight, timeout=delay, return_when=FIRST_COMPLETED)
+                        else:
+                            time.sleep(delay)
+                elif in_flight:
+                    wait(in_flight, return_when=FIRST_COMPLETED)
+        return results
+
+    def _fail(self, result, error, token=None):
+        result['status'] = 'failed'
+        result['error'] = str(error)
+        log(f"Failed to provision '{result['name']}': {error}")
+        if token:
+            self.journal.failed(token, error)
+
+    def _create(self, spec, token=None):
+        params = volume_params(
+            self.az,
+            spec['size'],
+            spec.get('volume_type', 'gp3'),
+            spec.get('iops'),
+            spec.get('throughput'),
+            spec['name'],
+            spec.get('tags')
+        )
+        if token:
+            params['ClientToken'] = token
+        with phase('create'):
+            vol = self.ec2.create_volume(**params)
+        volume_id = vol['VolumeId']
+        if token:
+            self.journal.created(token, volume_id)
+
+        log(f"Created volume {volume_id} with name '{spec['name']}'")
+        log("Waiting for volume to become available...")
+        return volume_id
+
+    def _attach(self, volume_id, token=None):
+        with phase('attach'):
+            device = self.allocator.attach(
+                volume_id,
+                lambda device_name: log(f"Attaching {volume_id} to {self.instance_id} as {device_name}")
+            )
+        if token:
+            self.journal.attaching(token, device)
+        return device
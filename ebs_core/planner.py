@@ -0,0 +1,190 @@
+"""Plan the cheapest striped (RAID 0) layout that meets a volume set's performance target
+
+A target is an aggregate IOPS, throughput (MiB/s) and capacity (GiB) for the
+whole set. For every volume type and disk count the cheapest disk that meets
+``target / disks`` can be worked out directly from the type's limits, so a
+plan is a few dozen evaluations and can be redone on every prompt.
+
+Limits follow the EBS documentation for gp3 and io2 (Block Express). Prices
+are us-east-1 list prices per month and only serve to rank layouts.
+"""
+import math
+import re
+
+DEFAULT_MAX_DISKS = 8
+PLANNER_TYPES = ('gp3', 'io2')
+
+VOLUME_LIMITS = {
+    'gp3': {
+        'min_size': 1, 'max_size': 65536,
+        'base_iops': 3000, 'max_iops': 80000, 'iops_per_gib': 500,
+        'base_throughput': 125, 'max_throughput': 2000,
+        # Provisioned throughput may be at most 0.25 MiB/s per provisioned IOPS
+        'throughput_per_iops': 0.25
+    },
+    'io2': {
+        'min_size': 4, 'max_size': 65536,
+        'min_iops': 100, 'max_iops': 256000, 'iops_per_gib': 1000,
+        # Throughput is not provisioned; it scales with IOPS up to the cap
+        'throughput_per_iops': 0.256, 'max_throughput': 4000
+    }
+}
+
+PRICES = {
+    'gp3': {'gib': 0.08, 'iops': 0.005, 'throughput': 0.04},
+    'io2': {'gib': 0.125, 'iops_tiers': ((32000, 0.065), (64000, 0.0455), (None, 0.032))},
+    'gp2': {'gib': 0.10},
+    'io1': {'gib': 0.125, 'iops': 0.065},
+    'st1': {'gib': 0.045},
+    'sc1': {'gib': 0.015},
+    'standard': {'gib': 0.05}
+}
+
+_TARGET_UNITS = {
+    'iops': 'iops',
+    'mbps': 'throughput', 'mb/s': 'throughput', 'mibps': 'throughput', 'mib/s': 'throughput',
+    'gib': 'capacity', 'gb': 'capacity', 'g': 'capacity',
+    'tib': 'capacity_tib', 'tb': 'capacity_tib', 't': 'capacity_tib'
+}
+
+
+def parse_target(text):
+    """Parse a target such as ``12000 iops, 500 MBps, 1 TiB`` into ``{'iops', 'throughput', 'capacity'}``
+
+    Any of the three may be left out and defaults to 0. Raises ValueError on
+    anything it does not understand.
+    """
+    target = {'iops': 0, 'throughput': 0, 'capacity': 0}
+    parts = re.findall(r'(\d+(?:\.\d+)?)\s*([a-z/]+)', text.lower())
+    leftover = re.sub(r'(\d+(?:\.\d+)?)\s*([a-z/]+)|[\s,]', '', text.lower())
+    if not parts or leftover:
+        raise ValueError(f"Could not parse target '{text}'")
+    for number, unit in parts:
+        key = _TARGET_UNITS.get(unit)
+        if key is None:
+            raise ValueError(f"Unknown unit '{unit}' (use iops, MBps, GiB or TiB)")
+        if key == 'capacity_tib':
+            target['capacity'] = math.ceil(float(number) * 1024)
+        else:
+            target[key] = math.ceil(float(number))
+    return target
+
+
+def disk_performance(volume_type, size, iops=None, throughput=None):
+    """Return the ``(iops, throughput)`` one disk delivers, or None for values the type does not define"""
+    if volume_type == 'gp3':
+        limits = VOLUME_LIMITS['gp3']
+        return iops or limits['base_iops'], throughput or limits['base_throughput']
+    if volume_type == 'io2':
+        limits = VOLUME_LIMITS['io2']
+        return iops, min(limits['max_throughput'], iops * limits['throughput_per_iops']) if iops else None
+    if volume_type == 'io1':
+        return iops, min(1000, iops * 0.256) if iops else None
+    if volume_type == 'gp2':
+        # 3 IOPS per GiB between 100 and 16000; throughput peaks at 250 MiB/s
+        return min(16000, max(100, 3 * size)), 250 if size > 170 else 128
+    if volume_type == 'st1':
+        return None, min(500, 40 * size / 1024)
+    if volume_type == 'sc1':
+        return None, min(192, 12 * size / 1024)
+    return None, None
+
+
+def disk_cost(volume_type, size, iops=None, throughput=None):
+    """Return the monthly list price of one disk"""
+    price = PRICES.get(volume_type, {})
+    cost = size * price.get('gib', 0)
+    if volume_type == 'gp3':
+        limits = VOLUME_LIMITS['gp3']
+        cost += max(0, (iops or 0) - limits['base_iops']) * price['iops']
+        cost += max(0, (throughput or 0) - limits['base_throughput']) * price['throughput']
+    elif volume_type == 'io2':
+        remaining = iops or 0
+        lower = 0
+        for upper, rate in price['iops_tiers']:
+            band = remaining if upper is None else min(remaining, upper - lower)
+            cost += band * rate
+            remaining -= band
+            if upper is None or remaining <= 0:
+                break
+            lower = upper
+    elif volume_type == 'io1':
+        cost += (iops or 0) * price['iops']
+    return cost
+
+
+def summarize_layout(volume_type, disks, size, iops=None, throughput=None):
+    """Describe a striped layout: per-disk settings, aggregate performance and monthly cost"""
+    disk_iops, disk_throughput = disk_performance(volume_type, size, iops, throughput)
+    return {
+        'volume_type': volume_type,
+        'disks': disks,
+        'size': size,
+        'iops': iops,
+        'throughput': throughput,
+        'capacity': disks * size,
+        'total_iops': disks * disk_iops if disk_iops is not None else None,
+        'total_throughput': round(disks * disk_throughput) if disk_throughput is not None else None,
+        'monthly_cost': round(disks * disk_cost(volume_type, size, iops, throughput), 2)
+    }
+
+
+def cheapest_disk(volume_type, disks, target):
+    """Return the cheapest ``(size, iops, throughput)`` for one of ``disks`` disks meeting ``target``, or None"""
+    need_iops = math.ceil(target['iops'] / disks)
+    need_throughput = math.ceil(target['throughput'] / disks)
+    need_size = math.ceil(target['capacity'] / disks)
+    limits = VOLUME_LIMITS[volume_type]
+
+    if volume_type == 'gp3':
+        throughput = max(limits['base_throughput'], need_throughput)
+        iops = max(limits['base_iops'], need_iops, math.ceil(throughput / limits['throughput_per_iops']))
+        if throughput > limits['max_throughput'] or iops > limits['max_iops']:
+            return None
+        # Leave the included baseline unset rather than provisioning it explicitly
+        provisioned_throughput = throughput if throughput > limits['base_throughput'] else None
+    elif volume_type == 'io2':
+        iops = max(limits['min_iops'], need_iops, math.ceil(need_throughput / limits['throughput_per_iops']))
+        if iops > limits['max_iops'] or need_throughput > limits['max_throughput']:
+            return None
+        provisioned_throughput = None
+    else:
+        raise ValueError(f"Cannot plan {volume_type} volumes")
+
+    size = max(limits['min_size'], need_size, math.ceil(iops / limits['iops_per_gib']))
+    if size > limits['max_size']:
+        return None
+    return size, iops, provisioned_throughput
+
+
+def plan_layouts(target, volume_types=PLANNER_TYPES, max_disks=DEFAULT_MAX_DISKS):
+    """Return every layout that meets ``target``, cheapest first (fewer disks first on a tie)"""
+    layouts = []
+    for volume_type in volume_types:
+        for disks in range(1, max_disks + 1):
+            disk = cheapest_disk(volume_type, disks, target)
+            if disk:
+                layouts.append(summarize_layout(volume_type, disks, *disk))
+    return sorted(layouts, key=lambda layout: (layout['monthly_cost'], layout['disks']))
+
+
+def plan_layout(target, volume_types=PLANNER_TYPES, max_disks=DEFAULT_MAX_DISKS):
+    """Return the cheapest layout that meets ``target``, or None if no layout within the limits does"""
+    layouts = plan_layouts(target, volume_types, max_disks)
+    return layouts[0] if layouts else None
+
+
+def format_layout(layout):
+    """One line such as ``4 x 250 GiB gp3 @ 3000 IOPS = 1000 GiB, 12000 IOPS, 500 MiB/s, $80.00/month``"""
+    settings = f"{layout['disks']} x {layout['size']} GiB {layout['volume_type']}"
+    if layout['iops']:
+        settings += f" @ {layout['iops']} IOPS"
+    if layout['throughput']:
+        settings += f", {layout['throughput']} MiB/s"
+    totals = [f"{layout['capacity']} GiB"]
+    if layout['total_iops'] is not None:
+        totals.append(f"{layout['total_iops']} IOPS")
+    if layout['total_throughput'] is not None:
+        totals.append(f"{layout['total_throughput']} MiB/s")
+    totals.append(f"${layout['monthly_cost']:.2f}/month")
+    return f"{settings} = {', '.join(totals)}"
@@ -0,0 +1,207 @@
+"""Check a whole batch of planned volumes before any of them is created
+
+A bad IOPS/size combination, a missing permission or too few free device
+names would otherwise only surface after part of a RAID set exists. The
+preflight checks every planned disk locally against its volume type's
+limits, counts the instance's free device names, and sends every planned
+create_volume and attach_volume at once with ``DryRun=True``. EC2 answers a
+dry run with ``DryRunOperation`` when the request is valid and permitted, so
+the whole batch is validated in about one round trip.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from ebs_core.api import DEFAULT_API_BUDGET, error_code
+from ebs_core.devices import DeviceAllocator, candidate_device_names
+from ebs_core.fanout import fan_out, target_label
+from ebs_core.metrics import phase
+from ebs_core.pipeline import volume_params
+from ebs_core.planner import VOLUME_LIMITS
+
+# Per-type limits beyond the planner's gp3 and io2: (min size, max size) in GiB
+SIZE_LIMITS = {
+    'gp2': (1, 16384), 'gp3': (VOLUME_LIMITS['gp3']['min_size'], VOLUME_LIMITS['gp3']['max_size']),
+    'io1': (4, 16384), 'io2': (VOLUME_LIMITS['io2']['min_size'], VOLUME_LIMITS['io2']['max_size']),
+    'st1': (125, 16384), 'sc1': (125, 16384), 'standard': (1, 1024)
+}
+IO1_LIMITS = {'min_iops': 100, 'max_iops': 64000, 'iops_per_gib': 50}
+
+# attach_volume is dry-run before its volume exists, so this stands in for it
+PLACEHOLDER_VOLUME_ID = 'vol-00000000000000000'
+# Errors about the placeholder volume itself are expected and mean the rest of the request was accepted
+PLACEHOLDER_ERRORS = ('InvalidVolume.NotFound', 'InvalidVolumeID.NotFound', 'InvalidVolumeID.Malformed')
+
+
+class PreflightProblem(Exception):
+    """One reason the batch would fail"""
+
+
+class PreflightError(Exception):
+    """Raised when the preflight found problems; ``problems`` maps each instance ID to its messages"""
+
+    def __init__(self, problems):
+        count = sum(len(messages) for messages in problems.values())
+        super().__init__(f"Preflight found {count} problem(s); nothing was created")
+        self.problems = problems
+
+
+def volume_problems(volume_type, size, iops=None, throughput=None):
+    """Return why EC2 would reject a volume with these settings, as a list of messages"""
+    if volume_type not in SIZE_LIMITS:
+        return [f"unknown volume type '{volume_type}'"]
+    problems = []
+    min_size, max_size = SIZE_LIMITS[volume_type]
+    if not min_size <= size <= max_size:
+        problems.append(f"{volume_type} size must be {min_size}-{max_size} GiB, not {size}")
+
+    if volume_type == 'gp3':
+        limits = VOLUME_LIMITS['gp3']
+        effective_iops = iops or limits['base_iops']
+        if iops and not limits['base_iops'] <= iops <= limits['max_iops']:
+            problems.append(f"gp3 IOPS must be {limits['base_iops']}-{limits['max_iops']}, not {iops}")
+        elif iops and iops > size * limits['iops_per_gib']:
+            problems.append(f"{iops} IOPS needs at least {-(-iops // limits['iops_per_gib'])} GiB on gp3 "
+                            f"({limits['iops_per_gib']} IOPS per GiB), not {size}")
+        if throughput and not limits['base_throughput'] <= throughput <= limits['max_throughput']:
+            problems.append(f"gp3 throughput must be {limits['base_throughput']}-{limits['max_throughput']} "
+                            f"MiB/s, not {throughput}")
+        elif throughput and throughput > effective_iops * limits['throughput_per_iops']:
+            problems.append(f"{throughput} MiB/s needs at least {int(throughput / limits['throughput_per_iops'])} "
+                            f"IOPS on gp3 ({limits['throughput_per_iops']} MiB/s per IOPS), not {effective_iops}")
+    elif volume_type in ('io1', 'io2'):
+        limits = IO1_LIMITS if volume_type == 'io1' else VOLUME_LIMITS['io2']
+        if not iops:
+            problems.append(f"{volume_type} volumes need provisioned IOPS")
+        elif not limits['min_iops'] <= iops <= limits['max_iops']:
+            problems.append(f"{volume_type} IOPS must be {limits['min_iops']}-{limits['max_iops']}, not {iops}")
+        elif iops > size * limits['iops_per_gib']:
+            problems.append(f"{iops} IOPS needs at least {-(-iops // limits['iops_per_gib'])} GiB on {volume_type} "
+                            f"({limits['iops_per_gib']} IOPS per GiB), not {size}")
+    elif iops:
+        problems.append(f"IOPS cannot be provisioned on {volume_type} volumes")
+
+    if throughput and volume_type != 'gp3':
+        problems.append("throughput can only be provisioned on gp3 volumes")
+    return problems
+
+
+def device_headroom(allocator, count):
+    """Return the device names the next ``count`` attachments would get
+
+    Raises ``PreflightProblem`` if the instance has fewer free names than that.
+    """
+    with phase('preflight'):
+        used = allocator.load()
+    free = [name for name in candidate_device_names() if name not in used]
+    if len(free) < count:
+        raise PreflightProblem(f"only {len(free)} free device name(s) for {count} new volume(s)")
+    return free[:count]
+
+
+def dry_run(method, ignore=(), **params):
+    """Send ``method(DryRun=True, **params)`` and return None if EC2 would accept it, otherwise the error"""
+    try:
+        with phase('preflight'):
+            method(DryRun=True, **params)
+    except ClientError as e:
+        if error_code(e) == 'DryRunOperation' or error_code(e) in ignore:
+            return None
+        return e
+    except Exception as e:
+        return e
+    # A client that ignores DryRun made the call for real; report it rather than hide it
+    return Exception("The request was not treated as a dry run")
+
+
+def preflight(ec2, targets, max_workers=DEFAULT_API_BUDGET):
+    """Check every planned disk of ``targets`` and raise ``PreflightError`` if any would fail
+
+    ``targets`` is a list of ``(instance_id, az, specs, allocator)``; specs
+    are pipeline specs and ``allocator`` may be None. Every instance's
+    device names are loaded at once while the specs are checked locally;
+    every create_volume and attach_volume dry run of the instances that pass
+    is then sent at once. Disks that fail the same way are reported together.
+    """
+    # {instance_id: {message: [disk name, ...]}}
+    found = {instance_id: {} for instance_id, _, _, _ in targets}
+    # Workers enter the preflight phase themselves; the phase does not follow work onto pool threads
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(targets)))) as executor:
+        headroom = {
+            instance_id: executor.submit(device_headroom, allocator or DeviceAllocator(ec2, instance_id), len(specs))
+            for instance_id, _, specs, allocator in targets
+        }
+        for instance_id, _, specs, _ in targets:
+            for spec in specs:
+                for message in volume_problems(spec['volume_type'], spec['size'], spec.get('iops'),
+                                               spec.get('throughput')):
+                    found[instance_id].setdefault(message, []).append(spec['name'])
+
+        calls = []
+        for instance_id, az, specs, _ in targets:
+            try:
+                devices = headroom[instance_id].result()
+            except PreflightProblem as e:
+                found[instance_id].setdefault(str(e), [])
+            except Exception as e:
+                found[instance_id].setdefault(f"could not read the instance's device names: {e}", [])
+            if found[instance_id]:
+                continue
+            for spec, device in zip(specs, devices):
+                params = volume_params(az, spec['size'], spec['volume_type'], spec.get('iops'),
+                                       spec.get('throughput'), spec['name'], spec.get('tags'))
+                calls.append((instance_id, spec['name'], 'create_volume', ec2.create_volume, (), params))
+                calls.append((instance_id, f"{spec['name']} on {device}", 'attach_volume', ec2.attach_volume,
+                              PLACEHOLDER_ERRORS,
+                              {'InstanceId': instance_id, 'VolumeId': PLACEHOLDER_VOLUME_ID, 'Device': device}))
+
+    if calls:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(calls)))) as executor:
+            futures = [(instance_id, subject, action, executor.submit(dry_run, method, ignore, **params))
+                       for instance_id, subject, action, method, ignore, params in calls]
+            for instance_id, subject, action, future in futures:
+                error = future.result()
+                if error is not None:
+                    found[instance_id].setdefault(f"{action} would fail: {error}", []).append(subject)
+
+    problems = {}
+    for instance_id, messages in found.items():
+        for message, subjects in messages.items():
+            problems.setdefault(instance_id, []).append(
+                f"{message} ({', '.join(subjects)})" if subjects else message
+            )
+    if problems:
+        raise PreflightError(problems)
+
+
+def preflight_groups(clients, groups, max_workers=DEFAULT_API_BUDGET):
+    """Run ``preflight`` for every ``(profile, region)`` group in parallel, each through its own client
+
+    ``groups`` maps each target to its list of preflight targets. Raises one
+    ``PreflightError`` covering every group.
+    """
+    def check(target, client):
+        try:
+            preflight(client, groups[target], max_workers)
+        except PreflightError as e:
+            return e.problems
+        return {}
+
+    problems = {}
+    for outcome in fan_out(check, {target: clients[target] for target in groups}):
+        if outcome['status'] == 'ok':
+            problems.update(outcome['result'])
+        else:
+            label = target_label((outcome['profile'], outcome['region']))
+            problems[label] = [f"preflight could not run: {outcome['error'] or outcome['status']}"]
+    if problems:
+        raise PreflightError(problems)
+
+
+def print_problems(error):
+    """Print a ``PreflightError`` grouped by instance"""
+    print(f"\nPREFLIGHT FAILED: {error}")
+    for instance_id, messages in error.problems.items():
+        print(f"  {instance_id}:")
+        for message in messages:
+            print(f"    - {message}")
@@ -0,0 +1,233 @@
+"""Generate the OS-side script that stripes each created RAID set into one filesystem
+
+One script is written per RAID set: bash using mdadm or LVM for Linux, and
+PowerShell using Storage Spaces or diskpart for Windows. Disks are found by
+their NVMe serial number, which on Nitro instances is the volume ID without
+its dash, so the scripts do not depend on the order the OS enumerated them
+in. On older Xen instances the Linux script falls back to the device name
+the volume was attached as.
+
+Stripe (chunk/interleave) size and filesystem allocation unit follow the
+workload: 64 KiB for SQL Server data, log and tempdb files, which do 64 KiB
+extent I/O, and 256 KiB for backups, which are large sequential writes.
+"""
+import os
+import re
+
+WORKLOAD_PROFILES = {
+    'data': {'stripe_kib': 64, 'allocation_unit_kib': 64},
+    'log': {'stripe_kib': 64, 'allocation_unit_kib': 64},
+    'temp': {'stripe_kib': 64, 'allocation_unit_kib': 64},
+    'backup': {'stripe_kib': 256, 'allocation_unit_kib': 256},
+}
+DEFAULT_WORKLOAD = 'data'
+
+LINUX_TOOLS = ('mdadm', 'lvm')
+WINDOWS_TOOLS = ('storage-spaces', 'diskpart')
+DEFAULT_TOOLS = {'linux': 'mdadm', 'windows': 'storage-spaces'}
+
+
+def workload_for(raid_set):
+    """Return the workload a RAID set name refers to, such as 'log' for 'SQL-Log'"""
+    words = re.split(r'[^a-z]+', raid_set.lower())
+    for workload in WORKLOAD_PROFILES:
+        if workload in words or f"{workload}db" in words:
+            return workload
+    return DEFAULT_WORKLOAD
+
+
+def nvme_serial(volume_id):
+    """EBS NVMe devices report the volume ID without its dash as their serial number"""
+    return volume_id.replace('-', '')
+
+
+def slug(raid_set):
+    return re.sub(r'[^a-z0-9]+', '-', raid_set.lower()).strip('-')
+
+
+def group_raid_sets(created_volumes):
+    """Group ``(volume_id, disk_name, raid_set[, device])`` tuples into ``{raid_set: [disk, ...]}``
+
+    Disks keep their creation order, which is disk-number order.
+    """
+    groups = {}
+    for volume in created_volumes:
+        volume_id, disk_name, raid_set = volume[:3]
+        device = volume[3] if len(volume) > 3 else None
+        groups.setdefault(raid_set, []).append({'volume_id': volume_id, 'name': disk_name, 'device': device})
+    return groups
+
+
+def _header(comment, raid_set, disks, profile, batch_id):
+    lines = [
+        f"{comment} Stripe the {raid_set} RAID set ({len(disks)} disk(s)) into one filesystem",
+        f"{comment} Stripe size {profile['stripe_kib']} KiB, allocation unit {profile['allocation_unit_kib']} KiB",
+    ]
+    if batch_id:
+        lines.append(f"{comment} Generated by ebs-multicreate for batch {batch_id}")
+    for disk in disks:
+        lines.append(f"{comment}   {disk['name']}: {disk['volume_id']}"
+                     + (f" attached as {disk['device']}" if disk['device'] else ""))
+    return lines
+
+
+def linux_script(raid_set, disks, tool='mdadm', batch_id=None, mount_root='/mnt'):
+    """Return a bash script that builds an XFS filesystem striped over ``disks``"""
+    if tool not in LINUX_TOOLS:
+        raise ValueError(f"Unknown Linux RAID tool '{tool}' (use {' or '.join(LINUX_TOOLS)})")
+    profile = WORKLOAD_PROFILES[workload_for(raid_set)]
+    name = slug(raid_set)
+    mount_point = f"{mount_root}/{name}"
+    stripe = profile['stripe_kib']
+    count = len(disks)
+
+    lines = ['#!/bin/bash'] + _header('#', raid_set, disks, profile, batch_id) + [
+        'set -euo pipefail',
+        '',
+        '# Print the block device of an EBS volume: its NVMe serial first, then the attach name (Xen)',
+        'find_disk() {',
+        '    local serial="$1" device="$2" path=/dev/disk/by-id/nvme-Amazon_Elastic_Block_Store_"$1"',
+        '    [ -e "$path" ] && { readlink -f "$path"; return; }',
+        '    path=$(lsblk -dno NAME,SERIAL | awk -v s="$serial" \'$2 == s {print "/dev/" $1; exit}\')',
+        '    [ -n "$path" ] && { echo "$path"; return; }',
+        '    [ -n "$device" ] && [ -b "$device" ] && { echo "$device"; return; }',
+        '    echo "Volume $serial not found; is it attached to this instance?" >&2',
+        '    return 1',
+        '}',
+        '',
+        'DISKS=()',
+    ]
+    for disk in disks:
+        lines.append(f'DISKS+=("$(find_disk {nvme_serial(disk["volume_id"])} "{disk["device"] or ""}")")')
+    lines += [
+        '',
+        'for disk in "${DISKS[@]}"; do',
+        '    if [ -n "$(blkid -o value -s TYPE "$disk" || true)" ]; then',
+        '        echo "$disk already has a filesystem or RAID signature; refusing to overwrite it" >&2',
+        '        exit 1',
+        '    fi',
+        'done',
+        '',
+    ]
+
+    if count == 1:
+        target = '"${DISKS[0]}"'
+        lines.append(f'mkfs.xfs -L {name[:12]} {target}')
+    elif tool == 'mdadm':
+        target = f'/dev/md/{name}'
+        lines += [
+            f'mdadm --create {target} --level=0 --raid-devices={count} --chunk={stripe}K '
+            f'--name={name} "${{DISKS[@]}}"',
+            'MDADM_CONF=/etc/mdadm.conf',
+            '[ -d /etc/mdadm ] && MDADM_CONF=/etc/mdadm/mdadm.conf',
+            f'mdadm --detail --brief {target} >> "$MDADM_CONF"',
+            f'mkfs.xfs -L {name[:12]} -d su={stripe}k,sw={count} {target}',
+        ]
+    else:
+        vg = f"vg_{name.replace('-', '_')}"
+        lv = f"lv_{name.replace('-', '_')}"
+        target = f'/dev/{vg}/{lv}'
+        lines += [
+            'pvcreate "${DISKS[@]}"',
+            f'vgcreate {vg} "${{DISKS[@]}}"',
+            f'lvcreate --yes --stripes {count} --stripesize {stripe}k --extents 100%FREE --name {lv} {vg}',
+            f'mkfs.xfs -L {name[:12]} -d su={stripe}k,sw={count} {target}',
+        ]
+
+    lines += [
+        '',
+        f'mkdir -p {mount_point}',
+        f'UUID=$(blkid -o value -s UUID {target})',
+        f'echo "UUID=$UUID {mount_point} xfs defaults,noatime,nofail 0 2" >> /etc/fstab',
+        f'mount {mount_point}',
+        f'echo "{raid_set} mounted on {mount_point}"',
+        '',
+    ]
+    return '\n'.join(lines)
+
+
+def windows_script(raid_set, disks, tool='storage-spaces', batch_id=None):
+    """Return a PowerShell script that builds an NTFS volume striped over ``disks``"""
+    if tool not in WINDOWS_TOOLS:
+        raise ValueError(f"Unknown Windows RAID tool '{tool}' (use {' or '.join(WINDOWS_TOOLS)})")
+    profile = WORKLOAD_PROFILES[workload_for(raid_set)]
+    stripe_bytes = profile['stripe_kib'] * 1024
+    unit_bytes = profile['allocation_unit_kib'] * 1024
+    label = raid_set[:32]
+    serials = ', '.join(f"'{nvme_serial(disk['volume_id'])}'" for disk in disks)
+
+    lines = ['#Requires -RunAsAdministrator'] + _header('#', raid_set, disks, profile, batch_id) + [
+        "$ErrorActionPreference = 'Stop'",
+        '',
+        '# EBS NVMe disks report serials such as vol0123456789abcdef0_00000001.',
+        f'$serials = @({serials})',
+        '$disks = foreach ($serial in $serials) {',
+        '    $disk = Get-PhysicalDisk | Where-Object { $_.SerialNumber -like "$serial*" }',
+        '    if (-not $disk) { throw "Volume $serial not found; is it attached to this instance?" }',
+        '    if ($disk.CanPool -ne $true -and $serials.Count -gt 1) { throw "Disk $serial is already in use: $($disk.CannotPoolReason)" }',
+        '    $disk',
+        '}',
+        '',
+    ]
+
+    if len(disks) == 1:
+        lines += [
+            '$disks[0] | Get-Disk | Initialize-Disk -PartitionStyle GPT -PassThru |',
+            '    New-Partition -AssignDriveLetter -UseMaximumSize |',
+            f"    Format-Volume -FileSystem NTFS -AllocationUnitSize {unit_bytes} "
+            f"-NewFileSystemLabel '{label}' -Confirm:$false",
+        ]
+    elif tool == 'storage-spaces':
+        lines += [
+            f"New-StoragePool -FriendlyName '{label}' -StorageSubSystemFriendlyName 'Windows Storage*' "
+            f"-PhysicalDisks $disks | Out-Null",
+            f"New-VirtualDisk -StoragePoolFriendlyName '{label}' -FriendlyName '{label}' "
+            f"-ResiliencySettingName Simple -NumberOfColumns {len(disks)} -Interleave {stripe_bytes} "
+            f"-ProvisioningType Fixed -UseMaximumSize |",
+            '    Get-Disk | Initialize-Disk -PartitionStyle GPT -PassThru |',
+            '    New-Partition -AssignDriveLetter -UseMaximumSize |',
+            f"    Format-Volume -FileSystem NTFS -AllocationUnitSize {unit_bytes} "
+            f"-NewFileSystemLabel '{label}' -Confirm:$false",
+        ]
+    else:
+        # diskpart stripes dynamic disks with a fixed 64 KiB stripe; only the allocation unit is tunable
+        lines += [
+            '$numbers = $disks | ForEach-Object { ($_ | Get-Disk).Number }',
+            '$commands = foreach ($number in $numbers) {',
+            '    "select disk $number", "online disk noerr", "attributes disk clear readonly", "convert dynamic"',
+            '}',
+            '$commands += "create volume stripe disk=$($numbers -join \',\')"',
+            f'$commands += "format fs=ntfs unit={profile["allocation_unit_kib"]}K label=""{label}"" quick"',
+            '$commands += "assign"',
+            f"$scriptPath = Join-Path $env:TEMP 'diskpart-{slug(raid_set)}.txt'",
+            '$commands | Set-Content -Path $scriptPath -Encoding ASCII',
+            'diskpart /s $scriptPath',
+            'if ($LASTEXITCODE -ne 0) { throw "diskpart failed with exit code $LASTEXITCODE" }',
+        ]
+
+    lines += [
+        '',
+        f"Get-Volume -FileSystemLabel '{label}' | Format-Table DriveLetter, FileSystemLabel, Size, AllocationUnitSize",
+        '',
+    ]
+    return '\r\n'.join(lines)
+
+
+def write_raid_scripts(created_volumes, directory, platform='linux', tool=None, batch_id=None):
+    """Write one script per RAID set of ``created_volumes`` into ``directory`` and return their paths"""
+    tool = tool or DEFAULT_TOOLS[platform]
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for raid_set, disks in group_raid_sets(created_volumes).items():
+        if platform == 'windows':
+            path = os.path.join(directory, f"raid-{slug(raid_set)}.ps1")
+            content = windows_script(raid_set, disks, tool, batch_id)
+        else:
+            path = os.path.join(directory, f"raid-{slug(raid_set)}.sh")
+            content = linux_script(raid_set, disks, tool, batch_id)
+        with open(path, 'w', newline='') as f:
+            f.write(content)
+        if platform != 'windows':
+            os.chmod(path, 0o755)
+        paths.append(path)
+    return paths
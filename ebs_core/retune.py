@@ -0,0 +1,202 @@
+"""Retune every disk of an existing RAID set in place with modify_volume
+
+A stripe is only as fast as its slowest member, so a change pays off once
+every disk of the set has it. The set's members are found by their Name tags,
+checked up front so that none is modified unless all of them can be, then
+modified at the same time. Their modifications are tracked together, with one
+describe_volumes_modifications call per tick, until every one is optimizing
+or completed.
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from ebs_core.metrics import phase
+from ebs_core.pipeline import log
+from ebs_core.planner import VOLUME_LIMITS, summarize_layout
+from ebs_core.tags import RAID_SET_KEY
+from ebs_core.waiter import FILTER_CHUNK, VolumeStateError, wait_for_modifications
+
+# EBS accepts one modification per volume every six hours
+MODIFICATION_COOLDOWN = 6 * 3600
+IN_PROGRESS_STATES = ('modifying', 'optimizing')
+# Previous-generation magnetic (standard) volumes cannot be a modification target
+MODIFIABLE_TYPES = ('gp2', 'gp3', 'io1', 'io2', 'st1', 'sc1')
+# Settings a retune can change; modify_volume parameters and describe_volumes keys share these names
+SETTINGS = ('Size', 'VolumeType', 'Iops', 'Throughput')
+
+_DISK_NAME = re.compile(r'^(?P<set>.+)-Disk(?P<n>\d+)$')
+
+
+class RetuneError(Exception):
+    """Raised when a RAID set cannot be retuned as asked; no volume has been modified"""
+
+
+def tag_value(resource, key):
+    return next((tag['Value'] for tag in resource.get('Tags', []) if tag['Key'] == key), None)
+
+
+def raid_sets_on(ec2, instance_id):
+    """Return ``{raid_set: [volume, ...]}`` for the RAID sets attached to an instance, disks in number order
+
+    A volume belongs to a set through its Name tag, ``<set>-Disk<n>``, or
+    through its RaidSet tag, which also covers single-disk sets named after
+    the set itself. Other volumes, such as the root volume, are left out.
+    """
+    members = {}
+    paginator = ec2.get_paginator('describe_volumes')
+    for page in paginator.paginate(Filters=[{'Name': 'attachment.instance-id', 'Values': [instance_id]}]):
+        for volume in page['Volumes']:
+            name = tag_value(volume, 'Name') or ''
+            match = _DISK_NAME.match(name)
+            raid_set = tag_value(volume, RAID_SET_KEY) or (match.group('set') if match else None)
+            if raid_set is None:
+                continue
+            disk_number = int(match.group('n')) if match and match.group('set') == raid_set else 1
+            members.setdefault(raid_set, []).append((disk_number, volume))
+    return {
+        raid_set: [volume for _, volume in sorted(disks, key=lambda disk: disk[0])]
+        for raid_set, disks in members.items()
+    }
+
+
+def disk_numbers(raid_set, volumes):
+    numbers = []
+    for volume in volumes:
+        match = _DISK_NAME.match(tag_value(volume, 'Name') or '')
+        numbers.append(int(match.group('n')) if match and match.group('set') == raid_set else 1)
+    return numbers
+
+
+def current_settings(volume):
+    return {key: volume.get(key) for key in SETTINGS}
+
+
+def plan_retune(raid_set, volumes, size=None, volume_type=None, iops=None, throughput=None):
+    """Return one ``{'volume', 'current', 'target', 'changes'}`` per member that needs modifying
+
+    Members already at the target are left out, so retuning a set again
+    after a partial failure only touches the disks that missed the change.
+    Raises ``RetuneError`` if the set has gaps in its disk numbers or the
+    target breaks a limit of the volume type.
+    """
+    numbers = disk_numbers(raid_set, volumes)
+    if numbers != list(range(1, len(numbers) + 1)):
+        missing = sorted(set(range(1, max(numbers) + 1)) - set(numbers))
+        raise RetuneError(f"{raid_set} is missing {', '.join(f'Disk{n}' for n in missing)} on this instance; "
+                          f"retuning only some members would leave the stripe uneven")
+
+    plan = []
+    for volume in volumes:
+        current = current_settings(volume)
+        target = dict(current)
+        if volume_type:
+            target['VolumeType'] = volume_type
+        if size:
+            target['Size'] = size
+        if iops:
+            target['Iops'] = iops
+        if throughput:
+            target['Throughput'] = throughput
+        check_limits(volume['VolumeId'], current, target)
+        changes = {key: target[key] for key in SETTINGS if target[key] != current[key]}
+        if changes:
+            plan.append({'volume': volume, 'current': current, 'target': target, 'changes': changes})
+    return plan
+
+
+def check_limits(volume_id, current, target):
+    """Raise ``RetuneError`` if ``target`` cannot be applied to a volume with settings ``current``"""
+    if target['Size'] < current['Size']:
+        raise RetuneError(f"{volume_id} is {current['Size']} GiB; EBS volumes can grow but not shrink")
+    limits = VOLUME_LIMITS.get(target['VolumeType'])
+    if limits is None:
+        return
+    size, iops, throughput = target['Size'], target['Iops'], target['Throughput']
+    if iops and iops > min(limits['max_iops'], size * limits['iops_per_gib']):
+        raise RetuneError(f"{iops} IOPS is more than a {size} GiB {target['VolumeType']} volume allows "
+                          f"({min(limits['max_iops'], size * limits['iops_per_gib'])})")
+    if target['VolumeType'] == 'gp3' and throughput:
+        if throughput > limits['max_throughput']:
+            raise RetuneError(f"gp3 throughput is limited to {limits['max_throughput']} MiB/s")
+        if throughput > (iops or limits['base_iops']) * limits['throughput_per_iops']:
+            raise RetuneError(f"{throughput} MiB/s needs at least "
+                              f"{int(throughput / limits['throughput_per_iops'])} IOPS on gp3")
+    elif target['VolumeType'] != 'gp3' and throughput and throughput != current['Throughput']:
+        raise RetuneError("Throughput can only be set on gp3 volumes")
+
+
+def check_modifiable(ec2, volume_ids, now=None):
+    """Raise ``RetuneError`` unless every volume can be modified right now
+
+    One batched describe_volumes_modifications call per 200 volumes finds
+    members with a modification still in progress or one started less than
+    six hours ago, which EBS would reject.
+    """
+    now = now or datetime.now(timezone.utc)
+    blocked = []
+    for start in range(0, len(volume_ids), FILTER_CHUNK):
+        chunk = volume_ids[start:start + FILTER_CHUNK]
+        paginator = ec2.get_paginator('describe_volumes_modifications')
+        for page in paginator.paginate(Filters=[{'Name': 'volume-id', 'Values': chunk}]):
+            for modification in page['VolumesModifications']:
+                state = modification['ModificationState']
+                elapsed = (now - modification['StartTime']).total_seconds()
+                if state in IN_PROGRESS_STATES:
+                    blocked.append(f"{modification['VolumeId']} is still {state}")
+                elif state != 'failed' and elapsed < MODIFICATION_COOLDOWN:
+                    minutes = int((MODIFICATION_COOLDOWN - elapsed) // 60) + 1
+                    blocked.append(f"{modification['VolumeId']} was modified recently; "
+                                   f"it can be modified again in {minutes // 60}h {minutes % 60:02d}m")
+    if blocked:
+        raise RetuneError("Not every member can be modified now: " + "; ".join(blocked))
+
+
+def retune(ec2, plan, max_workers=None, waiter_options=None):
+    """Modify every volume of ``plan`` at once and wait until they are all optimizing or completed
+
+    Returns ``{'modified': [volume_id, ...], 'failed': {volume_id: error}}``.
+    A member whose modify_volume call fails does not stop the others, which
+    are still waited for, so the result shows exactly which disks have the
+    change.
+    """
+    def modify(entry):
+        volume_id = entry['volume']['VolumeId']
+        with phase('modify'):
+            ec2.modify_volume(VolumeId=volume_id, **entry['changes'])
+        log(f"Modifying {volume_id}: " + ", ".join(f"{key} {entry['current'][key]} -> {value}"
+                                                    for key, value in entry['changes'].items()))
+        return volume_id
+
+    modified = []
+    failed = {}
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, len(plan))) as executor:
+        futures = {executor.submit(modify, entry): entry['volume']['VolumeId'] for entry in plan}
+        for future, volume_id in futures.items():
+            try:
+                modified.append(future.result())
+            except Exception as e:
+                failed[volume_id] = e
+
+    pending = list(modified)
+    try:
+        for modification in wait_for_modifications(ec2, pending, **(waiter_options or {})):
+            log(f"{modification['VolumeId']} is {modification['ModificationState']}")
+            pending.remove(modification['VolumeId'])
+    except VolumeStateError as e:
+        failed[e.volume_id] = e
+        for volume_id in pending:
+            if volume_id != e.volume_id:
+                failed.setdefault(volume_id, Exception("Not confirmed; another member's modification failed"))
+    return {'modified': [volume_id for volume_id in modified if volume_id not in failed], 'failed': failed}
+
+
+def uniform_layout(ec2, volume_ids):
+    """Return the ``summarize_layout`` of the set if every member now has the same settings, otherwise None"""
+    with phase('summary'):
+        volumes = ec2.describe_volumes(Filters=[{'Name': 'volume-id', 'Values': volume_ids}])['Volumes']
+    settings = {tuple(current_settings(volume)[key] for key in SETTINGS) for volume in volumes}
+    if len(settings) != 1 or len(volumes) != len(volume_ids):
+        return None
+    size, volume_type, iops, throughput = settings.pop()
+    return summarize_layout(volume_type, len(volumes), size, iops, throughput)
@@ -0,0 +1,217 @@
+"""Delete every volume a failed or unwanted batch created
+
+A batch that fails partway leaves encrypted volumes behind, some attached,
+some available, that keep being billed. Every volume a batch creates is
+tagged with its BatchId on create, so one paginated describe_volumes call
+with a ``tag:BatchId`` filter finds all of them, including volumes whose
+create response was lost. The attached ones are detached at once; one
+VolumeWaiter then polls them all with a single describe_volumes call per
+tick, and each volume is deleted as soon as it is available.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ebs_core.api import DEFAULT_API_BUDGET
+from ebs_core.clients import build_clients, target_client
+from ebs_core.discovery import select_profile
+from ebs_core.metrics import phase
+from ebs_core.pipeline import log
+from ebs_core.retune import tag_value
+from ebs_core.tags import BATCH_KEY
+from ebs_core.waiter import VolumeWaiter
+
+# Volumes in these states can be deleted as they are; 'error' volumes never become available
+DELETABLE_STATES = ('available', 'error')
+# Volumes in these states are already gone or on their way out
+GONE_STATES = ('deleting', 'deleted')
+
+
+def find_batch_volumes(ec2, batch_id, tag_filters=()):
+    """Return every volume tagged with ``batch_id`` that is not already being deleted
+
+    ``tag_filters`` is a list of ``(key, value)`` pairs that narrow the
+    search further, such as ``('InstanceId', 'i-...')``; an empty value
+    matches any value of the key.
+    """
+    filters = [{'Name': f"tag:{BATCH_KEY}", 'Values': [batch_id]}]
+    for key, value in tag_filters:
+        filters.append({'Name': f"tag:{key}", 'Values': [value]} if value else {'Name': 'tag-key', 'Values': [key]})
+    volumes = []
+    paginator = ec2.get_paginator('describe_volumes')
+    with phase('discovery'):
+        for page in paginator.paginate(Filters=filters):
+            volumes.extend(volume for volume in page['Volumes'] if volume['State'] not in GONE_STATES)
+    return volumes
+
+
+def describe_volume(volume):
+    """Return a one-line description of a volume for the rollback listing"""
+    name = tag_value(volume, 'Name') or '-'
+    attachments = [f"attached to {a['InstanceId']} as {a['Device']}" for a in volume.get('Attachments', [])]
+    return f"{volume['VolumeId']}  {name}  {volume['Size']} GiB {volume['VolumeType']}  " \
+           f"{', '.join(attachments) or volume['State']}"
+
+
+def rollback(ec2, volumes, max_workers=DEFAULT_API_BUDGET, force=False, waiter_options=None):
+    """Detach and delete ``volumes`` and return ``{'deleted': [volume_id, ...], 'failed': {volume_id: error}}``
+
+    Every attached volume is detached at once. The detached volumes and any
+    that were still being created are tracked by one waiter, and each is
+    deleted on the pool as soon as it is available, while the rest are still
+    detaching. A volume that fails does not stop the others.
+    """
+    deleted = []
+    failed = {}
+
+    # Workers enter their phase themselves; the phase does not follow work onto pool threads
+    def detach(volume):
+        with phase('detach'):
+            for attachment in volume['Attachments']:
+                if attachment['State'] != 'detaching':
+                    ec2.detach_volume(VolumeId=volume['VolumeId'], InstanceId=attachment['InstanceId'], Force=force)
+        log(f"Detaching {volume['VolumeId']} from {volume['Attachments'][0]['InstanceId']}")
+        return volume['VolumeId']
+
+    def delete(volume_id):
+        with phase('delete'):
+            ec2.delete_volume(VolumeId=volume_id)
+        log(f"Deleted {volume_id}")
+        return volume_id
+
+    waiter = VolumeWaiter(ec2, 'available', failure_states=(), **(waiter_options or {}))
+    # A volume that fails to create never becomes available, but can be deleted as it is
+    waiter.target_states.add('error')
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(volumes)))) as executor:
+        deletions = {}
+        detaching = {}
+        for volume in volumes:
+            if volume['Attachments']:
+                detaching[executor.submit(detach, volume)] = volume['VolumeId']
+            elif volume['State'] in DELETABLE_STATES:
+                deletions[executor.submit(delete, volume['VolumeId'])] = volume['VolumeId']
+            else:
+                waiter.add(volume['VolumeId'])
+        for future, volume_id in detaching.items():
+            try:
+                waiter.add(future.result())
+            except Exception as e:
+                failed[volume_id] = e
+
+        while waiter.pending:
+            with phase('wait'):
+                ready, timed_out = waiter.poll()
+            for volume in ready:
+                deletions[executor.submit(delete, volume['VolumeId'])] = volume['VolumeId']
+            for error in timed_out:
+                failed[error.volume_id] = error
+            if waiter.pending:
+                with phase('wait'):
+                    time.sleep(waiter.next_delay())
+
+        for future, volume_id in deletions.items():
+            try:
+                deleted.append(future.result())
+            except Exception as e:
+                failed[volume_id] = e
+    return {'deleted': deleted, 'failed': failed}
+
+
+def rollback_clients(args):
+    """Return the ``{(profile, region): ec2_client}`` to search for the batch's volumes, or None to quit
+
+    A batch journaled on this machine is searched for where it was created.
+    Otherwise ``--profiles``/``--regions``, then ``--profile``/``--region``,
+    and finally the profile prompt say where to look.
+    """
+    from ebs_core.journal import Journal, resume_groups
+
+    journal = Journal(args.rollback)
+    if journal.instances:
+        return {target: target_client(target) for target in resume_groups(journal)}
+    if args.profiles or args.regions:
+        return build_clients(args.profiles, args.regions)
+    if args.profile or args.region:
+        return build_clients([args.profile], [args.region])
+    profile = select_profile()
+    if not profile:
+        return None
+    return build_clients([profile], None)
+
+
+def confirm(count, batch_id):
+    """Ask before deleting; return True to go ahead"""
+    while True:
+        answer = input(f"\nDetach and DELETE these {count} volume(s) of batch {batch_id}? (y/n) or * to quit: ")
+        answer = answer.lower().strip()
+        if answer in ('y', 'yes'):
+            return True
+        if answer in ('n', 'no', '*'):
+            print("Nothing was deleted.")
+            return False
+        print("Please enter 'y' for yes or 'n' for no.")
+
+
+def run_rollback_command(args):
+    """Run ``--rollback`` mode for a script and return a process exit code
+
+    Every target is searched at once and, after one confirmation, rolled
+    back at once. The batch's journal is set aside once every volume is
+    deleted, so the run is no longer offered for ``--resume``.
+    """
+    from ebs_core.fanout import fan_out, target_label
+    from ebs_core.journal import journal_path
+
+    batch_id = args.rollback
+    clients = rollback_clients(args)
+    if not clients:
+        # Quitting at the profile prompt rolls nothing back, as does answering no
+        print("Nothing was deleted.")
+        return 1
+    found = {}
+    for outcome in fan_out(lambda target, client: find_batch_volumes(client, batch_id, args.rollback_tags), clients):
+        target = (outcome['profile'], outcome['region'])
+        if outcome['status'] != 'ok':
+            print(f"{target_label(target)}: could not list volumes: {outcome['error'] or outcome['status']}")
+            return 1
+        if outcome['result']:
+            found[target] = outcome['result']
+
+    count = sum(len(volumes) for volumes in found.values())
+    if not count:
+        print(f"No volumes of batch {batch_id} found; nothing to roll back.")
+        return 0
+    print(f"\nVolumes of batch {batch_id}:")
+    for target, volumes in found.items():
+        print(f"  {target_label(target)}:")
+        for volume in volumes:
+            print(f"    {describe_volume(volume)}")
+    if not args.yes and not confirm(count, batch_id):
+        return 1
+
+    started = time.monotonic()
+    outcomes = fan_out(lambda target, client: rollback(client, found[target], force=args.force_detach),
+                       {target: clients[target] for target in found})
+    deleted = 0
+    failed = {}
+    for outcome in outcomes:
+        if outcome['status'] == 'ok':
+            deleted += len(outcome['result']['deleted'])
+            failed.update(outcome['result']['failed'])
+        else:
+            label = target_label((outcome['profile'], outcome['region']))
+            failed[label] = outcome['error'] or outcome['status']
+
+    print(f"\n=== ROLLBACK SUMMARY ===")
+    print(f"Batch: {batch_id}")
+    print(f"Volumes deleted: {deleted}/{count} in {time.monotonic() - started:.1f}s")
+    for subject, error in failed.items():
+        print(f"  - {subject}: FAILED: {error}")
+    if failed:
+        print(f"Run --rollback {batch_id} again to retry the volumes that are left.")
+        return 1
+
+    path = journal_path(batch_id)
+    if os.path.exists(path) and not args.rollback_tags:
+        os.replace(path, f"{path}.rolled-back")
+    return 0
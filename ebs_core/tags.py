@@ -0,0 +1,29 @@
+"""Tag sets applied to volumes in the same create_volume request"""
+import time
+import uuid
+
+OWNER_KEY = 'Owner'
+RAID_SET_KEY = 'RaidSet'
+INSTANCE_KEY = 'InstanceId'
+BATCH_KEY = 'BatchId'
+
+
+def new_batch_id():
+    """Return a sortable, unique ID for one run of a script"""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def batch_tags(batch_id, instance_id, owner=None, extra_tags=None):
+    """Build the tags shared by every volume created in a batch"""
+    tags = {BATCH_KEY: batch_id, INSTANCE_KEY: instance_id}
+    if owner:
+        tags[OWNER_KEY] = owner
+    tags.update(extra_tags or {})
+    return tags
+
+
+def tag_specifications(name, tags=None):
+    """Build create_volume TagSpecifications for a Name tag plus any extra tags"""
+    tag_list = [{'Key': 'Name', 'Value': name}]
+    tag_list.extend({'Key': key, 'Value': value} for key, value in (tags or {}).items() if key != 'Name')
+    return [{'ResourceType': 'volume', 'Tags': tag_list}]
@@ -0,0 +1,214 @@
+"""Batched waiters that track many pending volumes with one describe call per tick"""
+import random
+import threading
+import time
+
+from ebs_core.metrics import phase
+
+BASE_DELAY = 1
+MAX_DELAY = 15
+DEFAULT_TIMEOUT = 600
+
+# describe_volumes accepts at most 200 values per filter
+FILTER_CHUNK = 200
+# Seconds a just-attached volume may still be described without its attachment
+ATTACH_GRACE = 5
+
+
+class VolumeStateError(Exception):
+    """Raised when a volume reaches a state it can never leave, such as 'error'"""
+
+    def __init__(self, volume_id, state, message=None):
+        super().__init__(message or f"Volume {volume_id} entered the {state} state")
+        self.volume_id = volume_id
+        self.state = state
+
+
+class VolumeWaiter:
+    """Wait for a growing set of volumes to reach ``target_state``
+
+    Volumes are polled together with a ``volume-id`` filter, which, unlike
+    ``VolumeIds``, does not fail when a just-created volume is not yet
+    visible. The delay between ticks grows exponentially with full jitter and
+    resets whenever a new volume is added.
+    """
+
+    def __init__(self, ec2, target_state='available', failure_states=('error',),
+                 base_delay=None, max_delay=None, timeout=DEFAULT_TIMEOUT):
+        self.ec2 = ec2
+        self.target_state = target_state
+        self.target_states = {target_state}
+        self.failure_states = set(failure_states)
+        # Module defaults are read here, not at import, so they can be tuned globally
+        self.base_delay = BASE_DELAY if base_delay is None else base_delay
+        self.max_delay = MAX_DELAY if max_delay is None else max_delay
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._delay = self.base_delay
+
+    @property
+    def pending(self):
+        with self._lock:
+            return set(self._pending)
+
+    def add(self, volume_id):
+        """Start tracking a volume"""
+        with self._lock:
+            self._pending[volume_id] = time.monotonic()
+            self._delay = self.base_delay
+
+    def poll(self):
+        """Describe every pending volume once
+
+        Returns ``(ready, failed)`` where ``ready`` is a list of volume
+        descriptions that reached the target state and ``failed`` is a list of
+        ``VolumeStateError`` for volumes that errored or timed out.
+        """
+        volume_ids = sorted(self.pending)
+        ready = []
+        failed = []
+        for start in range(0, len(volume_ids), FILTER_CHUNK):
+            for volume_id, state, description in self._describe(volume_ids[start:start + FILTER_CHUNK]):
+                if state in self.target_states:
+                    ready.append(description)
+                elif state in self.failure_states:
+                    failed.append(VolumeStateError(volume_id, state, self._failure_message(description)))
+
+        now = time.monotonic()
+        with self._lock:
+            for volume in ready:
+                self._pending.pop(volume['VolumeId'], None)
+            for error in failed:
+                self._pending.pop(error.volume_id, None)
+            if self.timeout is not None:
+                for volume_id, added in list(self._pending.items()):
+                    if now - added > self.timeout:
+                        del self._pending[volume_id]
+                        failed.append(VolumeStateError(
+                            volume_id,
+                            'timeout',
+                            f"Timed out waiting for volume {volume_id} to become {self.target_state}"
+                        ))
+        return ready, failed
+
+    def _describe(self, volume_ids):
+        """Yield ``(volume_id, state, description)`` for each of ``volume_ids`` that is visible yet"""
+        desc = self.ec2.describe_volumes(Filters=[{'Name': 'volume-id', 'Values': volume_ids}])
+        for volume in desc['Volumes']:
+            yield volume['VolumeId'], volume['State'], volume
+
+    def _failure_message(self, description):
+        return None
+
+    def next_delay(self):
+        """Return a jittered delay before the next tick and back off for the one after"""
+        with self._lock:
+            delay = self._delay
+            self._delay = min(self.max_delay, self._delay * 2)
+        return random.uniform(delay / 2, delay)
+
+
+class ModificationWaiter(VolumeWaiter):
+    """Wait for a set of volume modifications with one describe_volumes_modifications call per tick
+
+    A modification is reported ready once it is 'optimizing', when the new
+    size and type are usable and performance is ramping up to the new figures,
+    or already 'completed'. ``target_state='completed'`` waits for the end.
+    """
+
+    def __init__(self, ec2, target_state='optimizing', **kwargs):
+        super().__init__(ec2, target_state, failure_states=('failed',), **kwargs)
+        if target_state == 'optimizing':
+            self.target_states.add('completed')
+
+    def _describe(self, volume_ids):
+        desc = self.ec2.describe_volumes_modifications(Filters=[{'Name': 'volume-id', 'Values': volume_ids}])
+        for modification in desc['VolumesModifications']:
+            yield modification['VolumeId'], modification['ModificationState'], modification
+
+    def _failure_message(self, description):
+        reason = description.get('StatusMessage')
+        if reason:
+            return f"Modification of volume {description['VolumeId']} failed: {reason}"
+        return None
+
+
+class AttachmentWaiter(VolumeWaiter):
+    """Wait until a set of volumes is attached to one instance, with one describe_volumes call per tick
+
+    attach_volume only starts an attachment. A volume is ready once its
+    attachment to ``instance_id`` is 'attached'. An attachment that is no
+    longer there, because EC2 dropped it and the volume is available again,
+    is reported as failed with state 'detached' as soon as it disappears, or,
+    if it was never seen, once ``grace`` seconds have passed since the volume
+    was added, which allows for describe_volumes lagging behind the
+    attach_volume call.
+    """
+
+    def __init__(self, ec2, instance_id, grace=ATTACH_GRACE, **kwargs):
+        super().__init__(ec2, 'attached', failure_states=('detached', 'error'), **kwargs)
+        self.instance_id = instance_id
+        self.grace = grace
+        self._seen = set()
+
+    def add(self, volume_id):
+        """Start tracking a volume's new attachment"""
+        with self._lock:
+            self._seen.discard(volume_id)
+        super().add(volume_id)
+
+    def _describe(self, volume_ids):
+        now = time.monotonic()
+        with self._lock:
+            added = dict(self._pending)
+            seen = set(self._seen)
+        desc = self.ec2.describe_volumes(Filters=[{'Name': 'volume-id', 'Values': volume_ids}])
+        for volume in desc['Volumes']:
+            volume_id = volume['VolumeId']
+            attachment = next((a for a in volume['Attachments'] if a['InstanceId'] == self.instance_id), None)
+            if volume['State'] == 'error':
+                yield volume_id, 'error', volume
+            elif attachment is not None:
+                with self._lock:
+                    self._seen.add(volume_id)
+                yield volume_id, attachment['State'], volume
+            elif volume_id in seen or now - added.get(volume_id, now) > self.grace:
+                yield volume_id, 'detached', volume
+
+    def _failure_message(self, description):
+        if description['State'] == 'error':
+            return None
+        return f"Volume {description['VolumeId']} did not stay attached to {self.instance_id}"
+
+
+def _drain(waiter, volume_ids):
+    for volume_id in volume_ids:
+        waiter.add(volume_id)
+    while waiter.pending:
+        # Only the polling and sleeping count as waiting, not the caller's work between yields
+        with phase('wait'):
+            ready, failed = waiter.poll()
+        if failed:
+            raise failed[0]
+        for volume in ready:
+            yield volume
+        if waiter.pending:
+            with phase('wait'):
+                time.sleep(waiter.next_delay())
+
+
+def wait_for_volumes(ec2, volume_ids, target_state='available', **kwargs):
+    """Yield each volume description as soon as it reaches ``target_state``
+
+    Raises ``VolumeStateError`` as soon as any volume fails.
+    """
+    return _drain(VolumeWaiter(ec2, target_state, **kwargs), volume_ids)
+
+
+def wait_for_modifications(ec2, volume_ids, target_state='optimizing', **kwargs):
+    """Yield each volume modification as soon as it is ``target_state`` (or, for 'optimizing', completed)
+
+    Raises ``VolumeStateError`` as soon as any modification fails.
+    """
+    return _drain(ModificationWaiter(ec2, target_state, **kwargs), volume_ids)
@@ -0,0 +1,125 @@
+"""Retries, ClientTokens and adaptive rate limiting of ResilientClient, against a stub EC2 client"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+from ebs_core import api  # noqa: E402
+from ebs_core.api import MAX_ATTEMPTS, MUTATING_RATE, RateLimiter, ResilientClient, TokenBucket  # noqa: E402
+from ebs_core.fake_ec2 import client_error  # noqa: E402
+from ebs_core.metrics import Metrics  # noqa: E402
+
+
+class StubEC2:
+    """Fail each action with the error codes queued for it, then succeed; every call's arguments are kept"""
+
+    def __init__(self, **errors):
+        self.errors = {action: list(codes) for action, codes in errors.items()}
+        self.calls = []
+
+    def _call(self, action, kwargs):
+        self.calls.append((action, kwargs))
+        codes = self.errors.get(action)
+        if codes:
+            raise client_error(codes.pop(0), action)
+
+    def create_volume(self, **kwargs):
+        self._call('create_volume', kwargs)
+        return {'VolumeId': 'vol-1', 'State': 'creating'}
+
+    def attach_volume(self, **kwargs):
+        self._call('attach_volume', kwargs)
+        return {'State': 'attaching'}
+
+    def describe_volumes(self, **kwargs):
+        self._call('describe_volumes', kwargs)
+        return {'Volumes': []}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(api, 'BACKOFF_BASE', 0)
+
+
+def resilient(stub, metrics=None, max_attempts=MAX_ATTEMPTS):
+    """Return a ResilientClient over ``stub`` whose buckets refill fast enough not to slow the tests"""
+    rates = {action: (1000, 10) for action in ('create_volume', 'attach_volume', 'describe_volumes')}
+    return ResilientClient(stub, RateLimiter(rates), max_attempts, metrics or Metrics())
+
+
+def stats_of(metrics, action):
+    (_, _, stats), = [row for row in metrics.hot_spots() if row[1] == action]
+    return stats
+
+
+def test_throttled_calls_are_retried():
+    stub = StubEC2(describe_volumes=['RequestLimitExceeded', 'RequestLimitExceeded', 'InternalError'])
+    metrics = Metrics()
+    assert resilient(stub, metrics=metrics).describe_volumes() == {'Volumes': []}
+    assert len(stub.calls) == 4
+    stats = stats_of(metrics, 'describe_volumes')
+    assert (stats.calls, stats.attempts, stats.throttles, stats.errors) == (1, 4, 2, 0)
+
+
+def test_retried_create_keeps_its_client_token():
+    stub = StubEC2(create_volume=['RequestLimitExceeded', 'ServiceUnavailable'])
+    ec2 = resilient(stub)
+    assert ec2.create_volume(AvailabilityZone='us-east-1a', Size=10)['VolumeId'] == 'vol-1'
+    tokens = [kwargs['ClientToken'] for _, kwargs in stub.calls]
+    assert len(tokens) == 3
+    assert tokens[0] and len(set(tokens)) == 1
+
+    ec2.create_volume(AvailabilityZone='us-east-1a', Size=10, ClientToken='journaled')
+    assert stub.calls[-1][1]['ClientToken'] == 'journaled'
+
+
+def test_non_retryable_errors_are_raised():
+    stub = StubEC2(attach_volume=['VolumeInUse', 'VolumeInUse'])
+    metrics = Metrics()
+    with pytest.raises(ClientError) as e:
+        resilient(stub, metrics=metrics).attach_volume(VolumeId='vol-1', InstanceId='i-1', Device='/dev/xvdf')
+    assert e.value.response['Error']['Code'] == 'VolumeInUse'
+    assert len(stub.calls) == 1
+    assert stats_of(metrics, 'attach_volume').errors == 1
+
+
+def test_retries_stop_at_max_attempts():
+    stub = StubEC2(describe_volumes=['RequestLimitExceeded'] * 5)
+    with pytest.raises(ClientError):
+        resilient(stub, max_attempts=3).describe_volumes()
+    assert len(stub.calls) == 3
+
+
+def test_throttling_lowers_the_rate():
+    stub = StubEC2(create_volume=['RequestLimitExceeded', 'RequestLimitExceeded'])
+    ec2 = ResilientClient(stub, RateLimiter({'create_volume': (40, 50)}), metrics=Metrics())
+    ec2.create_volume(AvailabilityZone='us-east-1a', Size=10)
+    # Halved twice, then one success creeps back by a twentieth of the maximum
+    assert ec2.limiter.bucket('create_volume').rate == pytest.approx(40 / 4 + 40 / 20)
+    # Other actions keep their own rate
+    assert ec2.limiter.bucket('attach_volume').rate == MUTATING_RATE[0]
+
+
+def test_token_bucket_rate_bounds():
+    bucket = TokenBucket(rate=4, burst=1, min_rate=1)
+    for _ in range(5):
+        bucket.throttled()
+    assert bucket.rate == 1
+    for _ in range(100):
+        bucket.succeeded()
+    assert bucket.rate == 4
+
+
+def test_token_bucket_waits_once_the_burst_is_spent():
+    bucket = TokenBucket(rate=100, burst=2)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    waited = bucket.acquire()
+    assert waited == pytest.approx(1 / 100, abs=0.005)
+    bucket.throttled()
+    # Queued behind the last caller at half the rate, the next one waits longer than it did
+    assert bucket.acquire() > 1.5 * waited
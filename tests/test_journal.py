@@ -0,0 +1,125 @@
+"""Resuming a journaled batch after the run was killed, checked against the local EC2 stand-in"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ebs_core.api import ResilientClient  # noqa: E402
+from ebs_core.devices import DeviceAllocator  # noqa: E402
+from ebs_core.fake_ec2 import FakeEC2  # noqa: E402
+from ebs_core.journal import Journal, client_token, resume_groups  # noqa: E402
+from ebs_core.pipeline import Pipeline  # noqa: E402
+
+SCRIPT = 'createebs.py'
+VOLUME_SET = {'name': 'Data', 'disks': 3, 'size': 10, 'type': 'gp3', 'iops': None, 'throughput': None}
+SPECS = [{'name': f"Data-{n}", 'size': 10, 'volume_type': 'gp3'} for n in range(1, 4)]
+
+
+class Killed(BaseException):
+    """Stands in for the run being killed; like KeyboardInterrupt, the pipeline does not catch it"""
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('EBS_MULTICREATE_CACHE_DIR', str(tmp_path))
+
+
+@pytest.fixture
+def fake():
+    fake = FakeEC2(create_delay=0.05, attach_delay=0.02, seed=1)
+    fake.add_instance(name='web-01')
+    return fake
+
+
+def run_batch(fake, journal):
+    """Provision SPECS on the fake's instance the way ``createebs.py`` does, recording them in ``journal``"""
+    (instance_id, az, _), = resume_groups(journal)[(None, None)]
+    ec2 = ResilientClient(fake)
+    pipeline = Pipeline(ec2, instance_id, az, DeviceAllocator(ec2, instance_id),
+                        waiter_options={'base_delay': 0.01, 'max_delay': 0.05}, journal=journal)
+    return pipeline.run(SPECS)
+
+
+def start_batch(fake, batch_id):
+    journal = Journal(batch_id)
+    journal.begin(SCRIPT, 'interactive', owner=None, tags={}, manifest=None)
+    instance_id, = fake.instances
+    journal.plan_instance(instance_id, fake.instances[instance_id]['Placement']['AvailabilityZone'], [VOLUME_SET])
+    return journal
+
+
+def resume_batch(fake, batch_id):
+    journal = Journal.resume(batch_id, SCRIPT)
+    try:
+        return run_batch(fake, journal)
+    finally:
+        journal.close()
+
+
+def volumes_named(fake, *names):
+    """Return the fake's volumes named one of ``names``, or every volume of the batch"""
+    names = names or [spec['name'] for spec in SPECS]
+    return [v for v in fake.volumes.values() if any({'Key': 'Name', 'Value': name} in v['Tags'] for name in names)]
+
+
+def test_resume_after_create_before_attach(fake):
+    attach_volume = fake.attach_volume
+
+    def killed(**kwargs):
+        raise Killed()
+    fake.attach_volume = killed
+    journal = start_batch(fake, 'b1')
+    with pytest.raises(Killed):
+        run_batch(fake, journal)
+    journal.close()
+    assert len(volumes_named(fake)) == len(SPECS)
+    assert not any(v['Attachments'] for v in volumes_named(fake))
+
+    fake.attach_volume = attach_volume
+    fake.calls.clear()
+    results = resume_batch(fake, 'b1')
+    assert [r['status'] for r in results] == ['attached'] * len(SPECS)
+    assert fake.calls['create_volume'] == 0
+    assert sorted(r['volume_id'] for r in results) == sorted(v['VolumeId'] for v in volumes_named(fake))
+    assert Journal('b1').unfinished() == 0
+
+
+def test_lost_create_response_is_adopted(fake):
+    create_volume = fake.create_volume
+
+    def lost(**kwargs):
+        volume = create_volume(**kwargs)
+        if kwargs['TagSpecifications'][0]['Tags'][0]['Value'] == 'Data-2':
+            # The volume exists, but the run dies before it hears about it
+            raise Killed()
+        return volume
+    fake.create_volume = lost
+    journal = start_batch(fake, 'b2')
+    with pytest.raises(Killed):
+        run_batch(fake, journal)
+    journal.close()
+    lost_volume, = volumes_named(fake, 'Data-2')
+    instance_id, = fake.instances
+    assert Journal('b2').disk(client_token(journal.run_id, instance_id, 'Data-2'))['volume_id'] is None
+
+    fake.create_volume = create_volume
+    results = resume_batch(fake, 'b2')
+    assert [r['status'] for r in results] == ['attached'] * len(SPECS)
+    assert results[1]['volume_id'] == lost_volume['VolumeId']
+    assert volumes_named(fake, 'Data-2') == [lost_volume]
+    assert len(volumes_named(fake)) == len(SPECS)
+
+
+def test_resume_complete_batch_is_noop(fake):
+    journal = start_batch(fake, 'b3')
+    first = run_batch(fake, journal)
+    journal.close()
+    assert [r['status'] for r in first] == ['attached'] * len(SPECS)
+
+    fake.calls.clear()
+    results = resume_batch(fake, 'b3')
+    assert [(r['status'], r['volume_id'], r['device']) for r in results] == \
+        [(r['status'], r['volume_id'], r['device']) for r in first]
+    assert not fake.calls
@@ -0,0 +1,73 @@
+"""Cheapest striped layouts for a performance target, within the EBS limits of gp3 and io2"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ebs_core.planner import (VOLUME_LIMITS, cheapest_disk, format_layout, parse_target, plan_layout,  # noqa: E402
+                              plan_layouts)
+from ebs_core.preflight import SIZE_LIMITS, volume_problems  # noqa: E402
+
+
+def target(iops=0, throughput=0, capacity=0):
+    return {'iops': iops, 'throughput': throughput, 'capacity': capacity}
+
+
+def test_parse_target():
+    assert parse_target('12000 iops, 500 MBps, 1 TiB') == target(12000, 500, 1024)
+    assert parse_target('750 GiB') == target(capacity=750)
+    with pytest.raises(ValueError):
+        parse_target('12000 furlongs')
+    with pytest.raises(ValueError):
+        parse_target('fast please')
+
+
+def test_cheapest_layout():
+    layouts = plan_layouts(parse_target('12000 iops 500 MBps 1 TiB'))
+    assert format_layout(layouts[0]) == '4 x 256 GiB gp3 @ 3000 IOPS = 1024 GiB, 12000 IOPS, 500 MiB/s, $81.92/month'
+    # Eight disks cost the same, but fewer disks win the tie
+    assert (layouts[1]['disks'], layouts[1]['monthly_cost']) == (8, 81.92)
+    costs = [layout['monthly_cost'] for layout in layouts]
+    assert costs == sorted(costs)
+
+    layout = plan_layout(parse_target('60000 iops 1500 MBps 20000 GiB'))
+    assert format_layout(layout) == \
+        '8 x 2500 GiB gp3 @ 7500 IOPS, 188 MiB/s = 20000 GiB, 60000 IOPS, 1504 MiB/s, $1800.16/month'
+
+
+def test_io2_beyond_gp3():
+    layout = plan_layout(target(iops=100000), max_disks=1)
+    assert (layout['volume_type'], layout['size'], layout['iops']) == ('io2', 100, 100000)
+
+
+def test_gp3_iops_per_gib():
+    # 500 IOPS per GiB: 16000 IOPS need at least 32 GiB
+    assert cheapest_disk('gp3', 1, target(iops=16000)) == (32, 16000, None)
+    assert cheapest_disk('gp3', 1, target(iops=16001)) == (33, 16001, None)
+
+
+def test_gp3_throughput_per_iops():
+    # 0.25 MiB/s per IOPS: 1000 MiB/s need 4000 IOPS, and so 8 GiB
+    assert cheapest_disk('gp3', 1, target(throughput=1000)) == (8, 4000, 1000)
+    # The included 125 MiB/s is left unset
+    assert cheapest_disk('gp3', 1, target(throughput=125)) == (6, 3000, None)
+
+
+def test_gp3_limits():
+    limits = VOLUME_LIMITS['gp3']
+    assert (limits['max_size'], limits['max_iops'], limits['max_throughput']) == (65536, 80000, 2000)
+    assert SIZE_LIMITS['gp3'] == (1, 65536)
+    assert cheapest_disk('gp3', 1, target(80000, 2000, 65536)) == (65536, 80000, 2000)
+    assert cheapest_disk('gp3', 1, target(iops=80001)) is None
+    assert cheapest_disk('gp3', 1, target(throughput=2001)) is None
+    assert cheapest_disk('gp3', 1, target(capacity=65537)) is None
+
+    assert volume_problems('gp3', 65536, 80000, 2000) == []
+    assert len(volume_problems('gp3', 65537, 80001, 2001)) == 3
+
+
+def test_unreachable_target():
+    assert plan_layouts(target(iops=80000 * 8 + 1), volume_types=('gp3',)) == []
+    assert plan_layout(target(capacity=65536 * 8 + 1)) is None
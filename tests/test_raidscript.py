@@ -0,0 +1,124 @@
+"""RAID script generation, checked against volumes provisioned on the local EC2 stand-in"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ebs_core.api import ResilientClient  # noqa: E402
+from ebs_core.devices import DeviceAllocator  # noqa: E402
+from ebs_core.fake_ec2 import FakeEC2  # noqa: E402
+from ebs_core.pipeline import Pipeline  # noqa: E402
+from ebs_core.raidscript import nvme_serial, write_raid_scripts  # noqa: E402
+
+# (raid_set, disks)
+LAYOUT = [('SQL-Data', 4), ('SQL-Log', 2), ('SQL-Backup', 2), ('SQL-CommonFiles', 1)]
+
+
+@pytest.fixture(scope='module')
+def created_volumes():
+    """Provision LAYOUT on FakeEC2 and return ``(volume_id, disk_name, raid_set, device)`` per disk"""
+    fake = FakeEC2(create_delay=0.05, attach_delay=0.02, seed=1)
+    instance_id = fake.add_instance(name='sql-01')
+    az = fake.instances[instance_id]['Placement']['AvailabilityZone']
+    ec2 = ResilientClient(fake)
+    specs = []
+    for raid_set, count in LAYOUT:
+        for n in range(1, count + 1):
+            name = f"{raid_set}-Disk{n}" if count > 1 else raid_set
+            specs.append({'name': name, 'raid_set': raid_set, 'size': 100, 'volume_type': 'gp3'})
+    pipeline = Pipeline(ec2, instance_id, az, DeviceAllocator(ec2, instance_id),
+                        waiter_options={'base_delay': 0.01, 'max_delay': 0.05})
+    results = pipeline.run(specs)
+    assert [r['status'] for r in results] == ['attached'] * len(specs)
+    return [(r['volume_id'], spec['name'], spec['raid_set'], r['device']) for spec, r in zip(specs, results)]
+
+
+def read_scripts(paths):
+    scripts = {}
+    for path in paths:
+        with open(path, newline='') as f:
+            scripts[os.path.basename(path)] = f.read()
+    return scripts
+
+
+def volumes_of(created_volumes, raid_set):
+    return [volume for volume in created_volumes if volume[2] == raid_set]
+
+
+def test_linux_mdadm(created_volumes, tmp_path):
+    scripts = read_scripts(write_raid_scripts(created_volumes, str(tmp_path), 'linux', batch_id='b1'))
+    assert sorted(scripts) == ['raid-sql-backup.sh', 'raid-sql-commonfiles.sh', 'raid-sql-data.sh',
+                               'raid-sql-log.sh']
+    assert os.access(tmp_path / 'raid-sql-data.sh', os.X_OK)
+
+    data = scripts['raid-sql-data.sh']
+    for volume_id, _, _, device in volumes_of(created_volumes, 'SQL-Data'):
+        assert f'find_disk {nvme_serial(volume_id)} "{device}"' in data
+    assert '--level=0 --raid-devices=4 --chunk=64K' in data
+    assert 'mkfs.xfs -L sql-data -d su=64k,sw=4 /dev/md/sql-data' in data
+    assert 'batch b1' in data
+
+    log = scripts['raid-sql-log.sh']
+    assert '--raid-devices=2 --chunk=64K' in log
+    assert 'su=64k,sw=2' in log
+
+    backup = scripts['raid-sql-backup.sh']
+    assert '--raid-devices=2 --chunk=256K' in backup
+    assert 'su=256k,sw=2' in backup
+
+
+def test_linux_single_disk(created_volumes, tmp_path):
+    scripts = read_scripts(write_raid_scripts(created_volumes, str(tmp_path), 'linux'))
+    single = scripts['raid-sql-commonfiles.sh']
+    (volume_id, _, _, device), = volumes_of(created_volumes, 'SQL-CommonFiles')
+    assert f'find_disk {nvme_serial(volume_id)} "{device}"' in single
+    assert 'mkfs.xfs -L sql-commonfi "${DISKS[0]}"' in single
+    assert 'mdadm' not in single
+    assert 'su=' not in single
+
+
+def test_linux_lvm(created_volumes, tmp_path):
+    scripts = read_scripts(write_raid_scripts(created_volumes, str(tmp_path), 'linux', 'lvm'))
+    data = scripts['raid-sql-data.sh']
+    assert 'lvcreate --yes --stripes 4 --stripesize 64k' in data
+    assert 'su=64k,sw=4 /dev/vg_sql_data/lv_sql_data' in data
+    assert '--stripes 2 --stripesize 256k' in scripts['raid-sql-backup.sh']
+
+
+def test_windows_storage_spaces(created_volumes, tmp_path):
+    scripts = read_scripts(write_raid_scripts(created_volumes, str(tmp_path), 'windows'))
+    assert sorted(scripts) == ['raid-sql-backup.ps1', 'raid-sql-commonfiles.ps1', 'raid-sql-data.ps1',
+                               'raid-sql-log.ps1']
+
+    data = scripts['raid-sql-data.ps1']
+    assert '\r\n' in data
+    serials = ', '.join(f"'{nvme_serial(v[0])}'" for v in volumes_of(created_volumes, 'SQL-Data'))
+    assert f'$serials = @({serials})' in data
+    assert '-NumberOfColumns 4 -Interleave 65536' in data
+    assert '-AllocationUnitSize 65536' in data
+
+    backup = scripts['raid-sql-backup.ps1']
+    assert '-NumberOfColumns 2 -Interleave 262144' in backup
+    assert '-AllocationUnitSize 262144' in backup
+
+
+def test_windows_single_disk(created_volumes, tmp_path):
+    scripts = read_scripts(write_raid_scripts(created_volumes, str(tmp_path), 'windows'))
+    single = scripts['raid-sql-commonfiles.ps1']
+    (volume_id, _, _, _), = volumes_of(created_volumes, 'SQL-CommonFiles')
+    assert f"$serials = @('{nvme_serial(volume_id)}')" in single
+    assert 'New-StoragePool' not in single
+    assert 'Format-Volume -FileSystem NTFS -AllocationUnitSize 65536' in single
+
+
+def test_windows_diskpart(created_volumes, tmp_path):
+    scripts = read_scripts(write_raid_scripts(created_volumes, str(tmp_path), 'windows', 'diskpart'))
+    assert 'format fs=ntfs unit=64K' in scripts['raid-sql-data.ps1']
+    assert 'format fs=ntfs unit=256K' in scripts['raid-sql-backup.ps1']
+
+
+def test_unknown_tool(created_volumes, tmp_path):
+    with pytest.raises(ValueError):
+        write_raid_scripts(created_volumes, str(tmp_path), 'linux', 'storage-spaces')